@@ -25,14 +25,20 @@
 from __future__ import print_function, division
 
 import sys
-import os
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from operator import itemgetter
 
-from tables import decode_unk, opcodes
+from gsdisas.tables import opcodes, opcode_decoders, raw_decoders, NUM_OPCODES
+from gsdisas.layout import compile_renderers
+from gsdisas.operands import reg_names
+
+try:
+    _int_types = (int, long)
+except NameError:  # Python 3
+    _int_types = (int, )
 
 class EncodedInsn(object):
     def __init__(self, raw):
-        if type(raw) not in (int, long) or raw > 0xFFFFFFFF or raw < 0:
+        if type(raw) not in _int_types or raw > 0xFFFFFFFF or raw < 0:
             raise ValueError('invalid raw instruction')
         self.raw = raw
 
@@ -42,67 +48,200 @@ class EncodedInsn(object):
             assert 0 <= item.stop <= 32
             if item.step is not None:
                 raise NotImplementedError('stepping is not implemented')
-            return (((2 ** (item.stop - item.start) - 1) << item.start) & self.raw) >> item.start
+            return (self.raw >> item.start) & ((1 << (item.stop - item.start)) - 1)
         raise NotImplementedError()
 
     def __repr__(self):
         return 'EncodedInsn(raw=0x{:08X})'.format(self.raw)
 
 
-class DecodedInsn(object):
-    def __init__(self):
-        self.mnem = None
-        self.info = None
-        self.opcode = None
-        self.ops = None
+class DecodedInsn(tuple):
+    """
+    A decoded instruction, packed into an immutable tuple so instances can be
+    shared, e.g. by `DecodeCache`, between all occurrences of the same raw word.
+    Text is only rendered on request, from the raw word if known.
+    """
+    __slots__ = ()
+
+    mnem = property(itemgetter(0))
+    info = property(itemgetter(1))
+    opcode = property(itemgetter(2))
+    ops = property(itemgetter(3))
+    raw = property(itemgetter(4))
+
+    def __new__(cls, mnem=None, info=None, opcode=None, ops=None, raw=None):
+        return tuple.__new__(cls, (mnem, info, opcode, ops, raw))
+
+    def __reduce__(self):
+        return DecodedInsn, tuple(self)
 
     def textual(self):
-        return self.mnem.ljust(16) + ' ' + ', '.join([op.textual() for op in self.ops])
+        raw = self[4]
+        if raw is None:
+            return self.textual_from_ops()
+        return _renderers[raw >> 26](raw)
+
+    def textual_from_ops(self):
+        return self[0].ljust(16) + ' ' + ', '.join([op.textual() for op in self[3]])
 
     def __repr__(self):
         return 'DecodedInsn(mnem="{}", ops={})'.format(self.mnem, repr(self.ops))
 
 
+# Mnemonic and flags per opcode, undefined opcodes included
+_mnemonics = tuple(
+    opcodes[i][0] if i < len(opcodes) else 'ud_{:02X}'.format(i) for i in range(NUM_OPCODES)
+)
+_infos = tuple(opcodes[i][2] if i < len(opcodes) else None for i in range(NUM_OPCODES))
+
+
+def decode_raw(raw):
+    """Decodes a raw 32-bit instruction word into a `DecodedInsn`."""
+    opcode = raw >> 26
+    return DecodedInsn(_mnemonics[opcode], _infos[opcode], opcode, raw_decoders[opcode](raw), raw)
+
+
+# Per-opcode text renderers generated from the decoders' text templates
+_renderers = compile_renderers(
+    opcode_decoders,
+    [mnem.ljust(16) + ' ' for mnem in _mnemonics],
+    reg_names,
+    lambda raw: decode_raw(raw).textual_from_ops(),
+)
+
+
+def render_raw(raw):
+    """Renders the text line of a raw instruction word."""
+    return _renderers[raw >> 26](raw)
+
+
 class InsnDecoder(object):
     def __init__(self, encoded_insn):
         self.enc = encoded_insn
-        self.dec = DecodedInsn()
+        self.dec = None
 
     def decode(self):
-        self._dec_opcode()
-        self._dec_operands()
+        self.dec = decode_raw(self.enc.raw)
         return self.dec
 
-    def _dec_opcode(self):
-        self.dec.opcode = self.enc[26:32]
-        try:
-            self.dec.mnem = opcodes[self.dec.opcode][0]
-            self.dec.info = opcodes[self.dec.opcode][2]
-        except KeyError:
-            self.dec.mnem = 'ud_{:02X}'.format(self.dec.opcode)
 
-    def _dec_operands(self):
-        try:
-            decoder = opcodes[self.dec.opcode][1]
-        except IndexError:
-            decoder = decode_unk
-        self.dec.ops = decoder(self.enc)
+DEFAULT_CACHE_SIZE = 0x10000
+
+
+class DecodeCache(object):
+    """
+    Bounded cache handing out one shared `DecodedInsn` per distinct raw word.
+
+    Eviction approximates LRU with two generations: lookups are served from
+    the young generation, hits in the old one are promoted, and once the
+    young generation holds half of `maxsize` entries it replaces the old.
+    `decode` may be replaced to cache other per-word results.
+    """
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE, decode=decode_raw):
+        if maxsize < 2:
+            raise ValueError('cache size must be at least 2')
+        self.maxsize = maxsize
+        self._decode = decode
+        self.hits = 0
+        self.misses = 0
+        self._young = {}
+        self._old = {}
+
+    def decode(self, raw):
+        dec = self._young.get(raw)
+        if dec is not None:
+            self.hits += 1
+            return dec
+
+        dec = self._old.get(raw)
+        if dec is None:
+            self.misses += 1
+            dec = self._decode(raw)
+        else:
+            self.hits += 1
+        if len(self._young) >= self.maxsize // 2:
+            self._old = self._young
+            self._young = {}
+        self._young[raw] = dec
+        return dec
+
+    def clear(self):
+        self._young = {}
+        self._old = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._young) + len(self._old)
 
+    def __repr__(self):
+        return 'DecodeCache(maxsize={}, size={}, hits={}, misses={})'.format(
+            self.maxsize, len(self), self.hits, self.misses
+        )
 
-def main():
-    with open('gscodeseg.gsvm', 'rb') as f:
-        input = bytearray(f.read())
 
-    import struct
+def main(argv=None):
+    import argparse
     import time
+    from gsdisas.stream import map_segment, open_output, write_disassembly
+    from gsdisas.parallel import DEFAULT_SHARD_SIZE, parallel_disassemble
+
+    parser = argparse.ArgumentParser(description='Disassembles a GalaxyScript code segment.')
+    parser.add_argument('input', nargs='?', default='gscodeseg.gsvm', help='code segment file')
+    parser.add_argument('-o', '--output', default='disas.gsvmasm', help="output file, '-' for stdout")
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='worker processes, 0 for one per CPU')
+    parser.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE, help='bytes per worker shard')
+    parser.add_argument('--timings', action='store_true', help='print per-shard timings')
+    parser.add_argument(
+        '--format', choices=('text', 'columnar', 'jsonl'), default='text',
+        help='output format: disassembly text, memory mappable columnar binary or JSON lines',
+    )
+    parser.add_argument('--base', type=lambda x: int(x, 0), default=0, help='segment base address for exports')
+    parser.add_argument('--profile', metavar='REPORT', help='write an instrumentation report (JSON) and print a flat profile')
+    parser.add_argument('--profile-allocations', action='store_true', help='also trace allocations, slowing down')
+    args = parser.parse_args(argv)
+    if args.format != 'text' and args.jobs != 1:
+        parser.error('only text output supports multiple jobs')
+    if args.profile and args.jobs != 1:
+        parser.error('profiling needs a single job')
+    if args.format == 'columnar' and args.output == '-':
+        parser.error('columnar output needs a seekable file')
+
+    instrumentation = None
+    if args.profile:
+        from gsdisas.instrument import Instrumentation
+        instrumentation = Instrumentation(track_allocations=args.profile_allocations).start()
 
     start = time.time()
-    with open('disas.gsvmasm', 'w') as f:
-        for cur_offs in xrange(0, len(input), 4):
-            f.write(InsnDecoder(EncodedInsn(
-                struct.unpack('<I', input[cur_offs:cur_offs + 4])[0])
-            ).decode().textual() + '\n')
-    print('Disassembling took {} seconds.'.format(time.time() - start))
+    try:
+        if args.format == 'columnar':
+            from gsdisas.export import write_columnar
+            with map_segment(args.input) as buf, open(args.output, 'wb') as f:
+                write_columnar(buf, f, args.base)
+        elif args.format == 'jsonl':
+            from gsdisas.export import write_jsonl
+            with map_segment(args.input) as buf, open_output(args.output) as f:
+                write_jsonl(buf, f, args.base)
+        else:
+            # Opening the input first leaves no empty output behind if it is missing
+            with map_segment(args.input) as buf, open_output(args.output) as f:
+                if args.jobs == 1:
+                    write_disassembly(buf, f)
+                else:
+                    timings = parallel_disassemble(args.input, f, args.jobs or None, args.shard_size)
+                    if args.timings:
+                        for cur in timings:
+                            print('shard {:>5} @ 0x{:08X} ({} bytes): {:.3f} seconds'.format(*cur), file=sys.stderr)
+    except (ValueError, IOError) as e:
+        print('error: {}'.format(e), file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if instrumentation is not None:
+            instrumentation.stop()
+            with open(args.profile, 'w') as f:
+                instrumentation.write_json(f)
+            print(instrumentation.flat_profile(), file=sys.stderr)
+    print('Disassembling took {} seconds.'.format(time.time() - start), file=sys.stderr)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,3 @@
+from gsdisas import main
+
+main()
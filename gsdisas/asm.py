@@ -0,0 +1,198 @@
+"""
+    Assembler turning disassembly text back into GalaxyScript bytecode.
+
+    The MIT License (MIT)
+
+    Copyright (c) 2015 Joel Hoener <athre0z@zyantific.com>
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy
+    of this software and associated documentation files (the "Software"), to deal
+    in the Software without restriction, including without limitation the rights
+    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the Software is
+    furnished to do so, subject to the following conditions:
+    The above copyright notice and this permission notice shall be included in all
+    copies or substantial portions of the Software.
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+    SOFTWARE.
+"""
+
+
+from __future__ import print_function, division
+
+import io
+import struct
+import sys
+
+from gsdisas import _mnemonics
+from gsdisas.layout import compile_encoders
+from gsdisas.operands import Register, reg_names
+from gsdisas.tables import (
+    opcode_decoders, decode_insn_call, decode_insn_push, decode_store, decode_decref, decode_mov,
+)
+
+CHUNK_WORDS = 0x1000
+
+
+def _store_forms():
+    # Fields: value register, base register, immediate
+    forms = []
+    for prefix, imm in (('g', 0), ('s', 1), ('u', 2)):
+        forms.append((prefix + '::[{1:reg}], {0:reg}', {2: imm}, {0: Register.SP, 1: Register.BP}))
+        forms.append((prefix + '::[{1:reg}], #00h', {0: Register.SP, 2: imm}, {1: Register.BP}))
+    forms.append(('s::[bp+{2:hex}], {0:reg}', {1: Register.BP}, {0: Register.SP}))
+    forms.append(('s::[bp+{2:hex}], #00h', {0: Register.SP, 1: Register.BP}, {}))
+    return forms
+
+
+# Syntax forms of the decoders whose operand shape depends on field values,
+# as `(text, fixed, excluded)`, see `compile_encoders`. Within a form, a
+# field value the decoder would render differently is excluded.
+CONDITIONAL_FORMS = {
+    decode_insn_call: [
+        ('{1:hex}, {2:bool}', {0: 0}, {}),
+        ('{0:reg}, {2:bool}', {}, {0: 0}),
+    ],
+    decode_insn_push: [
+        ('{1:hex}', {0: Register.BP}, {}),
+        ('{0:reg}', {}, {0: Register.BP}),
+    ],
+    decode_store: _store_forms(),
+    decode_decref: [
+        ('s::[bp+{1:hex}]', {0: Register.BP}, {}),
+        ('s::[bp+{0:reg}+{1:hex}]', {}, {0: Register.BP}),
+    ],
+    decode_mov: [
+        ('{0:reg}, {1:reg}', {2: 0}, {}),
+        ('{0:reg}, {1:reg}+{2:hex}', {}, {2: 0}),
+    ],
+}
+
+
+def _build_encoders():
+    forms = []
+    owners = []
+    for opcode, decoder in enumerate(opcode_decoders):
+        if decoder.text is not None:
+            syntax = [(decoder.text, {}, {})]
+        else:
+            syntax = CONDITIONAL_FORMS[decoder]
+        for text, fixed, excluded in syntax:
+            forms.append((opcode, text, decoder.fields, fixed, excluded))
+            owners.append(opcode)
+    encoders = dict((mnem, []) for mnem in _mnemonics)
+    for opcode, encoder in zip(owners, compile_encoders(forms, reg_names)):
+        encoders[_mnemonics[opcode]].append(encoder)
+    return encoders
+
+
+# Per mnemonic list of `(regex, encode)` pairs, tried in order
+_encoders = _build_encoders()
+
+
+def assemble(line):
+    """
+    Encodes one line of disassembly, as rendered by `DecodedInsn.textual()`,
+    into its 32-bit instruction word. Bits the decoder ignores are zero.
+    Raises ValueError for text that doesn't denote an instruction.
+    """
+    parts = line.split(None, 1)
+    if not parts:
+        raise ValueError('empty line')
+    try:
+        encoders = _encoders[parts[0]]
+    except KeyError:
+        raise ValueError('unknown mnemonic {!r}'.format(parts[0]))
+    operands = parts[1].rstrip() if len(parts) > 1 else ''
+    matched = False
+    for regex, encode in encoders:
+        m = regex.match(operands)
+        if m is None:
+            continue
+        matched = True
+        try:
+            word = encode(m)
+        except KeyError as e:
+            raise ValueError('unknown register {} in {!r}'.format(e, line))
+        except ValueError as e:
+            raise ValueError('{} in {!r}'.format(e, line))
+        if word is not None:
+            return word
+    if matched:
+        raise ValueError('operands of {!r} can not be encoded'.format(line))
+    raise ValueError('invalid operands for {}: {!r}'.format(parts[0], operands))
+
+
+def iter_assemble(lines):
+    """
+    Lazily assembles a listing, yielding one word per instruction line.
+    Blank lines are skipped, errors name the offending line number.
+    """
+    for lineno, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield assemble(line)
+        except ValueError as e:
+            raise ValueError('line {}: {}'.format(lineno, e))
+
+
+def _pack(words):
+    return struct.pack('<{}I'.format(len(words)), *words)
+
+
+def write_assembly(lines, out, chunk_words=CHUNK_WORDS):
+    """
+    Assembles a listing to a binary stream of little endian words, handing
+    the output over in chunks of `chunk_words` words. Returns the number of
+    instructions written.
+    """
+    words = []
+    count = 0
+    for word in iter_assemble(lines):
+        words.append(word)
+        if len(words) == chunk_words:
+            out.write(_pack(words))
+            count += len(words)
+            del words[:]
+    if words:
+        out.write(_pack(words))
+        count += len(words)
+    return count
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Assembles GalaxyScript disassembly into bytecode.')
+    parser.add_argument('input', help="listing to assemble, '-' for stdin")
+    parser.add_argument('-o', '--output', required=True, help="code segment file, '-' for stdout")
+    args = parser.parse_args(argv)
+
+    if args.input == '-':
+        src = io.open(sys.stdin.fileno(), 'r', closefd=False)
+    else:
+        src = io.open(args.input, 'r')
+    try:
+        if args.output == '-':
+            out = io.open(sys.stdout.fileno(), 'wb', closefd=False)
+        else:
+            out = io.open(args.output, 'wb')
+        try:
+            count = write_assembly(src, out)
+        finally:
+            out.close()
+    except ValueError as e:
+        print('error: {}'.format(e), file=sys.stderr)
+        sys.exit(1)
+    finally:
+        src.close()
+    print('{} instructions assembled'.format(count), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
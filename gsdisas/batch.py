@@ -0,0 +1,107 @@
+"""
+    Vectorized batch decoding of GalaxyScript bytecode.
+
+    The MIT License (MIT)
+
+    Copyright (c) 2015 Joel Hoener <athre0z@zyantific.com>
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy
+    of this software and associated documentation files (the "Software"), to deal
+    in the Software without restriction, including without limitation the rights
+    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the Software is
+    furnished to do so, subject to the following conditions:
+    The above copyright notice and this permission notice shall be included in all
+    copies or substantial portions of the Software.
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+    SOFTWARE.
+"""
+
+
+from __future__ import print_function, division
+
+import numpy as np
+
+from gsdisas import decode_raw
+from gsdisas.layout import (
+    F_OPCODE, F_REG1, F_REG2, F_REG3, F_IMM21, F_IMM16, F_IMM8, F_CALL_R, CODE_SPACE, field_mask
+)
+from gsdisas.tables import opcodes, decode_cond_branch, decode_insn_jmp
+
+INSN_SIZE = 4
+NO_TARGET = -1
+
+# One record per instruction word
+INSN_DTYPE = np.dtype([
+    ('raw', '<u4'),
+    ('opcode', 'u1'),
+    ('reg1', 'u1'),
+    ('reg2', 'u1'),
+    ('reg3', 'u1'),
+    ('imm8', 'u1'),
+    ('imm16', '<u2'),
+    ('imm21', '<u4'),
+    ('call_r', 'u1'),
+    ('target', '<i8'),  # absolute IP-relative branch target or NO_TARGET
+])
+
+# Opcodes whose 21-bit immediate is an IP-relative code offset >> 2
+_branch_opcodes = np.zeros(1 << (F_OPCODE[1] - F_OPCODE[0]), dtype=bool)
+for i, cur_opcode in enumerate(opcodes):
+    _branch_opcodes[i] = cur_opcode[1] in (decode_cond_branch, decode_insn_jmp)
+
+
+def _extract(words, field):
+    return (words >> np.uint32(field[0])) & np.uint32(field_mask(field))
+
+
+def as_words(buf):
+    """
+    Views a buffer of little endian instruction words as an uint32 array.
+    Arrays, e.g. the `raw` column of a batch, are taken as they are.
+    """
+    if isinstance(buf, np.ndarray):
+        return np.asarray(buf, dtype='<u4')
+    if len(buf) % INSN_SIZE:
+        raise ValueError('buffer size is not a multiple of the instruction size')
+    return np.frombuffer(buf, dtype='<u4')
+
+
+def decode_batch(buf, base=0, start=0):
+    """
+    Decodes a code segment into a structured array of `INSN_DTYPE` records,
+    the instruction at index i being located at base + i * 4. Branch
+    targets wrap around within `CODE_SPACE` bytes from `base`, like the
+    instruction pointer of the emulator. A part of a segment starting at
+    instruction `start` is decoded with the segment's `base`, record i then
+    being the instruction at index start + i.
+    """
+    words = as_words(buf)
+    out = np.empty(len(words), dtype=INSN_DTYPE)
+    out['raw'] = words
+    out['opcode'] = _extract(words, F_OPCODE)
+    out['reg1'] = _extract(words, F_REG1)
+    out['reg2'] = _extract(words, F_REG2)
+    out['reg3'] = _extract(words, F_REG3)
+    out['imm8'] = _extract(words, F_IMM8)
+    out['imm16'] = _extract(words, F_IMM16)
+    out['imm21'] = _extract(words, F_IMM21)
+    out['call_r'] = _extract(words, F_CALL_R)
+
+    next_offset = (start + 1 + np.arange(len(words), dtype=np.int64)) * INSN_SIZE
+    out['target'] = np.where(
+        _branch_opcodes[out['opcode']],
+        base + (next_offset + (out['imm21'].astype(np.int64) << 2)) % CODE_SPACE,
+        NO_TARGET,
+    )
+    return out
+
+
+def row_to_insn(row):
+    """Turns a record of a batch into a full `DecodedInsn`."""
+    return decode_raw(int(row['raw']))
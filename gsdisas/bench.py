@@ -0,0 +1,329 @@
+"""
+    Benchmarks for the GalaxyScript disassembler.
+
+    The MIT License (MIT)
+
+    Copyright (c) 2015 Joel Hoener <athre0z@zyantific.com>
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy
+    of this software and associated documentation files (the "Software"), to deal
+    in the Software without restriction, including without limitation the rights
+    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the Software is
+    furnished to do so, subject to the following conditions:
+    The above copyright notice and this permission notice shall be included in all
+    copies or substantial portions of the Software.
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+    SOFTWARE.
+"""
+
+
+from __future__ import print_function, division
+
+import json
+import os
+import platform
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+from gsdisas import decode_raw, render_raw
+from gsdisas.stream import map_segment, iter_words
+from gsdisas.synth import SegmentGenerator
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+REPORT_VERSION = 1
+
+# Iterations of the loop the emulator stages execute, three instructions each
+LOOP_ITERATIONS = 1000000
+# Instructions executed by the loop, including its setup and return
+LOOP_STEPS = 3 + 3 * LOOP_ITERATIONS + 1
+
+
+def deep_sizeof(roots):
+    """
+    Sums up the size of all distinct objects reachable from `roots` through
+    containers, instance dicts and slots. Shared objects are counted once.
+    """
+    seen = set()
+    total = 0
+    pending = list(roots)
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen or isinstance(obj, type):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            pending.extend(obj.keys())
+            pending.extend(obj.values())
+        elif isinstance(obj, (tuple, list)):
+            pending.extend(obj)
+        if hasattr(obj, '__dict__'):
+            pending.append(obj.__dict__)
+        for cls in type(obj).__mro__:
+            for slot in cls.__dict__.get('__slots__', ()):
+                if hasattr(obj, slot):
+                    pending.append(getattr(obj, slot))
+    return total
+
+
+def bench_memory(words):
+    """Returns the retained bytes per decoded instruction for `words`."""
+    insns = [decode_raw(word) for word in words]
+    return deep_sizeof([insns]) / max(len(insns), 1)
+
+
+def _peak_rss_kb(who=None):
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF if who is None else who).ru_maxrss
+
+
+# Benchmark stages, each taking the word list and the segment file path
+def stage_decode(words, path):
+    for word in words:
+        decode_raw(word)
+
+
+def stage_render(words, path):
+    for word in words:
+        render_raw(word)
+
+
+def stage_decode_render(words, path):
+    for word in words:
+        decode_raw(word).textual_from_ops()
+
+
+def stage_ingest(words, path):
+    with map_segment(path) as buf:
+        for _ in iter_words(buf):
+            pass
+
+
+def stage_ingest_legacy(words, path):
+    # The original ingestion, unpacking a copied slice per word
+    with open(path, 'rb') as f:
+        buf = bytearray(f.read())
+    for offset in range(0, len(buf), 4):
+        struct.unpack('<I', buf[offset:offset + 4])[0]
+
+
+def stage_end_to_end(words, path):
+    # Runs the CLI in a child process so its peak memory can be told apart.
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))] +
+        ([env['PYTHONPATH']] if env.get('PYTHONPATH') else [])
+    )
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(
+            [sys.executable, '-m', 'gsdisas', path, '-o', path + '.gsvmasm'], env=env, stderr=devnull
+        )
+
+
+def _ida_session(path):
+    # The processor module runs against the headless IDA stand-in.
+    from gsdisas import idasim
+    idasim.install()
+    from gsdisas.idaprocmod import PROCESSOR_ENTRY
+    with open(path, 'rb') as f:
+        buf = f.read()
+    return idasim, idasim.open_database(buf, 0, PROCESSOR_ENTRY())
+
+
+def _loop_program():
+    # Sums up the counter from LOOP_ITERATIONS down to 1
+    from gsdisas.asm import assemble
+    lines = [
+        'ld_const_i21 r1, #{:X}h'.format(LOOP_ITERATIONS),
+        'ld_const_i21 r2, #00h',
+        'ld_const_i21 r3, #01h',
+        'add r2, r1, r2',
+        'sub r1, r3, r1',
+        'jnz r1, c::[+#7FFFF4h]',
+        'retn #00h',
+    ]
+    return struct.pack('<{}I'.format(len(lines)), *[assemble(line) for line in lines])
+
+
+def stage_emu_loop(words, path):
+    from gsdisas.emu import Emulator
+    Emulator(_loop_program()).call(0)
+
+
+def stage_translate_loop(words, path):
+    from gsdisas.translate import TranslatingEmulator
+    TranslatingEmulator(_loop_program()).call(0)
+
+
+def stage_ida_auto(words, path):
+    api, db = _ida_session(path)
+    api.auto_mark_range(db.start, db.end)
+    api.auto_wait()
+
+
+def stage_ida_bulk(words, path):
+    from gsdisas.idabulk import preanalyze_segment
+    api, db = _ida_session(path)
+    preanalyze_segment(db.start, db.end, api)
+
+
+STAGES = [
+    ('ingest', stage_ingest),
+    ('ingest_legacy', stage_ingest_legacy),
+    ('decode', stage_decode),
+    ('render', stage_render),
+    ('decode_render', stage_decode_render),
+    ('end_to_end', stage_end_to_end),
+    ('ida_auto', stage_ida_auto),
+    ('ida_bulk', stage_ida_bulk),
+    ('emu_loop', stage_emu_loop),
+    ('translate_loop', stage_translate_loop),
+]
+
+# Stages run unless others are asked for
+DEFAULT_STAGES = ('ingest', 'decode', 'render', 'decode_render', 'end_to_end', 'emu_loop', 'translate_loop')
+
+# Stages executing the loop program rather than processing the segment
+LOOP_STAGES = ('emu_loop', 'translate_loop')
+
+
+def run_stage(stage, words, path, repeat=3, num_insns=None):
+    """
+    Runs a stage `repeat` times, returning the best time, the resulting
+    throughput and the growth of the peak resident set size in KiB. Stages
+    running in child processes report the children's peak instead.
+    """
+    best = None
+    rss_before = _peak_rss_kb()
+    for _ in range(repeat):
+        start = time.time()
+        stage(words, path)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    rss_after = _peak_rss_kb()
+    result = {
+        'seconds': best,
+        'insns_per_sec': (len(words) if num_insns is None else num_insns) / best if best else None,
+        'peak_rss_growth_kb': rss_after - rss_before if rss_before is not None else None,
+    }
+    if stage is stage_end_to_end:
+        result['child_peak_rss_kb'] = _peak_rss_kb(getattr(resource, 'RUSAGE_CHILDREN', None))
+    return result
+
+
+def run_suite(path, repeat=3, stages=None):
+    """Benchmarks the segment stored at `path`, returning the JSON report."""
+    num_insns = os.path.getsize(path) // 4
+    if stages is None:
+        stages = DEFAULT_STAGES
+    report = {
+        'version': REPORT_VERSION,
+        'python': platform.python_version(),
+        'instructions': num_insns,
+        'repeat': repeat,
+        'stages': {},
+    }
+    # Child processes inherit our peak RSS on fork, so the end-to-end stage
+    # runs before the word list is loaded.
+    if 'end_to_end' in stages:
+        report['stages']['end_to_end'] = run_stage(stage_end_to_end, None, path, repeat, num_insns)
+
+    with map_segment(path) as buf:
+        words = list(iter_words(buf))
+    for name, stage in STAGES:
+        if stage is not stage_end_to_end and name in stages:
+            report['stages'][name] = run_stage(
+                stage, words, path, repeat, LOOP_STEPS if name in LOOP_STAGES else None
+            )
+    report['memory'] = {'bytes_per_insn': bench_memory(words)}
+    return report
+
+
+def compare(report, baseline, tolerance=0.1):
+    """
+    Lists the stages whose throughput dropped more than `tolerance` (as a
+    fraction) below the baseline report.
+    """
+    regressions = []
+    for name, cur in report['stages'].items():
+        base = baseline.get('stages', {}).get(name)
+        if not base or not base.get('insns_per_sec') or not cur['insns_per_sec']:
+            continue
+        ratio = cur['insns_per_sec'] / base['insns_per_sec']
+        if ratio < 1 - tolerance:
+            regressions.append((name, ratio))
+    return regressions
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmarks the disassembler.')
+    parser.add_argument('input', nargs='?', help='code segment file, generated if omitted')
+    parser.add_argument('-n', '--insns', type=int, default=1 << 20, help='instructions to generate')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='generator seed')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='runs per stage, best is reported')
+    parser.add_argument('--stage', action='append', choices=[x[0] for x in STAGES], help='stages to run, defaults to all but ingest_legacy and the ida_* ones')
+    parser.add_argument('--json', help="write the report to a file, '-' for stdout")
+    parser.add_argument('--baseline', help='report to compare against, fails on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed throughput drop')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='gsdisas-bench-')
+    try:
+        path = os.path.join(workdir, 'segment.gsvm')
+        if args.input:
+            shutil.copyfile(args.input, path)
+        else:
+            with open(path, 'wb') as f:
+                SegmentGenerator(args.seed).write(f, args.insns)
+        report = run_suite(path, args.repeat, args.stage)
+    finally:
+        shutil.rmtree(workdir)
+    report['input'] = args.input
+    report['seed'] = None if args.input else args.seed
+
+    for name, cur in sorted(report['stages'].items()):
+        print('{:<14} {:>8.3f} s {:>12.0f} insns/s  peak rss +{} KiB{}'.format(
+            name, cur['seconds'], cur['insns_per_sec'], cur['peak_rss_growth_kb'],
+            ' (child {} KiB)'.format(cur['child_peak_rss_kb']) if 'child_peak_rss_kb' in cur else ''
+        ), file=sys.stderr)
+    print('memory         {:.1f} bytes per instruction'.format(
+        report['memory']['bytes_per_insn']
+    ), file=sys.stderr)
+    if all(name in report['stages'] for name in LOOP_STAGES):
+        print('translation    {:.2f}x the interpreted loop throughput'.format(
+            report['stages']['translate_loop']['insns_per_sec'] / report['stages']['emu_loop']['insns_per_sec']
+        ), file=sys.stderr)
+
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    elif args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for name, ratio in regressions:
+            print('regression: {} at {:.0%} of baseline throughput'.format(name, ratio), file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
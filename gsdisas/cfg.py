@@ -0,0 +1,184 @@
+"""
+    Control flow graph construction for GalaxyScript code segments.
+
+    The MIT License (MIT)
+
+    Copyright (c) 2015 Joel Hoener <athre0z@zyantific.com>
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy
+    of this software and associated documentation files (the "Software"), to deal
+    in the Software without restriction, including without limitation the rights
+    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the Software is
+    furnished to do so, subject to the following conditions:
+    The above copyright notice and this permission notice shall be included in all
+    copies or substantial portions of the Software.
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+    SOFTWARE.
+"""
+
+
+from __future__ import print_function, division
+
+import numpy as np
+
+from gsdisas.batch import INSN_SIZE, NO_TARGET, decode_batch
+from gsdisas.tables import opcodes, NUM_OPCODES, OP_JUMP, OP_NFLW
+
+EDGE_FALL = 0
+EDGE_JUMP = 1
+
+# Opcode lookup tables of jumps and of instructions not flowing to the next one
+JUMP_OPCODES = np.zeros(NUM_OPCODES, dtype=bool)
+STOP_OPCODES = np.zeros(NUM_OPCODES, dtype=bool)
+for i, cur_opcode in enumerate(opcodes):
+    JUMP_OPCODES[i] = bool(cur_opcode[2] & OP_JUMP)
+    STOP_OPCODES[i] = bool(cur_opcode[2] & OP_NFLW)
+
+
+def _offsets(keys, num_keys):
+    """Returns the row offsets of the groups of equal `keys` once sorted."""
+    offsets = np.zeros(num_keys + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=num_keys), out=offsets[1:])
+    return offsets
+
+
+class ControlFlowGraph(object):
+    """
+    Basic blocks and edges of a code segment, stored as flat arrays. Blocks
+    are numbered in address order and cover the instruction index range
+    `[block_start[b], block_end[b])`. Edge `e` leads from `edge_src[e]` to
+    `edge_dst[e]` and is of kind `EDGE_FALL` or `EDGE_JUMP`; edges are sorted
+    by source block with `succ_offsets` indexing them per block, while
+    `pred_edges` lists edge indices sorted by destination block. The lookup
+    arrays are built when first needed.
+    """
+    def __init__(self, base, block_start, block_end, insn_block, edge_src, edge_dst, edge_kind):
+        self.base = base
+        self.block_start = block_start
+        self.block_end = block_end
+        self.insn_block = insn_block
+        self.edge_src = edge_src
+        self.edge_dst = edge_dst
+        self.edge_kind = edge_kind
+        self._succ_offsets = None
+        self._pred_edges = None
+        self._pred_offsets = None
+
+    @property
+    def succ_offsets(self):
+        if self._succ_offsets is None:
+            self._succ_offsets = _offsets(self.edge_src, self.num_blocks)
+        return self._succ_offsets
+
+    @property
+    def pred_edges(self):
+        if self._pred_edges is None:
+            self._pred_edges = np.argsort(self.edge_dst, kind='mergesort')
+        return self._pred_edges
+
+    @property
+    def pred_offsets(self):
+        if self._pred_offsets is None:
+            self._pred_offsets = _offsets(self.edge_dst, self.num_blocks)
+        return self._pred_offsets
+
+    @property
+    def num_blocks(self):
+        return len(self.block_start)
+
+    @property
+    def num_edges(self):
+        return len(self.edge_src)
+
+    def block_at(self, addr):
+        """Returns the index of the block containing `addr`."""
+        idx = (addr - self.base) // INSN_SIZE
+        if not 0 <= idx < len(self.insn_block):
+            raise IndexError('address 0x{:X} outside of segment'.format(addr))
+        return int(self.insn_block[idx])
+
+    def block_range(self, block):
+        """Returns the `[start, end)` address range of a block."""
+        return (
+            self.base + int(self.block_start[block]) * INSN_SIZE,
+            self.base + int(self.block_end[block]) * INSN_SIZE,
+        )
+
+    def successors(self, block):
+        return self.edge_dst[self.succ_offsets[block]:self.succ_offsets[block + 1]]
+
+    def predecessors(self, block):
+        edges = self.pred_edges[self.pred_offsets[block]:self.pred_offsets[block + 1]]
+        return self.edge_src[edges]
+
+    def __repr__(self):
+        return 'ControlFlowGraph(base=0x{:X}, blocks={}, edges={})'.format(
+            self.base, self.num_blocks, self.num_edges
+        )
+
+
+def build_cfg(insns, base=0):
+    """
+    Builds the control flow graph of a batch decoded segment (see
+    `gsdisas.batch.decode_batch`, which must have been given the same base).
+    Branches leaving the segment don't produce edges.
+    """
+    num_insns = len(insns)
+    if not num_insns:
+        empty = np.zeros(0, dtype=np.int64)
+        return ControlFlowGraph(
+            base, empty, empty, np.zeros(0, dtype=np.int32), empty, empty, np.zeros(0, dtype=np.uint8)
+        )
+
+    opcode = insns['opcode']
+    is_jump = JUMP_OPCODES[opcode]
+    is_term = is_jump | STOP_OPCODES[opcode]
+
+    # decode_batch() only produces instruction aligned targets
+    target = insns['target']
+    target_idx = (target - base) // INSN_SIZE
+    has_target = (target != NO_TARGET) & (target_idx >= 0) & (target_idx < num_insns)
+
+    # Leaders: the entry, every branch target and everything following a terminator
+    leaders = np.zeros(num_insns, dtype=bool)
+    leaders[0] = True
+    leaders[target_idx[has_target]] = True
+    after_term = np.flatnonzero(is_term[:-1]) + 1
+    leaders[after_term] = True
+
+    block_start = np.flatnonzero(leaders).astype(np.int64)
+    block_end = np.append(block_start[1:], num_insns)
+    insn_block = (np.cumsum(leaders, dtype=np.int32) - 1)
+    num_blocks = len(block_start)
+
+    last = block_end - 1
+    blocks = np.arange(num_blocks, dtype=np.int64)
+
+    jump_src = blocks[has_target[last] & is_jump[last]]
+    jump_dst = insn_block[target_idx[last[jump_src]]].astype(np.int64)
+
+    fall_src = blocks[~STOP_OPCODES[opcode[last]] & (block_end < num_insns)]
+    fall_dst = fall_src + 1
+
+    edge_src = np.concatenate([fall_src, jump_src])
+    edge_dst = np.concatenate([fall_dst, jump_dst])
+    edge_kind = np.concatenate([
+        np.full(len(fall_src), EDGE_FALL, dtype=np.uint8),
+        np.full(len(jump_src), EDGE_JUMP, dtype=np.uint8),
+    ])
+    order = np.argsort(edge_src, kind='mergesort')
+    return ControlFlowGraph(
+        base, block_start, block_end, insn_block, edge_src[order], edge_dst[order], edge_kind[order]
+    )
+
+
+def build_cfg_from_insns(insns, base=0):
+    """Builds the control flow graph of a sequence of `DecodedInsn` or raw words."""
+    words = np.array([getattr(x, 'raw', x) for x in insns], dtype='<u4')
+    return build_cfg(decode_batch(words.tobytes(), base), base)
@@ -0,0 +1,298 @@
+"""
+    Constant propagation over functions, resolving register-indirect calls.
+
+    The MIT License (MIT)
+
+    Copyright (c) 2015 Joel Hoener <athre0z@zyantific.com>
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy
+    of this software and associated documentation files (the "Software"), to deal
+    in the Software without restriction, including without limitation the rights
+    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the Software is
+    furnished to do so, subject to the following conditions:
+    The above copyright notice and this permission notice shall be included in all
+    copies or substantial portions of the Software.
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+    SOFTWARE.
+"""
+
+
+
+from __future__ import print_function, division
+
+import random
+import sys
+from collections import deque
+
+from gsdisas import render_raw
+from gsdisas.batch import INSN_SIZE, as_words, decode_batch
+from gsdisas.cfg import EDGE_JUMP, build_cfg
+from gsdisas.dataflow import insn_masks
+from gsdisas.emu import (
+    REGISTER_OPS, UNARY_OPS, FIXED_BITS, HOST_RETURN, Emulator, VmFault, _MASK, _div, _s32, _layouts, _handler_name
+)
+from gsdisas.functions import FunctionIndex
+from gsdisas.layout import F_OPCODE
+from gsdisas.operands import Register, reg_names
+
+DEFAULT_VERIFY_STEPS = 10000
+
+# Folding of instructions updating their first register from an immediate
+_IMMEDIATE_OPS = {
+    'add_i21': lambda x, imm: x + imm,
+    'add_lsh11': lambda x, imm: x + (imm << 11),
+    'mul_i21': lambda x, imm: x * imm,
+    'shl_i8': lambda x, imm: x << (imm & 31),
+    'shr_i8': lambda x, imm: x >> (imm & 31),
+}
+# Register operations over constant operands, GC handles never being constant
+_REGISTER_OPS = dict(
+    (mnem, eval('lambda x, y: ' + expr, {'_div': _div, '_s32': _s32, '_MASK': _MASK, 'FIXED_BITS': FIXED_BITS}))
+    for mnem, expr in REGISTER_OPS.items() if not mnem.endswith('_gc')
+)
+_REGISTER_OPS['shl_r'] = lambda x, y: x << (y & 31)
+_REGISTER_OPS['shr_r'] = lambda x, y: x >> (y & 31)
+_SHIFT_OPS = ('shl_r', 'shr_r')  # operating on the first register
+
+
+def _fold(state, name, a, b, c):
+    """Returns the constant an instruction sets its first register to, or None."""
+    if name == 'ld_const_i21':
+        return b
+    if name in _IMMEDIATE_OPS:
+        x = state.get(a)
+        return None if x is None else _IMMEDIATE_OPS[name](x, b)
+    if name in ('add_i8', 'mov'):
+        x = state.get(b)
+        return None if x is None else x + c
+    if name in _REGISTER_OPS:
+        if name in _SHIFT_OPS:
+            x, y = state.get(a), state.get(b)
+        else:
+            x, y = 0 if name in UNARY_OPS else state.get(c), state.get(b)
+        if x is None or y is None:
+            return None
+        try:
+            return _REGISTER_OPS[name](x, y)
+        except VmFault:
+            return None
+    return None
+
+
+def _meet(states):
+    state = dict(states[0])
+    for other in states[1:]:
+        for reg, value in list(state.items()):
+            if other.get(reg) != value:
+                del state[reg]
+    return state
+
+
+class Constants(object):
+    """
+    Constants of a function: `values` maps the index of each instruction
+    setting a register to a known constant to that value, `calls` maps the
+    index of each call site to its native index, None if unresolved. Indices
+    are instruction indices into the segment.
+    """
+    def __init__(self, values, calls):
+        self.values = values
+        self.calls = calls
+
+    def __repr__(self):
+        return 'Constants(values={}, calls={})'.format(len(self.values), len(self.calls))
+
+
+def propagate(buf, start, end, base=0):
+    """
+    Propagates constants through the instructions `[start, end)` of a code
+    segment, which are taken as a function entered at `start` with no
+    register known. Registers hold a constant at a block's entry if they
+    hold the same one on all already visited predecessors, blocks being
+    visited in address order and revisited only when their entry state
+    shrinks, so code without back edges takes a single pass. Conditional
+    branches on known registers only lead to the taken successor. Registers
+    defined by other instructions stop being known; natives are taken to
+    leave registers alone, `call` defining none.
+    """
+    words = as_words(buf)[start:end]
+    cfg = build_cfg(decode_batch(words, base, start), base + start * INSN_SIZE)
+    _, defs = insn_masks(words)
+    defs = defs.tolist()
+    decoded = []
+    for raw in words.tolist():
+        opcode = raw >> F_OPCODE[0]
+        (lo0, m0), (lo1, m1), (lo2, m2) = _layouts[opcode]
+        decoded.append((_handler_name(opcode, raw), (raw >> lo0) & m0, (raw >> lo1) & m1, (raw >> lo2) & m2))
+    block_start = cfg.block_start.tolist()
+    block_end = cfg.block_end.tolist()
+    succ_offsets = cfg.succ_offsets.tolist()
+    succs = cfg.edge_dst.tolist()
+    jumps = (cfg.edge_kind == EDGE_JUMP).tolist()
+    preds = [cfg.predecessors(block).tolist() for block in range(cfg.num_blocks)]
+
+    values = {}
+    calls = {}
+    outs = [None] * cfg.num_blocks
+    feasible = [frozenset()] * cfg.num_blocks
+    queued = set(range(cfg.num_blocks))
+    work = deque(range(cfg.num_blocks))
+    while work:
+        block = work.popleft()
+        queued.discard(block)
+        visited = [outs[pred] for pred in preds[block] if block in feasible[pred]]
+        state = _meet(visited) if visited and block else {}
+        for i in range(block_start[block], block_end[block]):
+            mask = defs[i]
+            name, a, b, c = decoded[i]
+            if name == 'call':
+                calls[start + i] = state.get(a) if a != 0 else b
+            if not mask:
+                continue
+            value = _fold(state, name, a, b, c)
+            while mask:
+                low = mask & -mask
+                state.pop(low.bit_length() - 1, None)
+                mask ^= low
+            if value is None:
+                values.pop(start + i, None)
+            else:
+                state[a] = values[start + i] = value & _MASK
+        # Branches on constants only pass their entry state on one way
+        edges = range(succ_offsets[block], succ_offsets[block + 1])
+        name, a, _, _ = decoded[block_end[block] - 1]
+        if name in ('jz', 'jnz') and a in state:
+            taken = (state[a] == 0) == (name == 'jz')
+            edges = [e for e in edges if jumps[e] == taken]
+        targets = frozenset(succs[e] for e in edges)
+        if state != outs[block] or targets != feasible[block]:
+            outs[block] = state
+            for succ in targets | feasible[block]:
+                if succ not in queued:
+                    queued.add(succ)
+                    work.append(succ)
+            feasible[block] = targets
+    return Constants(values, calls)
+
+
+def function_constants(index, func):
+    """Propagates constants through function `func` of a `FunctionIndex`."""
+    starts, ends = index.boundaries
+    return propagate(index.words, int(starts[func]), int(ends[func]), index.base)
+
+
+def verify(buf, start, end, constants=None, seed=0, max_steps=DEFAULT_VERIFY_STEPS, emulator=None):
+    """
+    Checks the constants of instructions `[start, end)` against the
+    emulator, running from `start` with random values in all registers but
+    bp and sp until control leaves the range, a fault occurs or `max_steps`
+    ran out. Natives do nothing. Returns `(index, expected, actual)` for
+    each executed instruction leaving its register at another value than
+    the propagated one.
+    """
+    if constants is None:
+        constants = propagate(buf, start, end)
+    vm = emulator or Emulator(buf, native_fallback=lambda vm, index: None)
+    rnd = random.Random(seed)
+    for reg in range(len(vm.regs)):
+        if reg not in (Register.BP, Register.SP):
+            vm.regs[reg] = rnd.randrange(_MASK + 1)
+    vm.frames = [(HOST_RETURN, vm.regs[Register.BP])]
+    words = as_words(buf)
+    mismatches = []
+    ip = start
+    for _ in range(max_steps):
+        if not start <= ip < end:
+            break
+        try:
+            next_ip = vm.run(ip, 1)
+        except VmFault:
+            break
+        expected = constants.values.get(ip)
+        if expected is not None:
+            raw = int(words[ip])
+            lo, mask = _layouts[raw >> F_OPCODE[0]][0]
+            actual = vm.regs[(raw >> lo) & mask] & _MASK
+            if actual != expected:
+                mismatches.append((ip, expected, actual))
+        ip = next_ip
+    return mismatches
+
+
+def iter_annotated(buf, constants, start, end, base=0):
+    """
+    Yields the text lines of instructions `[start, end)`, those setting a
+    register to a constant other than their immediate annotated with it and
+    call sites with their native index.
+    """
+    words = as_words(buf)
+    for i in range(start, end):
+        raw = int(words[i])
+        line = '0x{:08X}  {}'.format(base + i * INSN_SIZE, render_raw(raw))
+        value = constants.values.get(i)
+        opcode = raw >> F_OPCODE[0]
+        if i in constants.calls:
+            native = constants.calls[i]
+            line += '  ; native {}'.format('?' if native is None else '0x{:X}'.format(native))
+        elif value is not None and _handler_name(opcode, raw) != 'ld_const_i21':
+            line += '  ; {} = 0x{:08X}'.format(reg_names[(raw >> _layouts[opcode][0][0]) & 0x1F], value)
+        yield line
+
+
+def main(argv=None):
+    import argparse
+    from gsdisas.stream import map_segment
+
+    parser = argparse.ArgumentParser(description='Reports native calls, resolving register-indirect ones.')
+    parser.add_argument('input', help='code segment file')
+    parser.add_argument('--base', type=lambda x: int(x, 0), default=0, help='segment base address')
+    parser.add_argument('--annotate', action='store_true', help='print the annotated disassembly instead')
+    parser.add_argument(
+        '--verify', action='store_true',
+        help='check the constants against the emulator instead, reporting wrong ones',
+    )
+    parser.add_argument('--steps', type=int, default=DEFAULT_VERIFY_STEPS, help='instructions run per function when verifying')
+    args = parser.parse_args(argv)
+
+    with map_segment(args.input) as buf:
+        index = FunctionIndex(buf, args.base)
+        starts, ends = index.boundaries
+        counts = {}
+        unresolved = 0
+        mismatches = 0
+        vm = Emulator(buf, native_fallback=lambda vm, index: None) if args.verify else None
+        for func in range(len(index)):
+            constants = function_constants(index, func)
+            if args.verify:
+                start, end = int(starts[func]), int(ends[func])
+                for i, expected, actual in verify(index.words, start, end, constants, func, args.steps, vm):
+                    print('0x{:08X}  {}  ; 0x{:08X} instead of 0x{:08X}'.format(
+                        args.base + i * INSN_SIZE, render_raw(int(index.words[i])), actual, expected,
+                    ))
+                    mismatches += 1
+                continue
+            if args.annotate:
+                for line in iter_annotated(index.words, constants, int(starts[func]), int(ends[func]), args.base):
+                    print(line)
+                continue
+            for native in constants.calls.values():
+                if native is None:
+                    unresolved += 1
+                else:
+                    counts[native] = counts.get(native, 0) + 1
+    if args.verify:
+        print('{} wrong constants'.format(mismatches))
+        sys.exit(1 if mismatches else 0)
+    elif not args.annotate:
+        for native, count in sorted(counts.items()):
+            print('0x{:05X}  {}'.format(native, count))
+        print('{} calls unresolved'.format(unresolved))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,363 @@
+"""
+    Register liveness and reaching definitions over the control flow graph.
+
+    The MIT License (MIT)
+
+    Copyright (c) 2015 Joel Hoener <athre0z@zyantific.com>
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy
+    of this software and associated documentation files (the "Software"), to deal
+    in the Software without restriction, including without limitation the rights
+    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the Software is
+    furnished to do so, subject to the following conditions:
+    The above copyright notice and this permission notice shall be included in all
+    copies or substantial portions of the Software.
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+    SOFTWARE.
+"""
+
+
+
+from __future__ import print_function, division
+
+from collections import deque
+
+import numpy as np
+
+from gsdisas import decode_raw
+from gsdisas.batch import INSN_SIZE, as_words, decode_batch
+from gsdisas.cfg import build_cfg
+from gsdisas.layout import F_OPCODE, F_REG1, F_REG2, F_REG3, field_mask
+from gsdisas.operands import Register, Expression, Reference
+from gsdisas.tables import NUM_OPCODES, OP_USE1, OP_USE2, OP_USE3, OP_CHG1, OP_CHG2, OP_CHG3
+
+_USE_FLAGS = (OP_USE1, OP_USE2, OP_USE3)
+_CHG_FLAGS = (OP_CHG1, OP_CHG2, OP_CHG3)
+
+_BP = 1 << Register.BP
+_SP = 1 << Register.SP
+
+# Stack pointer effects the operand flags don't tell, as (use, def) masks
+IMPLICIT_REGS = {
+    'enter': (_SP, _BP | _SP),
+    'retn': (_BP, _BP | _SP),
+    'push': (_SP, _SP),
+    'push_local32': (_SP, _SP),
+    'pop': (_SP, _SP),
+}
+# Mnemonics whose register operand the VM ignores
+IGNORED_OPERANDS = frozenset(('enter', ))
+# Registers set up by the VM when entering code, and expected on exit
+ENTRY_DEFINED = _BP | _SP
+EXIT_LIVE = _BP | _SP
+
+# Definition site of registers undefined on entry
+UNDEFINED = -1
+
+
+def _operand_regs(op):
+    if isinstance(op, Register):
+        return 1 << op.idx
+    if isinstance(op, Expression):
+        return _operand_regs(op.lhs) | _operand_regs(op.rhs)
+    if isinstance(op, Reference):
+        return _operand_regs(op.expr)
+    return 0
+
+
+def register_masks(raw):
+    """
+    Returns the `(use, def)` register bitmasks of a raw instruction word.
+    Operands flagged OP_CHG define their register, registers of changed
+    memory operands being used for the address, and OP_USE operands use
+    all of their registers.
+    """
+    insn = decode_raw(raw)
+    use = defs = 0
+    if insn.info is None:
+        return use, defs
+    ops = () if insn.mnem in IGNORED_OPERANDS else insn.ops
+    for i, op in enumerate(ops[:3]):
+        regs = _operand_regs(op)
+        if insn.info & _USE_FLAGS[i]:
+            use |= regs
+        if insn.info & _CHG_FLAGS[i]:
+            if isinstance(op, Register):
+                defs |= regs
+            else:
+                use |= regs
+    implicit_use, implicit_def = IMPLICIT_REGS.get(insn.mnem, (0, 0))
+    return use | implicit_use, defs | implicit_def
+
+
+def _mask_tables():
+    """
+    Tabulates `register_masks` per opcode as a constant part and the part
+    contributed by each register field's value, probing every value with
+    two different fillings of the other fields.
+    """
+    fields = (F_REG1, F_REG2, F_REG3)
+    const = np.zeros((2, NUM_OPCODES), dtype=np.uint32)
+    table = np.zeros((2, NUM_OPCODES, len(fields), 32), dtype=np.uint32)
+
+    def word(opcode, values):
+        raw = opcode << F_OPCODE[0]
+        for field, value in zip(fields, values):
+            raw |= value << field[0]
+        return raw
+
+    for opcode in range(NUM_OPCODES):
+        masks = [register_masks(word(opcode, (fill, ) * len(fields))) for fill in (1, 2)]
+        const[:, opcode] = [masks[0][i] & masks[1][i] for i in range(2)]
+        for f in range(len(fields)):
+            for value in range(32):
+                fills = [x for x in (1, 2, 3) if x != value][:2]
+                bit = 1 << value
+                for i in range(2):
+                    if all(register_masks(word(opcode, [value if g == f else fill for g in range(len(fields))]))[i] & bit
+                           for fill in fills):
+                        table[i, opcode, f, value] = bit
+    return const, table
+
+_tables = None
+
+
+def insn_masks(words):
+    """Returns uint32 arrays of the use and def masks of instruction words."""
+    global _tables
+    if _tables is None:
+        _tables = _mask_tables()
+    const, table = _tables
+    words = as_words(words)
+    opcode = words >> np.uint32(F_OPCODE[0])
+    regs = [(words >> np.uint32(lo)) & np.uint32(field_mask((lo, hi))) for lo, hi in (F_REG1, F_REG2, F_REG3)]
+    masks = []
+    for i in range(2):
+        mask = const[i][opcode]
+        for f, reg in enumerate(regs):
+            mask |= table[i, opcode, f, reg]
+        masks.append(mask)
+    return tuple(masks)
+
+
+def _solve(gen, keep, init, src_offsets, sources, dep_offsets, dependents, order):
+    """
+    Worklist solver of `out[b] = gen[b] | (in[b] & keep[b])`, `in[b]` being
+    `init[b]` joined with `out` of the blocks in `sources[src_offsets[b]:
+    src_offsets[b + 1]]`. Blocks whose `out` changes requeue their
+    `dependents`. Arguments are lists, `order` giving the initial queue.
+    """
+    num_blocks = len(gen)
+    ins = list(init)
+    outs = [0] * num_blocks
+    queued = bytearray(b'\1' * num_blocks)
+    work = deque(order)
+    while work:
+        block = work.popleft()
+        queued[block] = 0
+        value = init[block]
+        for src in sources[src_offsets[block]:src_offsets[block + 1]]:
+            value |= outs[src]
+        ins[block] = value
+        value = gen[block] | (value & keep[block])
+        if value != outs[block]:
+            outs[block] = value
+            for dep in dependents[dep_offsets[block]:dep_offsets[block + 1]]:
+                if not queued[dep]:
+                    queued[dep] = 1
+                    work.append(dep)
+    return np.array(ins, dtype=np.uint32), np.array(outs, dtype=np.uint32)
+
+
+def _bits(masks, reg):
+    return (masks & np.uint32(1 << reg)) != 0
+
+
+class DataFlow(object):
+    """
+    Register dataflow of a code segment, all register sets being 32-bit
+    masks. Per instruction, `insn_use` and `insn_def` hold the registers
+    read and written; per block of the CFG, `block_use` holds those read
+    before being written and `block_def` those written.
+
+    Liveness gives `live_in` and `live_out` per block, blocks without
+    successors having EXIT_LIVE live out. Reaching definitions are solved
+    for the definitions on entry to blocks without predecessors, where all
+    registers but ENTRY_DEFINED are undefined: `undef_in` and `undef_out`
+    hold the registers possibly still undefined. Concrete definition sites
+    are resolved on demand by `reaching_definitions()`, so memory stays
+    linear in the number of blocks.
+    """
+    def __init__(self, cfg, insn_use, insn_def):
+        self.cfg = cfg
+        self.insn_use = insn_use
+        self.insn_def = insn_def
+        self._preds = cfg.edge_src[cfg.pred_edges].tolist()
+        self._pred_offsets = cfg.pred_offsets.tolist()
+
+        num_blocks = cfg.num_blocks
+        num_insns = len(insn_use)
+        pos = np.arange(num_insns, dtype=np.int64)
+        never = np.int64(num_insns)
+        block_use = np.zeros(num_blocks, dtype=np.uint32)
+        block_def = np.zeros(num_blocks, dtype=np.uint32)
+        if num_blocks:
+            for reg in range(32):
+                first_use = np.minimum.reduceat(np.where(_bits(insn_use, reg), pos, never), cfg.block_start)
+                first_def = np.minimum.reduceat(np.where(_bits(insn_def, reg), pos, never), cfg.block_start)
+                # An instruction reads its operands before writing its result
+                read_first = (first_use <= first_def) & (first_use < never)
+                block_use |= read_first.astype(np.uint32) << np.uint32(reg)
+                block_def |= (first_def < never).astype(np.uint32) << np.uint32(reg)
+        self.block_use = block_use
+        self.block_def = block_def
+
+        succs = cfg.edge_dst.tolist()
+        succ_offsets = cfg.succ_offsets.tolist()
+        keep = (~block_def).tolist()
+        has_succ = np.diff(cfg.succ_offsets) > 0
+        has_pred = np.diff(cfg.pred_offsets) > 0
+        self.live_out, self.live_in = _solve(
+            block_use.tolist(), keep, np.where(has_succ, 0, EXIT_LIVE).tolist(),
+            succ_offsets, succs, self._pred_offsets, self._preds, range(num_blocks - 1, -1, -1),
+        )
+        self.undef_in, self.undef_out = _solve(
+            [0] * num_blocks, keep, np.where(has_pred, 0, 0xFFFFFFFF & ~ENTRY_DEFINED).tolist(),
+            self._pred_offsets, self._preds, succ_offsets, succs, range(num_blocks),
+        )
+        self._live_after = None
+
+    @classmethod
+    def compute(cls, buf, base=0, cfg=None):
+        """Computes the dataflow of a code segment, building its CFG if not given."""
+        words = as_words(buf)
+        if cfg is None:
+            cfg = build_cfg(decode_batch(words, base), base)
+        insn_use, insn_def = insn_masks(words)
+        return cls(cfg, insn_use, insn_def)
+
+    @property
+    def live_after(self):
+        """Registers live after each instruction, computed when first needed."""
+        if self._live_after is None:
+            cfg = self.cfg
+            num_insns = len(self.insn_use)
+            insn_block = cfg.insn_block
+            block_end = cfg.block_end[insn_block]
+            pos = np.arange(num_insns, dtype=np.int64)
+            live = np.zeros(num_insns, dtype=np.uint32)
+            if not num_insns:
+                self._live_after = live
+                return live
+            for reg in range(32):
+                used = _bits(self.insn_use, reg)
+                # Next instruction after each one reading or writing the register
+                nxt = np.where(used | _bits(self.insn_def, reg), pos, num_insns)
+                nxt = np.append(np.minimum.accumulate(nxt[::-1])[::-1][1:], num_insns)
+                in_block = nxt < block_end
+                bit = np.where(
+                    in_block, used[np.minimum(nxt, num_insns - 1)], _bits(self.live_out, reg)[insn_block]
+                )
+                live |= bit.astype(np.uint32) << np.uint32(reg)
+            self._live_after = live
+        return self._live_after
+
+    def dead_stores(self):
+        """
+        Returns the indices of instructions defining registers none of which
+        is read afterwards. Stack pointer updates don't count.
+        """
+        defs = self.insn_def & np.uint32(~(_BP | _SP) & 0xFFFFFFFF)
+        return np.flatnonzero((defs != 0) & ((defs & self.live_after) == 0))
+
+    def uninitialized_uses(self):
+        """
+        Returns the indices of instructions reading registers possibly
+        undefined, and the masks of these registers.
+        """
+        cfg = self.cfg
+        num_insns = len(self.insn_use)
+        insn_block = cfg.insn_block
+        block_start = cfg.block_start[insn_block]
+        pos = np.arange(num_insns, dtype=np.int64)
+        undefined = np.zeros(num_insns, dtype=np.uint32)
+        for reg in range(32):
+            # Last instruction before each one writing the register
+            prev = np.maximum.accumulate(np.where(_bits(self.insn_def, reg), pos, -1))
+            prev = np.insert(prev[:-1], 0, -1)
+            bit = _bits(self.insn_use, reg) & (prev < block_start) & _bits(self.undef_in, reg)[insn_block]
+            undefined |= bit.astype(np.uint32) << np.uint32(reg)
+        sites = np.flatnonzero(undefined)
+        return sites, undefined[sites]
+
+    def _last_def(self, block, reg, end):
+        bit = 1 << reg
+        start = int(self.cfg.block_start[block])
+        for i in range(end - 1, start - 1, -1):
+            if self.insn_def[i] & bit:
+                return i
+        return None
+
+    def reaching_definitions(self, index, reg):
+        """
+        Returns the sorted indices of the instructions whose definitions of
+        register `reg` reach instruction `index`, UNDEFINED standing for the
+        register being undefined on entry.
+        """
+        block = int(self.cfg.insn_block[index])
+        site = self._last_def(block, reg, index)
+        if site is not None:
+            return [site]
+        bit = 1 << reg
+        preds = self._preds
+        offsets = self._pred_offsets
+        block_def = self.block_def
+        block_end = self.cfg.block_end
+        sites = set()
+        seen = set()
+        work = [block]
+        while work:
+            cur = work.pop()
+            if offsets[cur] == offsets[cur + 1] and not ENTRY_DEFINED & bit:
+                sites.add(UNDEFINED)
+            for pred in preds[offsets[cur]:offsets[cur + 1]]:
+                if pred in seen:
+                    continue
+                seen.add(pred)
+                if block_def[pred] & bit:
+                    sites.add(self._last_def(pred, reg, int(block_end[pred])))
+                else:
+                    work.append(pred)
+        return sorted(sites)
+
+
+def main(argv=None):
+    import argparse
+    from gsdisas import render_raw
+    from gsdisas.operands import reg_names
+    from gsdisas.stream import map_segment
+
+    parser = argparse.ArgumentParser(description='Reports dead stores and uses of undefined registers.')
+    parser.add_argument('input', help='code segment file')
+    parser.add_argument('--base', type=lambda x: int(x, 0), default=0, help='segment base address')
+    args = parser.parse_args(argv)
+
+    with map_segment(args.input) as buf:
+        words = as_words(buf)
+        flow = DataFlow.compute(words, args.base)
+        for index in flow.dead_stores():
+            print('0x{:08X}  {}  ; dead store'.format(args.base + index * INSN_SIZE, render_raw(int(words[index]))))
+        for index, mask in zip(*flow.uninitialized_uses()):
+            print('0x{:08X}  {}  ; undefined {}'.format(
+                args.base + index * INSN_SIZE, render_raw(int(words[index])),
+                ', '.join(reg_names[reg] for reg in range(32) if mask >> reg & 1),
+            ))
+
+if __name__ == '__main__':
+    main()
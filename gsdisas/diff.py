@@ -0,0 +1,232 @@
+"""
+    Incremental diffing of GalaxyScript code segments.
+
+    The MIT License (MIT)
+
+    Copyright (c) 2015 Joel Hoener <athre0z@zyantific.com>
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy
+    of this software and associated documentation files (the "Software"), to deal
+    in the Software without restriction, including without limitation the rights
+    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the Software is
+    furnished to do so, subject to the following conditions:
+    The above copyright notice and this permission notice shall be included in all
+    copies or substantial portions of the Software.
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+    SOFTWARE.
+"""
+
+
+from __future__ import print_function, division
+
+import difflib
+import hashlib
+from collections import namedtuple
+
+import numpy as np
+
+from gsdisas import decode_raw
+from gsdisas.batch import INSN_SIZE, as_words
+from gsdisas.functions import FunctionIndex
+
+COMPARE_CHUNK = 0x10000
+
+# `old` and `new` are `[start, end)` address ranges, None if not present
+FunctionChange = namedtuple('FunctionChange', 'old new changes')
+# `tag` is one of 'replace', 'insert' or 'delete' as used by difflib, the
+# instructions being `DecodedInsn` or None
+InsnChange = namedtuple('InsnChange', 'tag old_addr new_addr old new')
+
+
+def _common_prefix(a, b):
+    """Counts equal leading words, comparing chunk by chunk."""
+    n = min(len(a), len(b))
+    for lo in range(0, n, COMPARE_CHUNK):
+        hi = min(lo + COMPARE_CHUNK, n)
+        diff = np.flatnonzero(a[lo:hi] != b[lo:hi])
+        if len(diff):
+            return lo + int(diff[0])
+    return n
+
+
+class SegmentDiff(object):
+    """
+    Function level difference between two builds of a code segment, see
+    `diff_segments`. `added` and `removed` hold address ranges, `modified`
+    holds `FunctionChange` records and `moved` counts unchanged functions
+    found at a different address. `gaps` holds the `InsnChange` records of
+    changed instructions belonging to no function, e.g. following a `retn`.
+    """
+    def __init__(self, added, removed, modified, moved, changed_range, gaps=()):
+        self.added = added
+        self.removed = removed
+        self.modified = modified
+        self.moved = moved
+        self.changed_range = changed_range
+        self.gaps = list(gaps)
+
+    def __repr__(self):
+        return 'SegmentDiff(added={}, removed={}, modified={}, moved={}, gaps={})'.format(
+            len(self.added), len(self.removed), len(self.modified), self.moved, len(self.gaps)
+        )
+
+
+def _func_span(index, lo, hi):
+    """Returns the range of functions overlapping instruction indices [lo, hi)."""
+    starts, ends = index.boundaries
+    first = int(np.searchsorted(ends, lo, side='right'))
+    last = int(np.searchsorted(starts, hi, side='left'))
+    return first, max(first, last)
+
+
+def _func_words(index, func):
+    starts, ends = index.boundaries
+    return index.words[starts[func]:ends[func]]
+
+
+def _gap_indices(index, lo, hi):
+    """Returns the indices of the instructions in [lo, hi) belonging to no function."""
+    starts, ends = index.boundaries
+    owned = np.zeros(hi - lo, dtype=bool)
+    first, last = _func_span(index, lo, hi)
+    for func in range(first, last):
+        owned[max(int(starts[func]), lo) - lo:min(int(ends[func]), hi) - lo] = True
+    return lo + np.flatnonzero(~owned)
+
+
+def _insn_changes(old_words, new_words, old_addrs, new_addrs):
+    """Diffs two word arrays, the instructions being located at `old_addrs` and `new_addrs`."""
+    old_list = old_words.tolist()
+    new_list = new_words.tolist()
+    changes = []
+    matcher = difflib.SequenceMatcher(None, old_list, new_list, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        for k in range(max(i2 - i1, j2 - j1)):
+            i = i1 + k if i1 + k < i2 else None
+            j = j1 + k if j1 + k < j2 else None
+            changes.append(InsnChange(
+                tag,
+                old_addrs[i] if i is not None else None,
+                new_addrs[j] if j is not None else None,
+                decode_raw(old_list[i]) if i is not None else None,
+                decode_raw(new_list[j]) if j is not None else None,
+            ))
+    return changes
+
+
+def diff_segments(old, new, old_base=0, new_base=0):
+    """
+    Diffs two builds of a code segment. Identical leading and trailing
+    words are skipped with vectorized compares; only functions overlapping
+    the remaining region are hashed, aligned by content (so shifted
+    functions are matched up again) and, if modified, diffed and decoded
+    instruction by instruction. Instructions of the region outside of all
+    functions are diffed on their own.
+    """
+    old_words = as_words(old)
+    new_words = as_words(new)
+    prefix = _common_prefix(old_words, new_words)
+    max_suffix = min(len(old_words), len(new_words)) - prefix
+    suffix = _common_prefix(old_words[::-1][:max_suffix], new_words[::-1][:max_suffix])
+    old_hi = len(old_words) - suffix
+    new_hi = len(new_words) - suffix
+    if prefix == old_hi and prefix == new_hi:
+        return SegmentDiff([], [], [], 0, None)
+
+    old_index = FunctionIndex(old_words, old_base)
+    new_index = FunctionIndex(new_words, new_base)
+    old_lo, old_end = _func_span(old_index, prefix, old_hi)
+    new_lo, new_end = _func_span(new_index, prefix, new_hi)
+
+    def digests(index, lo, hi):
+        return [hashlib.sha1(_func_words(index, f).tobytes()).digest() for f in range(lo, hi)]
+
+    old_hashes = digests(old_index, old_lo, old_end)
+    new_hashes = digests(new_index, new_lo, new_end)
+
+    added = []
+    removed = []
+    modified = []
+    moved = 0
+    matcher = difflib.SequenceMatcher(None, old_hashes, new_hashes, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            moved += sum(
+                1 for k in range(i2 - i1)
+                if old_index.function_range(old_lo + i1 + k)[0] - old_base !=
+                new_index.function_range(new_lo + j1 + k)[0] - new_base
+            )
+            continue
+        pairs = min(i2 - i1, j2 - j1)
+        for k in range(pairs):
+            old_func, new_func = old_lo + i1 + k, new_lo + j1 + k
+            old_range = old_index.function_range(old_func)
+            new_range = new_index.function_range(new_func)
+            modified.append(FunctionChange(old_range, new_range, _insn_changes(
+                _func_words(old_index, old_func), _func_words(new_index, new_func),
+                range(old_range[0], old_range[1], INSN_SIZE), range(new_range[0], new_range[1], INSN_SIZE),
+            )))
+        for k in range(i1 + pairs, i2):
+            removed.append(old_index.function_range(old_lo + k))
+        for k in range(j1 + pairs, j2):
+            added.append(new_index.function_range(new_lo + k))
+
+    # Functions in the common suffix shift along with a length change
+    if old_hi - new_hi:
+        moved += len(old_index) - old_end
+
+    old_gaps = _gap_indices(old_index, prefix, old_hi)
+    new_gaps = _gap_indices(new_index, prefix, new_hi)
+    gaps = _insn_changes(
+        old_words[old_gaps], new_words[new_gaps],
+        (old_base + old_gaps * INSN_SIZE).tolist(), (new_base + new_gaps * INSN_SIZE).tolist(),
+    )
+
+    changed_range = (
+        (old_base + prefix * INSN_SIZE, old_base + old_hi * INSN_SIZE),
+        (new_base + prefix * INSN_SIZE, new_base + new_hi * INSN_SIZE),
+    )
+    return SegmentDiff(added, removed, modified, moved, changed_range, gaps)
+
+
+def main(argv=None):
+    import argparse
+    from gsdisas.stream import map_segment
+
+    parser = argparse.ArgumentParser(description='Diffs two builds of a code segment.')
+    parser.add_argument('old', help='old code segment file')
+    parser.add_argument('new', help='new code segment file')
+    args = parser.parse_args(argv)
+
+    with map_segment(args.old) as old, map_segment(args.new) as new:
+        result = diff_segments(old, new)
+    for start, end in result.removed:
+        print('- function 0x{:08X}..0x{:08X}'.format(start, end))
+    for start, end in result.added:
+        print('+ function 0x{:08X}..0x{:08X}'.format(start, end))
+    for change in result.modified:
+        print('~ function 0x{:08X}..0x{:08X} -> 0x{:08X}..0x{:08X}'.format(*(change.old + change.new)))
+        for insn in change.changes:
+            if insn.old is not None:
+                print('  - 0x{:08X}  {}'.format(insn.old_addr, insn.old.textual()))
+            if insn.new is not None:
+                print('  + 0x{:08X}  {}'.format(insn.new_addr, insn.new.textual()))
+    if result.gaps:
+        print('~ outside of functions')
+        for insn in result.gaps:
+            if insn.old is not None:
+                print('  - 0x{:08X}  {}'.format(insn.old_addr, insn.old.textual()))
+            if insn.new is not None:
+                print('  + 0x{:08X}  {}'.format(insn.new_addr, insn.new.textual()))
+    print('{} unchanged functions moved'.format(result.moved))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,293 @@
+"""
+    Batch driver disassembling many code segments with a worker pool.
+
+    The MIT License (MIT)
+
+    Copyright (c) 2015 Joel Hoener <athre0z@zyantific.com>
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy
+    of this software and associated documentation files (the "Software"), to deal
+    in the Software without restriction, including without limitation the rights
+    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the Software is
+    furnished to do so, subject to the following conditions:
+    The above copyright notice and this permission notice shall be included in all
+    copies or substantial portions of the Software.
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+    SOFTWARE.
+"""
+
+
+
+from __future__ import print_function, division
+
+import fnmatch
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from collections import namedtuple
+
+from gsdisas.stream import INSN_SIZE, map_segment, open_output, write_disassembly
+
+SUMMARY_VERSION = 1
+SUMMARY_NAME = 'summary.json'
+DEFAULT_PATTERN = '*.gsvm'
+HASH_CHUNK = 1 << 20
+
+# Output file suffix per format
+FORMATS = {'text': '.gsvmasm', 'jsonl': '.jsonl', 'columnar': '.gsvmcol'}
+
+# Outcome of one input: `duplicate_of` names the input whose output was
+# copied for segments identical to an earlier one, `error` is None on success.
+SegmentResult = namedtuple('SegmentResult', 'input output digest size seconds duplicate_of error')
+
+
+def iter_inputs(source, pattern=DEFAULT_PATTERN):
+    """
+    Yields the segment paths of a directory, searched recursively for
+    file names matching `pattern`, or of a manifest file listing one path
+    per line, relative to the manifest. Blank lines and '#' comments are
+    skipped.
+    """
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(fnmatch.filter(files, pattern)):
+                yield os.path.join(root, name)
+        return
+    root = os.path.dirname(os.path.abspath(source))
+    with open(source) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                yield os.path.join(root, line)
+
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def output_path(path, source, out_dir, fmt='text'):
+    """Returns where the output of an input goes, mirroring its path below `source`."""
+    base = source if os.path.isdir(source) else os.path.dirname(os.path.abspath(source))
+    rel = os.path.relpath(os.path.abspath(path), os.path.abspath(base))
+    if rel.startswith(os.pardir):
+        rel = os.path.basename(path)
+    return os.path.join(out_dir, rel + FORMATS[fmt])
+
+
+# Per-worker state, kept warm across the segments a worker processes: the
+# writer and its modules (compiled renderers, numpy for exports) load once.
+_worker = {}
+
+
+def _init_worker(fmt):
+    if fmt == 'text':
+        _worker['write'] = write_disassembly
+    elif fmt == 'jsonl':
+        from gsdisas.export import write_jsonl
+        _worker['write'] = write_jsonl
+    else:
+        from gsdisas.export import write_columnar
+        _worker['write'] = write_columnar
+    _worker['binary'] = fmt == 'columnar'
+
+
+def _process(task):
+    path, output = task
+    start = time.time()
+    try:
+        parent = os.path.dirname(output)
+        if parent and not os.path.isdir(parent):
+            try:
+                os.makedirs(parent)
+            except OSError:  # created by another worker meanwhile
+                if not os.path.isdir(parent):
+                    raise
+        with map_segment(path) as buf:
+            if len(buf) % INSN_SIZE:
+                raise ValueError('size {} is not a multiple of the instruction size'.format(len(buf)))
+            with open(output, 'wb') if _worker['binary'] else open_output(output) as f:
+                _worker['write'](buf, f)
+    except Exception as e:
+        return path, time.time() - start, '{}: {}'.format(type(e).__name__, e)
+    return path, time.time() - start, None
+
+
+def run_batch(paths, source, out_dir, jobs=None, fmt='text', report=None):
+    """
+    Disassembles the segments at `paths` into `out_dir` using a pool of
+    `jobs` worker processes (defaults to the CPU count; 1 runs in-process).
+    Identical segments are processed once, by content hash, the output
+    being copied for the others. Larger segments are dispatched first.
+    Paths listed more than once are taken once, inputs whose output would
+    overwrite that of an earlier one fail. Calls `report(result)` as
+    segments finish and returns the list of `SegmentResult` in input order.
+    """
+    results = {}
+    first_by_digest = {}
+    input_by_output = {}
+    seen = set()
+    unique = []
+    tasks = []
+    for path in paths:
+        if os.path.abspath(path) in seen:
+            continue
+        seen.add(os.path.abspath(path))
+        unique.append(path)
+        output = output_path(path, source, out_dir, fmt)
+        other = input_by_output.setdefault(os.path.abspath(output), path)
+        if other != path:
+            error = 'output {} collides with that of {}'.format(output, other)
+            results[path] = SegmentResult(path, output, None, None, 0.0, None, error)
+            if report is not None:
+                report(results[path])
+            continue
+        try:
+            size = os.path.getsize(path)
+            digest = file_digest(path)
+        except (IOError, OSError) as e:
+            results[path] = SegmentResult(path, output, None, None, 0.0, None, '{}: {}'.format(type(e).__name__, e))
+            if report is not None:
+                report(results[path])
+            continue
+        results[path] = SegmentResult(path, output, digest, size, 0.0, first_by_digest.get(digest), None)
+        if digest not in first_by_digest:
+            first_by_digest[digest] = path
+            tasks.append((size, path, output))
+    tasks = [(path, output) for _, path, output in sorted(tasks, key=lambda x: -x[0])]
+
+    def finished(path, seconds, error):
+        results[path] = results[path]._replace(seconds=seconds, error=error)
+        if report is not None:
+            report(results[path])
+
+    if jobs == 1:
+        _init_worker(fmt)
+        for task in tasks:
+            finished(*_process(task))
+    else:
+        pool = multiprocessing.Pool(jobs, _init_worker, (fmt,))
+        try:
+            for outcome in pool.imap_unordered(_process, tasks):
+                finished(*outcome)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    ordered = []
+    for path in unique:
+        result = results[path]
+        if result.duplicate_of is not None:
+            original = results[result.duplicate_of]
+            if original.error is not None:
+                error = 'duplicate of failed {}'.format(original.input)
+            else:
+                error = _copy(original.output, result.output)
+            result = results[path] = result._replace(error=error)
+            if report is not None:
+                report(result)
+        ordered.append(result)
+    return ordered
+
+
+def _copy(src, dst):
+    try:
+        parent = os.path.dirname(dst)
+        if parent and not os.path.isdir(parent):
+            os.makedirs(parent)
+        shutil.copyfile(src, dst)
+    except (IOError, OSError) as e:
+        return '{}: {}'.format(type(e).__name__, e)
+
+
+def summarize(results, seconds, jobs, fmt='text'):
+    """Returns the aggregate summary of a batch as a JSON serializable dict."""
+    processed = [r for r in results if r.duplicate_of is None and r.error is None]
+    total = sum(r.size for r in processed)
+    return {
+        'version': SUMMARY_VERSION,
+        'format': fmt,
+        'jobs': jobs,
+        'seconds': seconds,
+        'inputs': len(results),
+        'unique': sum(1 for r in results if r.duplicate_of is None and r.digest is not None),
+        'duplicates': sum(1 for r in results if r.duplicate_of is not None),
+        'succeeded': sum(1 for r in results if r.error is None),
+        'failed': sum(1 for r in results if r.error is not None),
+        'instructions': total // INSN_SIZE,
+        'instructions_per_second': total // INSN_SIZE / seconds if seconds else None,
+        'bytes_per_second': total / seconds if seconds else None,
+        'segments': [
+            {
+                'input': r.input,
+                'output': r.output if r.error is None else None,
+                'sha256': r.digest,
+                'size': r.size,
+                'seconds': r.seconds,
+                'duplicate_of': r.duplicate_of,
+                'status': 'error' if r.error is not None else 'ok',
+                'error': r.error,
+            }
+            for r in results
+        ],
+    }
+
+
+def _print_result(result):
+    if result.error is not None:
+        print('error {}: {}'.format(result.input, result.error), file=sys.stderr)
+    elif result.duplicate_of is not None:
+        print('dup   {} = {}'.format(result.input, result.duplicate_of), file=sys.stderr)
+    else:
+        print('ok    {} ({} bytes, {:.3f} seconds)'.format(result.input, result.size, result.seconds), file=sys.stderr)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Disassembles a batch of GalaxyScript code segments.')
+    parser.add_argument('source', help='directory of code segments or manifest file listing one per line')
+    parser.add_argument('-o', '--output-dir', default='disas', help='directory receiving one output per input')
+    parser.add_argument('-j', '--jobs', type=int, default=0, help='worker processes, 0 for one per CPU')
+    parser.add_argument('--pattern', default=DEFAULT_PATTERN, help='file name pattern when searching a directory')
+    parser.add_argument('--format', choices=sorted(FORMATS), default='text', help='output format')
+    parser.add_argument('--summary', help='summary file (JSON), defaults to {} in the output directory'.format(SUMMARY_NAME))
+    parser.add_argument('-q', '--quiet', action='store_true', help='only report failed segments')
+    args = parser.parse_args(argv)
+
+    paths = list(iter_inputs(args.source, args.pattern))
+    jobs = args.jobs or multiprocessing.cpu_count()
+    report = (lambda r: r.error is not None and _print_result(r)) if args.quiet else _print_result
+
+    start = time.time()
+    results = run_batch(paths, args.source, args.output_dir, jobs, args.format, report)
+    summary = summarize(results, time.time() - start, jobs, args.format)
+
+    summary_path = args.summary or os.path.join(args.output_dir, SUMMARY_NAME)
+    parent = os.path.dirname(summary_path)
+    if parent and not os.path.isdir(parent):
+        os.makedirs(parent)
+    with open(summary_path, 'w') as f:
+        json.dump(summary, f, indent=1)
+    print('{} inputs, {} unique, {} failed: {} instructions in {:.3f} seconds ({:.0f}/s) with {} jobs.'.format(
+        summary['inputs'], summary['unique'], summary['failed'], summary['instructions'],
+        summary['seconds'], summary['instructions_per_second'] or 0, jobs,
+    ), file=sys.stderr)
+    sys.exit(1 if summary['failed'] else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,510 @@
+"""
+    Emulator executing GalaxyScript bytecode from pre-decoded dispatch tables.
+
+    The MIT License (MIT)
+
+    Copyright (c) 2015 Joel Hoener <athre0z@zyantific.com>
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy
+    of this software and associated documentation files (the "Software"), to deal
+    in the Software without restriction, including without limitation the rights
+    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the Software is
+    furnished to do so, subject to the following conditions:
+    The above copyright notice and this permission notice shall be included in all
+    copies or substantial portions of the Software.
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+    SOFTWARE.
+"""
+
+
+from __future__ import print_function, division
+
+import struct
+import sys
+from itertools import count, islice
+
+from gsdisas.layout import F_OPCODE, F_IMM21, field_mask
+from gsdisas.operands import Register
+from gsdisas.stream import iter_words
+from gsdisas.tables import opcodes, opcode_decoders, NUM_OPCODES
+
+# Where GSVM.md is silent, the emulator assumes the following: the stack
+# grows upwards from STACK_BASE, bp and sp holding unified addresses.
+# `enter` starts a frame of its immediate's size at sp, `retn` drops the
+# frame plus its immediate in bytes of arguments and `pop` releases its
+# size in bytes. Return addresses and saved frame pointers are kept on a
+# host side control stack, as bytecode only calls natives. Operations of
+# three register instructions are `lhs op rhs` with lhs in the third field.
+# Fixed-point values have FIXED_BITS fractional bits. Branch targets wrap
+# around within the 23-bit code address space the offsets span, which
+# makes large offsets jump backwards.
+STACK_BASE = 0x1000000
+DEFAULT_GLOBAL_SIZE = 1 << 20
+DEFAULT_STACK_SIZE = 1 << 20
+FIXED_BITS = 11
+
+# Return address of frames entered from the host
+HOST_RETURN = -1
+
+_MASK = 0xFFFFFFFF
+_IP_MASK = field_mask(F_IMM21)
+_u32 = struct.Struct('<I')
+
+
+def _s32(value):
+    return value - 0x100000000 if value & 0x80000000 else value
+
+
+def _div(lhs, rhs):
+    # C semantics: truncation towards zero, remainder takes the dividend's sign
+    lhs = _s32(lhs)
+    rhs = _s32(rhs)
+    if rhs == 0:
+        raise VmFault('e_divByZero')
+    if lhs == -0x80000000 and rhs == -1:
+        raise VmFault('e_numericOverflow')
+    quot = abs(lhs) // abs(rhs)
+    if (lhs < 0) != (rhs < 0):
+        quot = -quot
+    return quot, lhs - quot * rhs
+
+
+class VmFault(RuntimeError):
+    """
+    Aborted execution, `code` naming the error like the VM does, e.g.
+    'e_divByZero'. `ip` is the instruction index the fault occurred at.
+    """
+    def __init__(self, code, ip=None):
+        super(VmFault, self).__init__(code)
+        self.code = code
+        self.ip = ip
+
+    def __str__(self):
+        if self.ip is None:
+            return self.code
+        return '{} at instruction {}'.format(self.code, self.ip)
+
+
+# Register operations, as expressions over lhs `x` and rhs `y`
+REGISTER_OPS = {
+    'add': 'x + y',
+    'and': 'x & y',
+    'or': 'x | y',
+    'xor': 'x ^ y',
+    'sub': 'x - y',
+    'mul': 'x * y',
+    'div': '_div(x, y)[0]',
+    'mod': '_div(x, y)[1]',
+    'fmul': '(_s32(x) * _s32(y)) >> FIXED_BITS',
+    'fdiv': '_div((_s32(x) << FIXED_BITS) & _MASK, y)[0]',
+    'seteq': 'x == y',
+    'setneq': 'x != y',
+    'setge': '_s32(x) >= _s32(y)',
+    'setge_inv': '_s32(x) < _s32(y)',
+    'seteq_gc': 'objects.get(x, x) == objects.get(y, y)',
+    'setneq_gc': 'objects.get(x, x) != objects.get(y, y)',
+    'not': '~y',
+    'neg': '-y',
+    'seteq0': 'y == 0',
+}
+UNARY_OPS = ('not', 'neg', 'seteq0')  # operand in the second field
+
+
+def _make_handlers(vm):
+    """
+    Returns the instruction handlers of a machine, keyed by mnemonic. Each
+    takes the up to three decoder fields and the instruction index and
+    returns the index of the next instruction.
+    """
+    regs = vm.regs
+    mem_global = vm.globals
+    mem_stack = vm.stack
+    frames = vm.frames
+    objects = vm.objects
+    natives = vm.natives
+    unpack_from = _u32.unpack_from
+    pack_into = _u32.pack_into
+    bp = Register.BP
+    sp = Register.SP
+
+    def space(addr, stack):
+        if stack:
+            return mem_stack, addr - STACK_BASE
+        return mem_global, addr
+
+    def load32(mem, off):
+        if 0 <= off <= len(mem) - 4:
+            return unpack_from(mem, off)[0]
+        raise VmFault('e_badMemoryAccess')
+
+    def load8(mem, off):
+        if 0 <= off < len(mem):
+            return mem[off]
+        raise VmFault('e_badMemoryAccess')
+
+    def store32(mem, off, value):
+        if 0 <= off <= len(mem) - 4:
+            pack_into(mem, off, value)
+            return
+        raise VmFault('e_badMemoryAccess')
+
+    def store8(mem, off, value):
+        if 0 <= off < len(mem):
+            mem[off] = value & 0xFF
+            return
+        raise VmFault('e_badMemoryAccess')
+
+    def push(value):
+        store32(mem_stack, regs[sp] - STACK_BASE, value)
+        regs[sp] = regs[sp] + 4
+
+    source = []
+    for mnem, expr in sorted(REGISTER_OPS.items()):
+        lhs = '0' if mnem in UNARY_OPS else 'regs[c]'
+        source.append(
+            'def op_{0}(a, b, c, ip):\n'
+            '    x = {1}\n'
+            '    y = regs[b]\n'
+            '    regs[a] = ({2}) & _MASK\n'
+            '    return ip + 1\n'.format(mnem, lhs, expr)
+        )
+    namespace = {
+        'regs': regs, 'objects': objects, '_div': _div, '_s32': _s32, '_MASK': _MASK,
+        'FIXED_BITS': FIXED_BITS,
+    }
+    exec(compile('\n'.join(source), '<gsvm-handlers>', 'exec'), namespace)
+    h = dict((mnem, namespace['op_' + mnem]) for mnem in REGISTER_OPS)
+
+    def strcat(a, b, c, ip):
+        regs[a] = vm.new_object(objects.get(regs[c], b'') + objects.get(regs[b], b''))
+        return ip + 1
+    h['strcat'] = strcat
+
+    def add_i21(a, b, c, ip):
+        regs[a] = (regs[a] + b) & _MASK
+        return ip + 1
+    h['add_i21'] = add_i21
+
+    def add_lsh11(a, b, c, ip):
+        regs[a] = (regs[a] + (b << 11)) & _MASK
+        return ip + 1
+    h['add_lsh11'] = add_lsh11
+
+    def mul_i21(a, b, c, ip):
+        regs[a] = (regs[a] * b) & _MASK
+        return ip + 1
+    h['mul_i21'] = mul_i21
+
+    def add_imm(a, b, c, ip):
+        regs[a] = (regs[b] + c) & _MASK
+        return ip + 1
+    h['add_i8'] = add_imm
+    h['mov'] = add_imm
+
+    def ld_const_i21(a, b, c, ip):
+        regs[a] = b
+        return ip + 1
+    h['ld_const_i21'] = ld_const_i21
+
+    def shl_r(a, b, c, ip):
+        regs[a] = (regs[a] << (regs[b] & 31)) & _MASK
+        return ip + 1
+    h['shl_r'] = shl_r
+
+    def shr_r(a, b, c, ip):
+        regs[a] = regs[a] >> (regs[b] & 31)
+        return ip + 1
+    h['shr_r'] = shr_r
+
+    def shl_i8(a, b, c, ip):
+        regs[a] = (regs[a] << (b & 31)) & _MASK
+        return ip + 1
+    h['shl_i8'] = shl_i8
+
+    def shr_i8(a, b, c, ip):
+        regs[a] = regs[a] >> (b & 31)
+        return ip + 1
+    h['shr_i8'] = shr_i8
+
+    def ckarbnds(a, b, c, ip):
+        value = _s32(regs[a])
+        if value < 0:
+            raise VmFault('e_arrayIndexUnderflow')
+        if value >= b:
+            raise VmFault('e_arrayIndexOverflow')
+        return ip + 1
+    h['ckarbnds'] = ckarbnds
+
+    def jz(a, b, c, ip):
+        return (ip + 1 + b) & _IP_MASK if regs[a] == 0 else ip + 1
+    h['jz'] = jz
+
+    def jnz(a, b, c, ip):
+        return (ip + 1 + b) & _IP_MASK if regs[a] != 0 else ip + 1
+    h['jnz'] = jnz
+
+    def jmp(a, b, c, ip):
+        return (ip + 1 + a) & _IP_MASK
+    h['jmp'] = jmp
+
+    def nop(a, b, c, ip):
+        return ip + 1
+    h['bp'] = nop
+    h['mkgc'] = nop
+
+    # Loads, `stack` telling the address space of non-unified references
+    def load(size, stack, indexed):
+        read = load32 if size == 4 else load8
+
+        def handler(a, b, c, ip):
+            addr = regs[b] + c if indexed else b
+            regs[a] = read(*space(addr, addr >= STACK_BASE if stack is None else stack))
+            return ip + 1
+        return handler
+
+    h['ld_global32i'] = load(4, False, False)
+    h['ld_global8i'] = load(1, False, False)
+    h['ld_local32'] = load(4, True, True)
+    h['ld_local8'] = load(1, True, True)
+    h['ld_global32'] = load(4, False, True)
+    h['ld_global8'] = load(1, False, True)
+    h['ld_mem32'] = load(4, None, True)
+    h['ld_mem8'] = load(1, None, True)
+
+    def ld_local32b(a, b, c, ip):
+        regs[a] = load32(mem_stack, regs[bp] + b - STACK_BASE)
+        return ip + 1
+    h['ld_local32b'] = ld_local32b
+
+    def store(size):
+        write = store32 if size == 4 else store8
+
+        def handler(a, b, c, ip):
+            value = regs[a] if a != sp else 0
+            if b == bp:
+                write(mem_stack, regs[bp] + c - STACK_BASE, value)
+            else:
+                addr = regs[b]
+                stack = c == 1 if c < 2 else addr >= STACK_BASE
+                mem, off = space(addr, stack)
+                write(mem, off, value)
+            return ip + 1
+        return handler
+
+    h['st_mem32'] = store(4)
+    h['st_mem8'] = store(1)
+    h['st_gc'] = store(4)
+
+    def decref(a, b, c, ip):
+        vm.decref(regs[bp] + (regs[a] if a != bp else 0) + b)
+        return ip + 1
+    h['decref'] = decref
+
+    def mkstr(a, b, c, ip):
+        end = mem_global.find(b'\0', b)
+        if end < 0:
+            raise VmFault('e_badMemoryAccess')
+        regs[a] = vm.new_object(bytes(mem_global[b:end]))
+        return ip + 1
+    h['mkstr'] = mkstr
+
+    def push_reg(a, b, c, ip):
+        push(regs[a])
+        return ip + 1
+    h['push'] = push_reg
+
+    def push_imm(a, b, c, ip):
+        push(b)
+        return ip + 1
+    h['push_imm'] = push_imm
+
+    def push_local32(a, b, c, ip):
+        push(load32(mem_stack, regs[bp] + b - STACK_BASE))
+        return ip + 1
+    h['push_local32'] = push_local32
+
+    def pop(a, b, c, ip):
+        regs[sp] = (regs[sp] - a) & _MASK
+        return ip + 1
+    h['pop'] = pop
+
+    def enter(a, b, c, ip):
+        regs[bp] = regs[sp]
+        regs[sp] = (regs[sp] + b) & _MASK
+        return ip + 1
+    h['enter'] = enter
+
+    def retn(a, b, c, ip):
+        if not frames:
+            raise VmFault('e_stackUnderflow')
+        regs[sp] = (regs[bp] - a) & _MASK
+        ret_ip, regs[bp] = frames.pop()
+        return ret_ip
+    h['retn'] = retn
+
+    def call(a, b, c, ip):
+        index = regs[a] if a != 0 else b
+        native = natives.get(index, vm.native_fallback)
+        if native is None:
+            raise VmFault('e_unknownNative')
+        native(vm, index)
+        return ip + 1
+    h['call'] = call
+
+    def unsupported(a, b, c, ip):
+        raise VmFault('e_unsupported')
+    for mnem in ('add_gc', 'sub_gc', 'unk_36'):
+        h[mnem] = unsupported
+
+    def invalid(a, b, c, ip):
+        raise VmFault('e_invalidOpcode')
+    h[None] = invalid
+
+    return h
+
+
+# Field positions of the decoder of each opcode, padded to three fields
+_layouts = [
+    tuple((lo, field_mask((lo, hi))) for lo, hi in decoder.fields) + ((0, 0), ) * (3 - len(decoder.fields))
+    for decoder in opcode_decoders
+]
+_mnemonics = [opcodes[i][0] if i < len(opcodes) else None for i in range(NUM_OPCODES)]
+_op_push = _mnemonics.index('push')
+_op_setge = _mnemonics.index('setge')
+
+
+def _handler_name(opcode, raw):
+    if opcode == _op_push and (raw >> 21) & 0x1F == Register.BP:
+        return 'push_imm'
+    if opcode == _op_setge and raw & 1:
+        return 'setge_inv'
+    return _mnemonics[opcode]
+
+
+class Emulator(object):
+    """
+    Executes a code segment. Instructions are decoded once into a dense
+    table of `(handler, field, field, field)` entries, the interpreter loop
+    only dispatching through it. Instruction pointers are instruction
+    indices into the segment.
+
+    Memory is backed by bytearrays: `globals` at address 0 and `stack` at
+    STACK_BASE. `natives` maps native indices to stubs called as
+    `stub(emulator, index)`, `native_fallback` serving unknown indices,
+    faulting if None. GC objects created by `mkstr` and `strcat` are kept
+    in `objects`, keyed by handle.
+    """
+    def __init__(self, buf, natives=None, global_size=DEFAULT_GLOBAL_SIZE,
+                 stack_size=DEFAULT_STACK_SIZE, native_fallback=None):
+        self.regs = [0] * 32
+        self.regs[Register.BP] = self.regs[Register.SP] = STACK_BASE
+        self.globals = bytearray(global_size)
+        self.stack = bytearray(stack_size)
+        self.frames = []
+        self.objects = {}
+        self.natives = dict(natives or {})
+        self.native_fallback = native_fallback
+        self.steps = 0
+        self._handlers = _make_handlers(self)
+        self.code = self._predecode(buf)
+
+    def _predecode(self, buf):
+        entries = {}
+        code = []
+        for raw in iter_words(buf):
+            entry = entries.get(raw)
+            if entry is None:
+                entry = entries[raw] = self._decode_entry(raw)
+            code.append(entry)
+        return code
+
+    def _decode_entry(self, raw):
+        opcode = raw >> F_OPCODE[0]
+        (lo0, m0), (lo1, m1), (lo2, m2) = _layouts[opcode]
+        return (
+            self._handlers[_handler_name(opcode, raw)],
+            (raw >> lo0) & m0, (raw >> lo1) & m1, (raw >> lo2) & m2,
+        )
+
+    def write_code(self, ip, words):
+        """Patches the instructions starting at index `ip` with raw `words`."""
+        words = list(words)
+        if ip < 0 or ip + len(words) > len(self.code):
+            raise ValueError('code write outside of the segment')
+        for i, raw in enumerate(words):
+            self.code[ip + i] = self._decode_entry(raw)
+        self.invalidate(ip, ip + len(words))
+
+    def invalidate(self, start, stop):
+        """Called after the instructions in `[start, stop)` changed."""
+
+    def new_object(self, value):
+        """Stores a GC object, returning its (non-zero) handle."""
+        handle = len(self.objects) + 1
+        self.objects[handle] = value
+        return handle
+
+    def decref(self, addr):
+        """Called by `decref` with the stack address of the released handle."""
+
+    def memory(self, addr, size):
+        """Returns a writable memoryview of `size` bytes at a unified address."""
+        if addr >= STACK_BASE:
+            mem, addr = self.stack, addr - STACK_BASE
+        else:
+            mem = self.globals
+        if addr < 0 or addr + size > len(mem):
+            raise VmFault('e_badMemoryAccess')
+        return memoryview(mem)[addr:addr + size]
+
+    def push(self, value):
+        sp = self.regs[Register.SP]
+        _u32.pack_into(self.memory(sp, 4), 0, value & _MASK)
+        self.regs[Register.SP] = sp + 4
+
+    def run(self, ip, max_steps=None):
+        """
+        Executes from instruction `ip` until the frame entered from the host
+        returns, or for at most `max_steps` instructions. Returns the index
+        of the next instruction, HOST_RETURN once returned.
+        """
+        code = self.code
+        limit = sys.maxsize if max_steps is None else max_steps
+        # Counting with the loop itself costs less than incrementing
+        steps = 0
+        try:
+            for steps in islice(count(), limit):
+                if ip < 0:
+                    break
+                handler, a, b, c = code[ip]
+                ip = handler(a, b, c, ip)
+            else:
+                steps = limit
+        except VmFault as e:
+            if e.ip is None:
+                e.ip = ip
+            raise
+        except IndexError:
+            if 0 <= ip < len(code):
+                raise
+            raise VmFault('e_badJump', ip)
+        finally:
+            self.steps += steps
+        return ip
+
+    def call(self, ip, args=(), max_steps=None):
+        """
+        Calls the function starting at instruction `ip` after pushing `args`,
+        returning once it does. Returns the next instruction index, which is
+        HOST_RETURN unless `max_steps` ran out.
+        """
+        for arg in args:
+            self.push(arg)
+        self.frames.append((HOST_RETURN, self.regs[Register.BP]))
+        return self.run(ip, max_steps)
@@ -0,0 +1,207 @@
+"""
+    Columnar binary and JSONL exports of decoded instructions.
+
+    The MIT License (MIT)
+
+    Copyright (c) 2015 Joel Hoener <athre0z@zyantific.com>
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy
+    of this software and associated documentation files (the "Software"), to deal
+    in the Software without restriction, including without limitation the rights
+    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the Software is
+    furnished to do so, subject to the following conditions:
+    The above copyright notice and this permission notice shall be included in all
+    copies or substantial portions of the Software.
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+    SOFTWARE.
+"""
+
+
+
+from __future__ import print_function, division
+
+import json
+import struct
+
+import numpy as np
+
+from gsdisas import DecodeCache, decode_raw
+from gsdisas.batch import INSN_SIZE, as_words, decode_batch
+from gsdisas.operands import Register, Immediate, Expression, Reference
+
+CHUNK_WORDS = 1 << 16
+
+# Columnar files start with a header and a directory of `num_columns`
+# entries, each naming a column, its numpy dtype and its file offset.
+# Columns hold `count` values each, aligned to COLUMN_ALIGN bytes.
+COLUMNAR_MAGIC = b'GSVMCOL\0'
+COLUMNAR_VERSION = 1
+COLUMN_ALIGN = 64
+_header = struct.Struct('<8sIIQQ')  # magic, version, num_columns, count, base
+_column = struct.Struct('<16s8sQ')  # name, dtype, offset
+
+# Operand kinds of the columnar format, by operand type
+KIND_NONE = 0
+KIND_REGISTER = 1
+KIND_IMMEDIATE = 2
+KIND_EXPRESSION = 3
+KIND_REFERENCE = 4
+# Set in the `sub` column of ip relative references
+REF_IP_RELATIVE = 0x80
+# Register columns of operands without (a second) register
+NO_REG = 0xFF
+
+MAX_OPERANDS = 3
+COLUMNS = [('raw', '<u4'), ('opcode', '|u1'), ('target', '<i8')] + [
+    ('op{}_{}'.format(i, name), dtype)
+    for i in range(MAX_OPERANDS)
+    for name, dtype in (('kind', '|u1'), ('sub', '|u1'), ('reg', '|u1'), ('reg2', '|u1'), ('value', '<u4'))
+]
+_OPERAND_COLUMNS = COLUMNS[3:]
+
+
+def _operand_parts(expr):
+    """Returns the registers and the immediate sum of an address expression."""
+    if isinstance(expr, Register):
+        return [expr.idx], 0
+    if isinstance(expr, Immediate):
+        return [], expr.val
+    lhs_regs, lhs_val = _operand_parts(expr.lhs)
+    rhs_regs, rhs_val = _operand_parts(expr.rhs)
+    return lhs_regs + rhs_regs, lhs_val + rhs_val
+
+
+def operand_columns(op):
+    """Returns the `(kind, sub, reg, reg2, value)` columns of an operand."""
+    if isinstance(op, Register):
+        return KIND_REGISTER, 0, op.idx, NO_REG, 0
+    if isinstance(op, Immediate):
+        return KIND_IMMEDIATE, op.type, NO_REG, NO_REG, op.val
+    if isinstance(op, Reference):
+        kind, sub = KIND_REFERENCE, op.type | (REF_IP_RELATIVE if op.ip_relative else 0)
+        regs, value = _operand_parts(op.expr)
+    else:
+        kind, sub = KIND_EXPRESSION, 0
+        regs, value = _operand_parts(op)
+    regs = regs + [NO_REG] * (2 - len(regs))
+    return kind, sub, regs[0], regs[1], value
+
+
+def _insn_columns(raw):
+    values = []
+    ops = decode_raw(raw).ops
+    for i in range(MAX_OPERANDS):
+        values.extend(operand_columns(ops[i]) if i < len(ops) else (KIND_NONE, 0, NO_REG, NO_REG, 0))
+    return tuple(values)
+
+
+def _aligned(offset):
+    return (offset + COLUMN_ALIGN - 1) // COLUMN_ALIGN * COLUMN_ALIGN
+
+
+def write_columnar(buf, f, base=0, chunk_words=CHUNK_WORDS):
+    """
+    Writes the decoded instructions of a code segment to a seekable binary
+    file in the columnar format, chunk by chunk. Operand columns are filled
+    from one decode per distinct word of each chunk.
+    """
+    words = as_words(buf)
+    count = len(words)
+    directory = []
+    offset = _aligned(_header.size + _column.size * len(COLUMNS))
+    for name, dtype in COLUMNS:
+        directory.append((name, dtype, offset))
+        offset = _aligned(offset + count * np.dtype(dtype).itemsize)
+    start = f.tell()
+    f.write(_header.pack(COLUMNAR_MAGIC, COLUMNAR_VERSION, len(COLUMNS), count, base))
+    for name, dtype, col_offset in directory:
+        f.write(_column.pack(name.encode('ascii'), dtype.encode('ascii'), col_offset))
+    f.truncate(start + offset)
+
+    for lo in range(0, count, chunk_words):
+        chunk = words[lo:lo + chunk_words]
+        insns = decode_batch(chunk, base, lo)
+        unique, inverse = np.unique(chunk, return_inverse=True)
+        operands = np.array([_insn_columns(int(raw)) for raw in unique], dtype=np.int64)
+        operands = operands.reshape(-1, len(_OPERAND_COLUMNS))[inverse]
+        columns = [chunk, insns['opcode'], insns['target']] + [operands[:, i] for i in range(len(_OPERAND_COLUMNS))]
+        for (name, dtype, col_offset), values in zip(directory, columns):
+            dtype = np.dtype(dtype)
+            f.seek(start + col_offset + lo * dtype.itemsize)
+            f.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+    f.seek(start + offset)
+
+
+def load_columnar(path):
+    """
+    Maps a columnar export read-only, returning its base address and a
+    dict of its columns as memory mapped arrays.
+    """
+    with open(path, 'rb') as f:
+        magic, version, num_columns, count, base = _header.unpack(f.read(_header.size))
+        if magic != COLUMNAR_MAGIC:
+            raise ValueError('not a columnar export')
+        if version != COLUMNAR_VERSION:
+            raise ValueError('unsupported columnar export version {}'.format(version))
+        directory = [_column.unpack(f.read(_column.size)) for _ in range(num_columns)]
+    columns = {}
+    for name, dtype, offset in directory:
+        name = name.rstrip(b'\0').decode('ascii')
+        columns[name] = np.memmap(
+            path, dtype=dtype.rstrip(b'\0').decode('ascii'), mode='r', offset=offset, shape=(count, )
+        ) if count else np.zeros(0, dtype=dtype.rstrip(b'\0').decode('ascii'))
+    return base, columns
+
+
+def operand_json(op):
+    """Returns the JSON representation of an operand, tagged with its type name."""
+    out = {'type': type(op).__name__}
+    if isinstance(op, Register):
+        out['idx'] = op.idx
+    elif isinstance(op, Immediate):
+        out['val'] = op.val
+        out['bits'] = op.bits
+        out['const_type'] = op.type
+    elif isinstance(op, Expression):
+        out['operator'] = op.operator
+        out['lhs'] = operand_json(op.lhs)
+        out['rhs'] = operand_json(op.rhs)
+    elif isinstance(op, Reference):
+        out['ref_type'] = op.prefix()
+        out['ip_relative'] = op.ip_relative
+        out['expr'] = operand_json(op.expr)
+    out['text'] = op.textual()
+    return out
+
+
+def write_jsonl(buf, out, base=0, chunk_lines=CHUNK_WORDS, cache_size=0x10000):
+    """
+    Writes the decoded instructions of a code segment to a text stream as
+    JSON lines, one object per instruction with its address, raw word,
+    mnemonic, text and structured operands.
+    """
+    operands = DecodeCache(cache_size, lambda op: json.dumps(operand_json(op)))
+
+    def insn_json(raw):
+        # Everything but the address, serialized once per distinct word
+        insn = decode_raw(raw)
+        return '"raw": {}, "mnem": "{}", "opcode": {}, "text": {}, "ops": [{}]}}'.format(
+            raw, insn.mnem, insn.opcode, json.dumps(insn.textual()),
+            ', '.join([operands.decode(op) for op in insn.ops]),
+        )
+    cache = DecodeCache(cache_size, insn_json)
+    words = as_words(buf)
+    for lo in range(0, len(words), chunk_lines):
+        addr = base + lo * INSN_SIZE
+        lines = []
+        for raw in words[lo:lo + chunk_lines].tolist():
+            lines.append('{"addr": ' + str(addr) + ', ' + cache.decode(raw))
+            addr += INSN_SIZE
+        lines.append('')
+        out.write(u'\n'.join(lines))
@@ -0,0 +1,170 @@
+"""
+    Function recovery and call graph indexing for GalaxyScript code segments.
+
+    The MIT License (MIT)
+
+    Copyright (c) 2015 Joel Hoener <athre0z@zyantific.com>
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy
+    of this software and associated documentation files (the "Software"), to deal
+    in the Software without restriction, including without limitation the rights
+    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the Software is
+    furnished to do so, subject to the following conditions:
+    The above copyright notice and this permission notice shall be included in all
+    copies or substantial portions of the Software.
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+    SOFTWARE.
+"""
+
+
+from __future__ import print_function, division
+
+from collections import namedtuple
+
+import numpy as np
+
+from gsdisas.batch import INSN_SIZE, as_words
+from gsdisas.cfg import _offsets
+from gsdisas.layout import F_OPCODE, F_REG1, F_CALL_IDX, field_mask
+from gsdisas.tables import opcodes
+
+OP_ENTER = [x[0] for x in opcodes].index('enter')
+OP_RETN = [x[0] for x in opcodes].index('retn')
+OP_CALL = [x[0] for x in opcodes].index('call')
+
+# Per-function call information: `direct_calls` holds the sorted distinct
+# call indices, `call_sites` the addresses of all calls and `register_calls`
+# `(address, register)` pairs of calls taking the index from a register.
+FunctionInfo = namedtuple('FunctionInfo', 'index start end direct_calls call_sites register_calls')
+
+
+def _field(words, field):
+    return (words >> np.uint32(field[0])) & np.uint32(field_mask(field))
+
+
+class FunctionIndex(object):
+    """
+    Recovers functions of a code segment and indexes their calls.
+
+    Functions start at `enter` and extend to their last `retn` before the
+    next function start (or up to it, if there is none). Code preceding the
+    first `enter` forms a function of its own. Functions are numbered in
+    address order.
+
+    Work is done on demand: boundaries are located with one vectorized pass,
+    per-function call information is computed and cached when first asked
+    for and the caller index is only built for `callers()`. Previously
+    computed `(starts, ends)` instruction index arrays may be passed as
+    `boundaries`.
+    """
+    def __init__(self, buf, base=0, boundaries=None):
+        self.words = as_words(buf)
+        self.base = base
+        self._starts, self._ends = boundaries or (None, None)
+        self._infos = {}
+        self._caller_offsets = None
+        self._caller_funcs = None
+
+    def _boundaries(self):
+        if self._starts is None:
+            opcode = _field(self.words, F_OPCODE)
+            starts = np.flatnonzero(opcode == OP_ENTER)
+            if len(self.words) and (not len(starts) or starts[0] != 0):
+                starts = np.insert(starts, 0, 0)
+            if not len(starts):
+                self._starts, self._ends = starts, starts.copy()
+                return self._starts, self._ends
+            retns = np.flatnonzero(opcode == OP_RETN)
+            limits = np.append(starts[1:], len(self.words))
+            # Index of the last retn before each next start, if in function
+            last_retn = np.searchsorted(retns, limits) - 1
+            ends = limits.copy()
+            has_retn = last_retn >= 0
+            retn_idx = retns[last_retn[has_retn]]
+            ends[has_retn] = np.where(retn_idx >= starts[has_retn], retn_idx + 1, limits[has_retn])
+            self._starts = starts
+            self._ends = ends
+        return self._starts, self._ends
+
+    @property
+    def boundaries(self):
+        """Instruction index arrays of function starts and (exclusive) ends."""
+        return self._boundaries()
+
+    def __len__(self):
+        return len(self._boundaries()[0])
+
+    def function_range(self, func):
+        """Returns the `[start, end)` address range of a function."""
+        starts, ends = self._boundaries()
+        return self.base + int(starts[func]) * INSN_SIZE, self.base + int(ends[func]) * INSN_SIZE
+
+    def function_at(self, addr):
+        """Returns the index of the function containing `addr` or None."""
+        starts, ends = self._boundaries()
+        idx = (addr - self.base) // INSN_SIZE
+        func = int(np.searchsorted(starts, idx, side='right')) - 1
+        if func < 0 or idx >= ends[func]:
+            return None
+        return func
+
+    def info(self, func):
+        """Returns the (cached) `FunctionInfo` of a function."""
+        info = self._infos.get(func)
+        if info is None:
+            start, end = self.function_range(func)
+            lo = (start - self.base) // INSN_SIZE
+            words = self.words[lo:(end - self.base) // INSN_SIZE]
+            sites = np.flatnonzero(_field(words, F_OPCODE) == OP_CALL)
+            regs = _field(words[sites], F_REG1)
+            direct = regs == 0
+            info = FunctionInfo(
+                func, start, end,
+                np.unique(_field(words[sites[direct]], F_CALL_IDX)),
+                self.base + (lo + sites) * INSN_SIZE,
+                [
+                    (self.base + (lo + int(site)) * INSN_SIZE, int(reg))
+                    for site, reg in zip(sites[~direct], regs[~direct])
+                ],
+            )
+            self._infos[func] = info
+        return info
+
+    def callees(self, func):
+        """Returns the distinct call indices directly called by a function."""
+        return self.info(func).direct_calls
+
+    def callers(self, call_idx):
+        """Returns the indices of all functions directly calling `call_idx`."""
+        if self._caller_offsets is None:
+            starts, ends = self._boundaries()
+            words = self.words
+            sites = np.flatnonzero(_field(words, F_OPCODE) == OP_CALL)
+            sites = sites[_field(words[sites], F_REG1) == 0]
+            funcs = np.searchsorted(starts, sites, side='right') - 1
+            # Sites past the last retn of a function belong to none, as in info()
+            inside = sites < ends[funcs]
+            sites, funcs = sites[inside], funcs[inside]
+            keys = _field(words[sites], F_CALL_IDX).astype(np.int64)
+            # Sort by call index, then function, dropping duplicate pairs
+            order = np.lexsort((funcs, keys))
+            keys, funcs = keys[order], funcs[order]
+            keep = np.ones(len(keys), dtype=bool)
+            keep[1:] = (keys[1:] != keys[:-1]) | (funcs[1:] != funcs[:-1])
+            keys = keys[keep]
+            # Offsets up to the highest call index made, later ones have no callers
+            self._caller_offsets = _offsets(keys, int(keys[-1]) + 1 if len(keys) else 0)
+            self._caller_funcs = funcs[keep]
+        offsets = self._caller_offsets
+        if not 0 <= call_idx < len(offsets) - 1:
+            return self._caller_funcs[:0]
+        return self._caller_funcs[offsets[call_idx]:offsets[call_idx + 1]]
+
+    def __repr__(self):
+        return 'FunctionIndex(base=0x{:X}, insns={})'.format(self.base, len(self.words))
@@ -0,0 +1,197 @@
+"""
+    Offline pre-analysis of a code segment, applied to an IDA database in bulk.
+
+    The MIT License (MIT)
+
+    Copyright (c) 2015 Joel Hoener <athre0z@zyantific.com>
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy
+    of this software and associated documentation files (the "Software"), to deal
+    in the Software without restriction, including without limitation the rights
+    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the Software is
+    furnished to do so, subject to the following conditions:
+    The above copyright notice and this permission notice shall be included in all
+    copies or substantial portions of the Software.
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+    SOFTWARE.
+"""
+
+
+from __future__ import print_function, division
+
+from contextlib import contextmanager
+
+import numpy as np
+
+from gsdisas.batch import INSN_SIZE, NO_TARGET, decode_batch
+from gsdisas.cfg import JUMP_OPCODES, STOP_OPCODES
+from gsdisas.functions import FunctionIndex
+from gsdisas.tables import opcodes, NUM_OPCODES
+
+_defined_opcodes = np.arange(NUM_OPCODES) < len(opcodes)
+
+FUNC_NAME_FORMAT = 'gsfunc_{:d}'
+
+# Address range currently being applied in bulk and the itypes of its
+# instructions, see preanalyzed()
+_active = None
+
+
+def preanalyzed(ea):
+    """
+    Tells whether the instruction at `ea` is part of a bulk application in
+    progress. The processor module's emu() skips its per-instruction work
+    for those, as the references are added in bulk afterwards.
+    """
+    return _active is not None and _active[0] <= ea < _active[1]
+
+
+def planned_itype(ea):
+    """
+    Returns the itype of the instruction at `ea` if it is part of a bulk
+    application in progress, None otherwise. The processor module's ana()
+    takes it instead of decoding the operands, which only out() needs.
+    """
+    if _active is None or not _active[0] <= ea < _active[1]:
+        return None
+    return _active[2][(ea - _active[0]) // INSN_SIZE]
+
+
+@contextmanager
+def _applying(start, end, itypes):
+    global _active
+    _active = (start, end, itypes)
+    try:
+        yield
+    finally:
+        _active = None
+
+
+class BulkPlan(object):
+    """
+    Everything the bulk step writes to the database for one code segment:
+    the opcode of every instruction and, as address arrays, the defined
+    instructions, those passing flow to the next one, jump sources with their
+    targets and function ranges. The references match those emu() would
+    create instruction by instruction.
+    """
+    def __init__(self, start, end, opcodes, code, flow_src, jump_src, jump_dst, func_starts, func_ends):
+        self.start = start
+        self.end = end
+        self.opcodes = opcodes
+        self.code = code
+        self.flow_src = flow_src
+        self.jump_src = jump_src
+        self.jump_dst = jump_dst
+        self.func_starts = func_starts
+        self.func_ends = func_ends
+
+    @classmethod
+    def from_arrays(cls, insns, functions, base=0):
+        """Builds the plan from batch decoded instructions and a `FunctionIndex`."""
+        opcode = insns['opcode']
+        eas = base + np.arange(len(insns), dtype=np.int64) * INSN_SIZE
+        # ana() rejects undefined opcodes, so they get no references.
+        defined = _defined_opcodes[opcode]
+        flows = defined & ~STOP_OPCODES[opcode]
+        jumps = JUMP_OPCODES[opcode] & (insns['target'] != NO_TARGET)
+        starts, ends = functions.boundaries
+        return cls(
+            base, base + len(insns) * INSN_SIZE,
+            opcode,
+            eas[defined],
+            eas[flows],
+            eas[jumps],
+            insns['target'][jumps],
+            base + np.asarray(starts, dtype=np.int64) * INSN_SIZE,
+            base + np.asarray(ends, dtype=np.int64) * INSN_SIZE,
+        )
+
+    @classmethod
+    def from_analysis(cls, analysis):
+        """Builds the plan from an `Analysis`, e.g. one loaded from a store."""
+        return cls.from_arrays(analysis.insns, analysis.functions, analysis.base)
+
+    @classmethod
+    def compute(cls, buf, base=0):
+        insns = decode_batch(buf, base)
+        return cls.from_arrays(insns, FunctionIndex(insns['raw'], base), base)
+
+    def __len__(self):
+        return (self.end - self.start) // INSN_SIZE
+
+
+def apply_plan(plan, api=None, names=True):
+    """
+    Applies a `BulkPlan` to the current database through `api`, the
+    `idaapi` module by default. The defined instructions are created first,
+    ana() taking their itypes from the plan and emu() short-circuited, then
+    all code references, functions and names are added in one pass each.
+    """
+    if api is None:
+        import idaapi as api
+
+    create_insn = api.create_insn
+    add_cref = api.add_cref
+    with _applying(plan.start, plan.end, plan.opcodes.tolist()):
+        for ea in plan.code.tolist():
+            create_insn(ea)
+
+    # Same order as in emu(), a flow reference wins over a jump to the next
+    # instruction.
+    fl_JN = api.fl_JN
+    for src, dst in zip(plan.jump_src.tolist(), plan.jump_dst.tolist()):
+        add_cref(src, dst, fl_JN)
+    fl_F = api.fl_F
+    for ea in plan.flow_src.tolist():
+        add_cref(ea, ea + INSN_SIZE, fl_F)
+
+    add_func = api.add_func
+    for start, end in zip(plan.func_starts.tolist(), plan.func_ends.tolist()):
+        add_func(start, end)
+    if names:
+        set_name = api.set_name
+        flags = api.SN_NOWARN
+        for i, start in enumerate(plan.func_starts.tolist()):
+            set_name(start, FUNC_NAME_FORMAT.format(i), flags)
+
+
+def preanalyze_segment(start, end, api=None, store=None):
+    """
+    Reads the code segment `[start, end)` from the database, analyzes it
+    offline and applies the results in bulk. Analyses are taken from and
+    saved to the `AnalysisStore` `store`, if given. Returns the plan.
+    """
+    if api is None:
+        import idaapi as api
+
+    buf = api.get_many_bytes(start, end - start)
+    if buf is None:
+        raise ValueError('segment 0x{:X}-0x{:X} is not loaded'.format(start, end))
+    buf = buf[:len(buf) - len(buf) % INSN_SIZE]
+    if store is not None:
+        plan = BulkPlan.from_analysis(store.open(buf, start))
+    else:
+        plan = BulkPlan.compute(buf, start)
+    apply_plan(plan, api)
+    return plan
+
+
+def main():
+    # Run as an IDA script: pre-analyzes the segment at the cursor.
+    import idaapi
+    seg = idaapi.getseg(idaapi.get_screen_ea())
+    if seg is None:
+        print('gsdisas: no segment at the cursor')
+        return
+    plan = preanalyze_segment(seg.startEA, seg.endEA)
+    print('gsdisas: pre-analyzed {} instructions, {} functions'.format(len(plan), len(plan.func_starts)))
+
+if __name__ == '__main__':
+    main()
@@ -30,6 +30,90 @@ from idaapi import *
 from gsdisas import *
 from gsdisas.tables import *
 from gsdisas.operands import *
+from gsdisas.layout import CODE_SPACE
+
+# ----------------------------------------------------------------------
+
+ANA_CACHE_SIZE = 0x10000
+
+# Operand output plans, see out_plan()
+OUT_REG = 1
+OUT_IMM = 2
+OUT_LINE = 3
+OUT_REF = 4
+
+
+def preanalyzed(ea):
+    """
+    See gsdisas.idabulk.preanalyzed(). Nothing is applied in bulk unless
+    that module was loaded, so numpy is only needed for bulk pre-analysis.
+    """
+    bulk = sys.modules.get('gsdisas.idabulk')
+    return bulk is not None and bulk.preanalyzed(ea)
+
+
+def planned_itype(ea):
+    """See gsdisas.idabulk.planned_itype()."""
+    bulk = sys.modules.get('gsdisas.idabulk')
+    return bulk.planned_itype(ea) if bulk is not None else None
+
+
+def ida_operand(opnd):
+    """
+    Maps a decoded operand to the IDA operand type and the attributes to set
+    on the IDA operand, as `(type, ((name, value), ...))`.
+    """
+    kind = type(opnd)
+    if kind is Immediate:
+        return o_imm, (('value', opnd.val), )
+    if kind is Register:
+        return o_reg, (('reg', opnd.idx), ('dtype', dt_dword))  # TODO: dtype
+    if isinstance(opnd, Expression):
+        return o_phrase, ()  # TODO
+    if kind is Reference:
+        expr = opnd.expr
+        if type(expr) is Immediate:
+            return o_mem, (('addr', expr.val), )
+        if type(expr) is Register:
+            return o_reg, (('reg', expr.idx), )
+        if isinstance(expr, Expression):
+            if Immediate in (type(expr.lhs), type(expr.rhs)):
+                return o_phrase, ()
+            return o_displ, ()
+        raise RuntimeError("unreachable code (2)")
+    raise RuntimeError("unreachable code (1)")
+
+
+def out_plan(opnd):
+    """
+    Precomputes how outop() renders a decoded operand: `(OUT_REG, reg_idx)`,
+    `(OUT_IMM, )`, `(OUT_LINE, text)` or `(OUT_REF, prefix, inner_plan)`.
+    """
+    if isinstance(opnd, Expression):
+        return OUT_LINE, opnd.textual()
+    kind = type(opnd)
+    if kind is Register:
+        return OUT_REG, opnd.idx
+    if kind is Immediate:
+        return OUT_IMM,
+    if kind is Reference:
+        return OUT_REF, opnd.prefix(), out_plan(opnd.expr)
+    return None
+
+
+def analyze_raw(raw):
+    """
+    Decodes a raw word into `(itype, ida operands, output plans)`, itype being
+    None for undefined opcodes. The result is made of plain tuples only, which
+    the garbage collector stops tracking, so large caches of them stay cheap.
+    """
+    dec = decode_raw(raw)
+    ops = dec.ops
+    return (
+        dec.opcode if dec.info is not None else None,
+        tuple([ida_operand(x) for x in ops]),
+        tuple([out_plan(x) for x in ops]),
+    )
 
 # ----------------------------------------------------------------------
 
@@ -64,6 +148,9 @@ class GsVmProcessor(idaapi.processor_t):
         super(GsVmProcessor, self).__init__()
         self._init_instructions()
         self._init_regs()
+        # Analysis results keyed by raw instruction word. As ana() reads the
+        # word from the database every time, patched bytes simply miss.
+        self._insn_cache = DecodeCache(ANA_CACHE_SIZE, analyze_raw)
 
     def _init_instructions(self):
         self.instruc = []
@@ -94,7 +181,7 @@ class GsVmProcessor(idaapi.processor_t):
 
     def _init_regs(self):
         self.regNames = []
-        for i in xrange(30):
+        for i in range(30):
             self.regNames.append('r' + str(i))
         self.regNames += [
             'bp', 'sp',
@@ -239,7 +326,7 @@ class GsVmProcessor(idaapi.processor_t):
         # usually 1:1, i.e. trivial translation
         # If specified, must be 256 chars long
         # (optional)
-        'XlatAsciiOutput': "".join([chr(x) for x in xrange(256)]),
+        'XlatAsciiOutput': "".join([chr(x) for x in range(256)]),
 
         # current IP (instruction pointer) symbol in assembler
         'a_curip': "$",
@@ -328,12 +415,18 @@ class GsVmProcessor(idaapi.processor_t):
         all information about the instruction is in 'cmd' structure.
         If zero is returned, the kernel will delete the instruction.
         """
+        if preanalyzed(self.cmd.ea):
+            # References are added in bulk, see gsdisas.idabulk.
+            return 1
         feature = self.cmd.get_canon_feature()
         if feature & CF_JUMP:
             QueueSet(Q_jumps, self.cmd.ea)
             target_op = self.cmd.Operands[0 if self.cmd.itype == self.itype_jmp else 1]
             if target_op.type == o_mem:
-                ua_add_cref(0, self.cmd.ea + self.cmd.size + target_op.addr, fl_JN)
+                # Targets wrap around within the code address space of the segment
+                start = getseg(self.cmd.ea).startEA
+                offset = (self.cmd.ea + self.cmd.size - start + target_op.addr) % CODE_SPACE
+                ua_add_cref(0, start + offset, fl_JN)
         if not (feature & CF_STOP):
             ua_add_cref(0, self.cmd.ea + self.cmd.size, fl_F)
         return 1
@@ -347,30 +440,29 @@ class GsVmProcessor(idaapi.processor_t):
         This function uses out_...() functions from ua.hpp to generate the operand text
         Returns: 1-ok, 0-operand is hidden.
         """
-        def out_opnd(opnd, imm_src):
-            if isinstance(opnd, Expression):
-                #out_opnd(opnd.lhs, OOF_ADDR)
-                #out_symbol(opnd.operator)
-                #out_opnd(opnd.rhs, OOF_ADDR)
-                OutLine(opnd.textual())
-            elif type(opnd) == Register:
-                out_register(self.regNames[opnd.idx])
-            elif type(opnd) == Immediate:
-                OutValue(op, OOFW_32 | imm_src)
-            elif type(opnd) == Reference:
-                out_keyword(opnd.prefix())
-                for c in '::[':
-                    out_symbol(c)
-                out_opnd(opnd.expr, OOF_ADDR)
-                out_symbol(']')
-            else:
-                return False
-            return True
-
         try:
-           return out_opnd(self.cmd.dec.ops[op.n], OOFW_IMM)
+            plan = self.cmd.dec_plans[op.n]
         except IndexError:
             return False
+        return self._out_plan(op, plan, OOFW_IMM)
+
+    def _out_plan(self, op, plan, imm_src):
+        if plan is None:
+            return False
+        kind = plan[0]
+        if kind == OUT_REG:
+            out_register(self.regNames[plan[1]])
+        elif kind == OUT_IMM:
+            OutValue(op, OOFW_32 | imm_src)
+        elif kind == OUT_LINE:
+            OutLine(plan[1])
+        else:
+            out_keyword(plan[1])
+            for c in '::[':
+                out_symbol(c)
+            self._out_plan(op, plan[2], OOF_ADDR)
+            out_symbol(']')
+        return True
 
     def out(self):
         """
@@ -382,9 +474,10 @@ class GsVmProcessor(idaapi.processor_t):
         buf = init_output_buffer(0x400)  # should be more than enough
         OutMnem(13, None)
 
-        for i, cur_op in enumerate(self.cmd.dec.ops):
+        num_ops = len(self.cmd.dec_plans)
+        for i in range(num_ops):
             out_one_operand(i)
-            if i != len(self.cmd.dec.ops) - 1:
+            if i != num_ops - 1:
                 out_symbol(',')
                 OutChar(' ')
 
@@ -396,46 +489,33 @@ class GsVmProcessor(idaapi.processor_t):
         Decodes an instruction into self.cmd.
         Returns: self.cmd.size (=the size of the decoded instruction) or zero
         """
-        insn = ua_next_long()
-        dec = InsnDecoder(EncodedInsn(insn)).decode()
-        self.cmd.itype = dec.opcode
-        self.cmd.size = 4
-
-        op_map = (self.cmd.Op1, self.cmd.Op2, self.cmd.Op3)
-        for my_op, ida_op in zip(dec.ops, op_map):
-            if type(my_op) == Immediate:
-                ida_op.type = o_imm
-                ida_op.value = my_op.val
-            elif type(my_op) == Register:
-                ida_op.type = o_reg
-                ida_op.reg = my_op.idx
-                ida_op.dtype = dt_dword  # TODO
-            elif isinstance(my_op, Expression):
-                ida_op.type = o_phrase
-                # TODO
-            elif type(my_op) == Reference:
-                expr = my_op.expr
-                if type(expr) == Immediate:
-                    ida_op.type = o_mem
-                    ida_op.addr = my_op.expr.val
-                elif type(expr) == Register:
-                    ida_op.type = o_reg
-                    ida_op.reg = expr.idx
-                elif isinstance(expr, Expression):
-                    if Immediate in (type(expr.lhs), type(expr.rhs)):
-                        ida_op.type = o_phrase
-                    else:
-                        ida_op.type = o_displ
-                else:
-                    raise RuntimeError("unreachable code (2)")
-            else:
-                raise RuntimeError("unreachable code (1)")
-
-        # We store (hack?) the decoded instruction info into the cmd struct.
-        self.cmd.dec = dec
+        cmd = self.cmd
+        itype = planned_itype(cmd.ea)
+        if itype is not None:
+            # Created in bulk, see gsdisas.idabulk. The operands are decoded
+            # once the instruction is displayed.
+            cmd.itype = itype
+            cmd.size = 4
+            cmd.dec_plans = ()
+            return cmd.size
+
+        itype, ida_ops, plans = self._insn_cache.decode(ua_next_long())
+        if itype is None:
+            return 0  # undefined opcode
+        cmd.itype = itype
+        cmd.size = 4
+
+        op_map = (cmd.Op1, cmd.Op2, cmd.Op3)
+        for (op_type, attrs), ida_op in zip(ida_ops, op_map):
+            ida_op.type = op_type
+            for name, value in attrs:
+                setattr(ida_op, name, value)
+
+        # We store (hack?) the operand output plans into the cmd struct.
+        cmd.dec_plans = plans
 
         # Return decoded instruction size
-        return self.cmd.size
+        return cmd.size
 
 # ----------------------------------------------------------------------
 # Every processor module script must provide this function.
@@ -0,0 +1,338 @@
+"""
+    Headless stand-in for the parts of the IDA API used by the processor module.
+
+    The MIT License (MIT)
+
+    Copyright (c) 2015 Joel Hoener <athre0z@zyantific.com>
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy
+    of this software and associated documentation files (the "Software"), to deal
+    in the Software without restriction, including without limitation the rights
+    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the Software is
+    furnished to do so, subject to the following conditions:
+    The above copyright notice and this permission notice shall be included in all
+    copies or substantial portions of the Software.
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+    SOFTWARE.
+"""
+
+
+from __future__ import print_function, division
+
+import struct
+import sys
+from collections import deque
+
+# The stand-in only models what the processor module and the bulk
+# pre-analysis touch: instruction creation through ana()/emu(), code
+# cross-references, the segment, functions, names and text output. Constant values
+# follow IDA 6.x where the processor module could observe them.
+
+# Operand types
+o_void = 0
+o_reg = 1
+o_mem = 2
+o_phrase = 3
+o_displ = 4
+o_imm = 5
+
+# Operand data types
+dt_byte = 0
+dt_word = 1
+dt_dword = 2
+
+# Canonical instruction features
+CF_STOP = 0x00001
+CF_CALL = 0x00002
+CF_CHG1 = 0x00004
+CF_CHG2 = 0x00008
+CF_CHG3 = 0x00010
+CF_USE1 = 0x00100
+CF_USE2 = 0x00200
+CF_USE3 = 0x00400
+CF_JUMP = 0x20000
+
+# Code cross-reference types
+fl_CF = 16
+fl_CN = 17
+fl_JF = 18
+fl_JN = 19
+fl_F = 21
+
+# Auto-analysis queues
+Q_jumps = 2
+
+# Processor and assembler flags, opaque to the stand-in
+PR_SEGS = 0x000001
+PR_USE32 = 0x000002
+PR_DEFSEG32 = 0x000004
+PR_RNAMESOK = 0x000080
+PRN_HEX = 0x000000
+PR_NO_SEGMOVE = 0x100000
+ASH_HEXF3 = 0x0003
+AS_UNEQU = 0x0000
+AS_COLON = 0x0002
+ASB_BINF4 = 0x0000
+AS_N2CHR = 0x0000
+
+# Operand output flags
+OOFW_IMM = 0x0000
+OOFW_32 = 0x0030
+OOF_ADDR = 0x0080
+
+# set_name() flags
+SN_NOWARN = 0x80
+
+BADADDR = 0xFFFFFFFF
+
+_dword = struct.Struct('<I')
+
+
+class op_t(object):
+    def __init__(self, n):
+        self.n = n
+        self.clear()
+
+    def clear(self):
+        self.type = o_void
+        self.reg = 0
+        self.value = 0
+        self.addr = 0
+        self.dtype = dt_byte
+
+
+class insn_t(object):
+    def __init__(self):
+        self.Operands = [op_t(i) for i in range(3)]
+        self.Op1, self.Op2, self.Op3 = self.Operands
+        self.clear(0)
+
+    def clear(self, ea):
+        self.ea = ea
+        self.size = 0
+        self.itype = 0
+        for op in self.Operands:
+            op.clear()
+
+    def get_canon_feature(self):
+        return _state.proc.instruc[self.itype]['feature']
+
+
+class processor_t(object):
+    @property
+    def cmd(self):
+        return _state.cmd
+
+
+class Database(object):
+    """
+    An in-memory database holding one code segment. `code` maps the heads
+    of instructions to their size, `crefs` maps `(from, to)` pairs to the
+    reference type; `funcs` maps function starts to their end.
+    """
+    def __init__(self, buf, base=0):
+        self.buf = bytes(buf)
+        self.start = base
+        self.end = base + len(self.buf)
+        self.code = {}
+        self.crefs = {}
+        self.funcs = {}
+        self.names = {}
+        self.queue = deque()
+        self.lines = {}
+
+    def get_long(self, ea):
+        if not self.start <= ea <= self.end - 4:
+            return BADADDR
+        return _dword.unpack_from(self.buf, ea - self.start)[0]
+
+
+class _State(object):
+    def __init__(self):
+        self.db = None
+        self.proc = None
+        self.cmd = insn_t()
+        self.out = None
+
+
+_state = _State()
+
+
+def open_database(buf, base=0, proc=None):
+    """Makes a new database for `buf` the current one, returning it."""
+    _state.db = Database(buf, base)
+    if proc is not None:
+        _state.proc = proc
+    return _state.db
+
+
+def set_processor(proc):
+    _state.proc = proc
+
+
+# ----------------------------------------------------------------------
+# Database access
+
+def get_many_bytes(ea, size):
+    db = _state.db
+    if ea < db.start or ea + size > db.end:
+        return None
+    return db.buf[ea - db.start:ea - db.start + size]
+
+
+class segment_t(object):
+    def __init__(self, start, end):
+        self.startEA = start
+        self.endEA = end
+
+
+def getseg(ea):
+    db = _state.db
+    if not db.start <= ea < db.end:
+        return None
+    return segment_t(db.start, db.end)
+
+
+def ua_next_long():
+    cmd = _state.cmd
+    value = _state.db.get_long(cmd.ea + cmd.size)
+    cmd.size += 4
+    return value
+
+
+def create_insn(ea):
+    """Runs ana() and emu() at `ea`, returning the instruction size or 0."""
+    db = _state.db
+    cmd = _state.cmd
+    cmd.clear(ea)
+    size = _state.proc.ana()
+    if not size:
+        return 0
+    db.code[ea] = size
+    if not _state.proc.emu():
+        del db.code[ea]
+        return 0
+    return size
+
+
+def isCode(ea):
+    return ea in _state.db.code
+
+
+def add_cref(frm, to, type):
+    db = _state.db
+    db.crefs[frm, to] = type
+    if db.start <= to < db.end and to not in db.code:
+        db.queue.append(to)
+    return True
+
+
+def ua_add_cref(opoff, to, type):
+    return add_cref(_state.cmd.ea, to, type)
+
+
+def QueueSet(queue, ea):
+    pass
+
+
+def add_func(start, end=BADADDR):
+    db = _state.db
+    if start in db.funcs:
+        return False
+    db.funcs[start] = end
+    return True
+
+
+def set_name(ea, name, flags=0):
+    _state.db.names[ea] = name
+    return True
+
+
+def auto_mark_range(start, end):
+    """Plans the analysis of all addresses in `[start, end)`."""
+    _state.db.queue.extend(range(start, end, 4))
+
+
+def auto_wait():
+    """
+    Drains the analysis queue one address at a time the way the kernel does,
+    calling into ana() and emu() for every instruction.
+    """
+    db = _state.db
+    while db.queue:
+        ea = db.queue.popleft()
+        if ea not in db.code:
+            create_insn(ea)
+    return True
+
+
+# ----------------------------------------------------------------------
+# Text output
+
+def init_output_buffer(size):
+    _state.out = []
+    return _state.out
+
+
+def term_output_buffer():
+    pass
+
+
+def MakeLine(buf):
+    _state.db.lines[_state.cmd.ea] = ''.join(buf)
+    return True
+
+
+def OutMnem(width=8, postfix=None):
+    cmd = _state.cmd
+    mnem = _state.proc.instruc[cmd.itype]['name'] + (postfix or '')
+    _state.out.append(mnem.ljust(width))
+
+
+def OutChar(c):
+    _state.out.append(c)
+
+
+def OutLine(s):
+    _state.out.append(s)
+
+
+out_symbol = OutChar
+out_keyword = OutLine
+out_register = OutLine
+
+
+def OutValue(op, flags=0):
+    _state.out.append('#%02Xh' % (op.addr if flags & OOF_ADDR else op.value))
+
+
+def out_one_operand(n):
+    return _state.proc.outop(_state.cmd.Operands[n])
+
+
+def generate_line(ea):
+    """Analyzes the instruction at `ea` and returns its text from out()."""
+    _state.cmd.clear(ea)
+    if not _state.proc.ana():
+        return None
+    _state.proc.out()
+    return _state.db.lines[ea]
+
+
+def install():
+    """
+    Registers the stand-in as the `idaapi` module unless the real one is
+    importable, so the processor module can be loaded headless.
+    """
+    if 'idaapi' not in sys.modules:
+        try:
+            import idaapi
+        except ImportError:
+            sys.modules['idaapi'] = sys.modules[__name__]
+    return sys.modules['idaapi']
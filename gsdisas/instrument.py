@@ -0,0 +1,225 @@
+"""
+    Optional instrumentation of the decode and render paths.
+
+    The MIT License (MIT)
+
+    Copyright (c) 2015 Joel Hoener <athre0z@zyantific.com>
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy
+    of this software and associated documentation files (the "Software"), to deal
+    in the Software without restriction, including without limitation the rights
+    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the Software is
+    furnished to do so, subject to the following conditions:
+    The above copyright notice and this permission notice shall be included in all
+    copies or substantial portions of the Software.
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+    SOFTWARE.
+"""
+
+
+
+from __future__ import print_function, division
+
+import json
+import platform
+import timeit
+
+import gsdisas
+from gsdisas import DecodedInsn, InsnDecoder, _mnemonics
+from gsdisas.tables import raw_decoders, NUM_OPCODES
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+REPORT_VERSION = 1
+DEFAULT_SAMPLE_EVERY = 64
+TOP_ALLOCATION_SITES = 10
+
+_timer = timeit.default_timer
+
+
+class _Stage(object):
+    """
+    Per-opcode call counts and sampled timings of one instrumented stage.
+    Sampling counts per opcode, so periodic input can't hide opcodes.
+    """
+    def __init__(self, name, sample_every):
+        self.name = name
+        self.calls = [0] * NUM_OPCODES
+        self.sampled = [0] * NUM_OPCODES
+        self.seconds = [0.0] * NUM_OPCODES
+        self.countdown = [sample_every] * NUM_OPCODES
+
+    def wrap(self, fn, opcode_of, sample_every):
+        calls = self.calls
+        sampled = self.sampled
+        seconds = self.seconds
+        countdown = self.countdown
+
+        def wrapper(*args):
+            opcode = opcode_of(args)
+            calls[opcode] += 1
+            countdown[opcode] -= 1
+            if countdown[opcode]:
+                return fn(*args)
+            countdown[opcode] = sample_every
+            start = _timer()
+            try:
+                return fn(*args)
+            finally:
+                seconds[opcode] += _timer() - start
+                sampled[opcode] += 1
+        return wrapper
+
+    def estimated_seconds(self, opcode):
+        """Extrapolates the sampled time of an opcode to all of its calls."""
+        if not self.sampled[opcode]:
+            return 0.0
+        return self.seconds[opcode] / self.sampled[opcode] * self.calls[opcode]
+
+
+class Instrumentation(object):
+    """
+    Counts and times the decode and render paths while active, i.e. between
+    `start()` and `stop()` or inside a `with` block. Stages are the
+    per-opcode operand decoders ('decode'), the per-opcode text renderers
+    ('render'), `InsnDecoder.decode` ('insn_decode') and
+    `DecodedInsn.textual_from_ops` ('textual_from_ops'); times include
+    nested stages. Every `sample_every`-th call of a stage per opcode is
+    timed. With `track_allocations`, allocations are traced with tracemalloc
+    where available, which slows everything down and so skews the times.
+
+    Instrumentation swaps the instrumented functions for wrappers and puts
+    the originals back when stopped, so it costs nothing while inactive.
+    """
+    def __init__(self, sample_every=DEFAULT_SAMPLE_EVERY, track_allocations=False):
+        self.sample_every = sample_every
+        self.track_allocations = track_allocations and tracemalloc is not None
+        self.stages = dict((name, _Stage(name, sample_every)) for name in (
+            'decode', 'render', 'insn_decode', 'textual_from_ops'
+        ))
+        self.wall_seconds = 0.0
+        self.allocations = None
+        self._saved = None
+        self._started = None
+        self._started_tracing = False
+
+    def start(self):
+        if self._saved is not None:
+            raise RuntimeError('instrumentation already active')
+        renderers = gsdisas._renderers
+        self._saved = (
+            list(raw_decoders), list(renderers), InsnDecoder.__dict__['decode'],
+            DecodedInsn.__dict__['textual_from_ops'],
+        )
+        every = self.sample_every
+        by_index = lambda opcode: lambda args: opcode
+        for opcode in range(NUM_OPCODES):
+            raw_decoders[opcode] = self.stages['decode'].wrap(raw_decoders[opcode], by_index(opcode), every)
+            renderers[opcode] = self.stages['render'].wrap(renderers[opcode], by_index(opcode), every)
+        InsnDecoder.decode = self.stages['insn_decode'].wrap(
+            self._saved[2], lambda args: args[0].enc.raw >> 26, every
+        )
+        DecodedInsn.textual_from_ops = self.stages['textual_from_ops'].wrap(
+            self._saved[3], lambda args: args[0][2], every
+        )
+        if self.track_allocations:
+            self._started_tracing = not tracemalloc.is_tracing()
+            if self._started_tracing:
+                tracemalloc.start()
+            if hasattr(tracemalloc, 'reset_peak'):  # Python 3.9+
+                tracemalloc.reset_peak()
+            self._traced_before = tracemalloc.get_traced_memory()[0]
+        self._started = _timer()
+        return self
+
+    def stop(self):
+        if self._saved is None:
+            return
+        self.wall_seconds += _timer() - self._started
+        decoders, renderers, decode, textual_from_ops = self._saved
+        raw_decoders[:] = decoders
+        gsdisas._renderers[:] = renderers
+        InsnDecoder.decode = decode
+        DecodedInsn.textual_from_ops = textual_from_ops
+        self._saved = None
+        if self.track_allocations:
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, __file__), tracemalloc.Filter(False, tracemalloc.__file__),
+            ))
+            if self._started_tracing:
+                tracemalloc.stop()
+            self.allocations = {
+                'net_bytes': current - self._traced_before,
+                'peak_bytes': peak,
+                'top_sites': [
+                    {'site': '{}:{}'.format(stat.traceback[0].filename, stat.traceback[0].lineno),
+                     'bytes': stat.size, 'blocks': stat.count}
+                    for stat in snapshot.statistics('lineno')[:TOP_ALLOCATION_SITES]
+                ],
+            }
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def report(self):
+        """Returns the collected numbers as a JSON serializable dict."""
+        stages = {}
+        opcodes = {}
+        for name, stage in sorted(self.stages.items()):
+            stages[name] = {
+                'calls': sum(stage.calls),
+                'sampled_calls': sum(stage.sampled),
+                'sampled_seconds': sum(stage.seconds),
+                'estimated_seconds': sum(stage.estimated_seconds(op) for op in range(NUM_OPCODES)),
+            }
+            for opcode in range(NUM_OPCODES):
+                if stage.calls[opcode]:
+                    opcodes.setdefault(_mnemonics[opcode], {})[name] = {
+                        'calls': stage.calls[opcode],
+                        'estimated_seconds': stage.estimated_seconds(opcode),
+                    }
+        return {
+            'version': REPORT_VERSION,
+            'python': platform.python_version(),
+            'sample_every': self.sample_every,
+            'wall_seconds': self.wall_seconds,
+            'stages': stages,
+            'opcodes': opcodes,
+            'allocations': self.allocations,
+        }
+
+    def write_json(self, f):
+        json.dump(self.report(), f, indent=2, sort_keys=True)
+        f.write('\n')
+
+    def flat_profile(self):
+        """
+        Renders a flat profile of estimated time per stage and opcode,
+        most expensive first.
+        """
+        rows = []
+        for name, stage in self.stages.items():
+            for opcode in range(NUM_OPCODES):
+                if stage.calls[opcode]:
+                    rows.append((stage.estimated_seconds(opcode), stage.calls[opcode], name, _mnemonics[opcode]))
+        rows.sort(reverse=True)
+        total = self.wall_seconds or 1.0
+        lines = ['  %time   est. s       calls   us/call  stage:opcode']
+        for seconds, calls, name, mnem in rows:
+            lines.append('{:7.2f} {:8.3f} {:11d} {:9.3f}  {}:{}'.format(
+                100 * seconds / total, seconds, calls, 1e6 * seconds / calls, name, mnem
+            ))
+        return '\n'.join(lines)
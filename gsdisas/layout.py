@@ -0,0 +1,238 @@
+"""
+    Declarative instruction field layouts for GalaxyScript bytecode.
+
+    The MIT License (MIT)
+
+    Copyright (c) 2015 Joel Hoener <athre0z@zyantific.com>
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy
+    of this software and associated documentation files (the "Software"), to deal
+    in the Software without restriction, including without limitation the rights
+    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the Software is
+    furnished to do so, subject to the following conditions:
+    The above copyright notice and this permission notice shall be included in all
+    copies or substantial portions of the Software.
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+    SOFTWARE.
+"""
+
+import re
+from string import Formatter
+
+# Instruction fields as [lo, hi) bit ranges
+F_OPCODE = (26, 32)
+F_REG1 = (21, 26)
+F_REG2 = (16, 21)
+F_REG3 = (11, 16)
+F_IMM21 = (0, 21)
+F_IMM16 = (0, 16)
+F_IMM8 = (0, 8)
+F_CALL_IDX = (1, 21)
+F_CALL_R = (0, 1)
+F_POP_SIZE = (4, 26)
+F_POP_CNT = (0, 4)
+
+
+def field_mask(field):
+    lo, hi = field
+    return (1 << (hi - lo)) - 1
+
+
+# Bytes of code address space spanned by branch offsets (imm21 words);
+# targets wrap around within it, so large offsets jump backwards.
+CODE_SPACE = (field_mask(F_IMM21) + 1) << 2
+
+
+def extract(raw, field):
+    return (raw >> field[0]) & field_mask(field)
+
+
+def insert(raw, field, value):
+    mask = field_mask(field)
+    if not 0 <= value <= mask:
+        raise ValueError('value 0x{:X} does not fit field {}'.format(value, field))
+    return (raw & ~(mask << field[0]) & 0xFFFFFFFF) | (value << field[0])
+
+
+class FieldDecoder(object):
+    """
+    Operand decoder described by a field layout and a builder that turns the
+    extracted field values (in layout order) into the operand tuple.
+
+    `text` optionally describes the textual operand representation as a
+    format string referencing fields by their layout index, the format spec
+    naming one of the conversions in `TEXT_CONVERSIONS`, e.g. '{0:reg}, {1:hex}'.
+    Decoders whose operand shape depends on field values leave it unset.
+    """
+    def __init__(self, build, fields, text=None):
+        self.build = build
+        self.fields = tuple(fields)
+        self.text = text
+
+    def __call__(self, insn):
+        return self.build(*[insn[lo:hi] for lo, hi in self.fields])
+
+    def __repr__(self):
+        return 'FieldDecoder(fields={})'.format(self.fields)
+
+
+def fields(*layout):
+    """Decorator turning an operand builder into a `FieldDecoder`."""
+    return lambda build: FieldDecoder(build, layout)
+
+
+# Text conversions of field values usable in `FieldDecoder.text`, matching
+# the `textual()` output of the corresponding operands
+TEXT_CONVERSIONS = {
+    'reg': '_reg_names[{}]',
+    'hex': "'#%02Xh' % {}",
+    'hex_lsh2': "'#%02Xh' % ({} << 2)",
+    'hex_lsh11': "'#%02Xh' % ({} << 11)",
+    'bool': "('true' if {} else 'false')",
+}
+
+
+def _field_expr(field):
+    lo, _ = field
+    if lo == 0:
+        return 'raw & 0x{:X}'.format(field_mask(field))
+    return '(raw >> {}) & 0x{:X}'.format(lo, field_mask(field))
+
+
+def compile_decoders(decoders, name='decode_raw_{:02X}'):
+    """
+    Generates one specialized shift-and-mask function per entry of
+    `decoders`, each taking the raw instruction word and returning the
+    operand tuple. The returned list is indexed like the input.
+    """
+    namespace = {}
+    source = []
+    for i, decoder in enumerate(decoders):
+        builder = '_build_{:02X}'.format(i)
+        namespace[builder] = decoder.build
+        source.append('def {}(raw):\n    return {}({})\n'.format(
+            name.format(i), builder, ', '.join([_field_expr(x) for x in decoder.fields])
+        ))
+    exec(compile('\n'.join(source), '<gsvm-decoders>', 'exec'), namespace)
+    return [namespace[name.format(i)] for i in range(len(decoders))]
+
+
+def compile_renderers(decoders, prefixes, reg_names, fallback, name='render_raw_{:02X}'):
+    """
+    Generates one function per entry of `decoders` turning the raw instruction
+    word into its text line, `prefixes` holding the padded mnemonic for each.
+    Decoders without text template are rendered through `fallback(raw)`.
+    """
+    namespace = {'_reg_names': reg_names}
+    source = []
+    for i, decoder in enumerate(decoders):
+        if decoder.text is None:
+            continue
+        parts = [repr(prefixes[i])]
+        for literal, field, spec, _ in Formatter().parse(decoder.text):
+            if literal:
+                parts.append(repr(literal))
+            if field is not None:
+                value = _field_expr(decoder.fields[int(field)])
+                parts.append(TEXT_CONVERSIONS[spec].format('(' + value + ')'))
+        source.append('def {}(raw):\n    return {}\n'.format(name.format(i), ' + '.join(parts)))
+    exec(compile('\n'.join(source), '<gsvm-renderers>', 'exec'), namespace)
+    return [
+        namespace[name.format(i)] if decoder.text is not None else fallback
+        for i, decoder in enumerate(decoders)
+    ]
+
+
+def parse_hex(text):
+    """
+    Parses an immediate as rendered by `Immediate.textual()`, '#1Fh' or the
+    fixed point form '#3.5', whose fraction holds the low 11 bits.
+    """
+    if text.endswith('h'):
+        return int(text[1:-1], 16)
+    whole, frac = text[1:].split('.')
+    frac = int(frac)
+    if frac > 0x7ff:
+        raise ValueError('fraction of {} exceeds 11 bits'.format(text))
+    return (int(whole) << 11) | frac
+
+
+def parse_shifted(text, shift):
+    value = parse_hex(text)
+    if value & ((1 << shift) - 1):
+        raise ValueError('{} is not a multiple of 0x{:X}'.format(text, 1 << shift))
+    return value >> shift
+
+
+def check_field(value, mask):
+    if not 0 <= value <= mask:
+        raise ValueError('value 0x{:X} does not fit into 0x{:X}'.format(value, mask))
+    return value
+
+
+_HEX_PATTERN = r'#(?:[0-9A-Fa-f]+h|[0-9]+\.[0-9]+)'
+
+# Inverses of `TEXT_CONVERSIONS`: the pattern matching the converted text
+# and an expression turning the matched text back into the field value
+TEXT_PARSERS = {
+    'reg': (r'[a-z][a-z0-9]*', '_reg_index[{}]'),
+    'hex': (_HEX_PATTERN, '_parse_hex({})'),
+    'hex_lsh2': (_HEX_PATTERN, '_parse_shifted({}, 2)'),
+    'hex_lsh11': (_HEX_PATTERN, '_parse_shifted({}, 11)'),
+    'bool': (r'true|false', "({} == 'true')"),
+}
+
+
+def _literal_pattern(literal):
+    # Spacing is free, anything else has to match exactly.
+    return ''.join([r'\s*' if c == ' ' else re.escape(c) for c in literal])
+
+
+def compile_encoders(forms, reg_names, name='encode_{:d}'):
+    """
+    Generates one encoder per syntax form, the inverse of the renderers.
+    A form is a tuple `(opcode, text, fields, fixed, excluded)`: `text` is a
+    template in `FieldDecoder.text` syntax over `fields`, `fixed` maps field
+    indices not in the text to their value and `excluded` maps field indices
+    to values the form can't express. Returns `(regex, encode)` pairs, `encode`
+    taking the regex match and returning the word or None if excluded. Raises
+    ValueError or KeyError on out-of-range values or unknown registers.
+    """
+    namespace = {
+        '_reg_index': dict((x, i) for i, x in enumerate(reg_names)),
+        '_parse_hex': parse_hex,
+        '_parse_shifted': parse_shifted,
+        '_check_field': check_field,
+    }
+    source = []
+    regexes = []
+    for i, (opcode, text, layout, fixed, excluded) in enumerate(forms):
+        pattern = []
+        values = dict((idx, repr(val)) for idx, val in fixed.items())
+        body = []
+        for literal, field, spec, _ in Formatter().parse(text):
+            if literal:
+                pattern.append(_literal_pattern(literal))
+            if field is not None:
+                regex, convert = TEXT_PARSERS[spec]
+                pattern.append('(' + regex + ')')
+                body.append('v{} = {}'.format(field, convert.format('m.group({})'.format(len(body) + 1))))
+                values[int(field)] = 'v' + field
+        for idx, val in sorted(excluded.items()):
+            body.append('if {} == {!r}: return None'.format(values[idx], val))
+        parts = ['0x{:X}'.format(opcode << F_OPCODE[0])]
+        for idx, value in sorted(values.items()):
+            parts.append('(_check_field({}, 0x{:X}) << {})'.format(
+                value, field_mask(layout[idx]), layout[idx][0]
+            ))
+        body.append('return ' + ' | '.join(parts))
+        source.append('def {}(m):\n    {}\n'.format(name.format(i), '\n    '.join(body)))
+        regexes.append(re.compile(''.join(pattern) + r'\Z'))
+    exec(compile('\n'.join(source), '<gsvm-encoders>', 'exec'), namespace)
+    return [(regex, namespace[name.format(i)]) for i, regex in enumerate(regexes)]
@@ -22,93 +22,151 @@
     SOFTWARE.
 """
 
-class Register(object):
+from operator import itemgetter
+
+
+class Operand(tuple):
+    """
+    Base class of all operands. Operands are packed into immutable tuples
+    holding their fields, exposed as read-only attributes by the subclasses.
+    They compare and hash by type and value, which allows sharing them
+    between decoded instructions.
+    """
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return type(self) is type(other) and tuple.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((type(self), tuple(self)))
+
+    def __reduce__(self):
+        return type(self), tuple(self)
+
+
+class Register(Operand):
+    __slots__ = ()
+
     BP = 30
     SP = 31
 
-    def __init__(self, idx):
+    idx = property(itemgetter(0))
+
+    # There are only 32 registers, so instances are interned.
+    def __new__(cls, idx):
         assert 0 <= idx <= 31
-        self.idx = idx
+        return _registers[idx]
 
     def textual(self):
-        if self.idx == self.BP:
-            return 'bp'
-        if self.idx == self.SP:
-            return 'sp'
-        return 'r' + str(self.idx)
+        return reg_names[self[0]]
 
     def __repr__(self):
-        return 'Register(idx: {})'.format(self.idx)
+        return 'Register(idx: {})'.format(self[0])
+
+
+_registers = tuple(tuple.__new__(Register, (i, )) for i in range(32))
+reg_names = tuple('r' + str(i) for i in range(30)) + ('bp', 'sp')
+
 
+class Immediate(Operand):
+    __slots__ = ()
 
-class Immediate(object):
     CONST = 1
     CONST_BOOL = 2
     FIXED = 3
 
-    def __init__(self, val, bits, val_type=CONST):
-        assert val_type in (self.CONST, self.CONST_BOOL, self.FIXED)
-        self.val = val
-        self.bits = bits
-        self.type = val_type
+    val = property(itemgetter(0))
+    bits = property(itemgetter(1))
+    type = property(itemgetter(2))
+
+    def __new__(cls, val, bits, val_type=CONST):
+        assert val_type in (cls.CONST, cls.CONST_BOOL, cls.FIXED)
+        return tuple.__new__(cls, (val, bits, val_type))
 
     def textual(self):
-        if self.type == self.CONST:
-            return '#{:02X}h'.format(self.val)
-        if self.type == self.CONST_BOOL:
-            return 'true' if self.val != 0 else 'false'
-        if self.type == self.FIXED:
-            return '#{}.{}'.format(self.val >> 11, self.val & 0x7ff)
+        val, _, val_type = self
+        if val_type == self.CONST:
+            return '#{:02X}h'.format(val)
+        if val_type == self.CONST_BOOL:
+            return 'true' if val != 0 else 'false'
+        if val_type == self.FIXED:
+            return '#{}.{}'.format(val >> 11, val & 0x7ff)
         raise IndexError()
 
     def __repr__(self):
-        return 'Immediate(val: {}, bits: {})'.format(self.val, self.bits)
+        return 'Immediate(val: {}, bits: {})'.format(self[0], self[1])
+
+
+class Expression(Operand):
+    __slots__ = ()
 
+    lhs = property(itemgetter(0))
+    rhs = property(itemgetter(1))
+    operator = property(itemgetter(2))
 
-class Expression(object):
-    def __init__(self, lhs, rhs, operator):
-        self.lhs = lhs
-        self.rhs = rhs
-        self.operator = operator
+    def __new__(cls, lhs, rhs, operator):
+        return tuple.__new__(cls, (lhs, rhs, operator))
 
     def textual(self):
-        return self.lhs.textual() + self.operator + self.rhs.textual()
+        return self[0].textual() + self[2] + self[1].textual()
+
+    def __repr__(self):
+        return '{}(lhs: {!r}, rhs: {!r})'.format(type(self).__name__, self[0], self[1])
 
 
-def make_expression_type(operator):
+def make_expression_type(operator, name='Expr'):
     class Expr(Expression):
-        def __init__(self, lhs, rhs):
-            super(Expr, self).__init__(lhs, rhs, operator)
+        __slots__ = ()
+
+        def __new__(cls, lhs, rhs):
+            return tuple.__new__(cls, (lhs, rhs, operator))
+
+        def __reduce__(self):
+            return type(self), (self[0], self[1])
+    Expr.__name__ = name
+    Expr.__qualname__ = name
     return Expr
 
-AddExpression = make_expression_type('+')
-SubExpression = make_expression_type('-')
-LeftShiftExpression = make_expression_type('<<')
-RightShiftExpression = make_expression_type('>>')
+AddExpression = make_expression_type('+', 'AddExpression')
+SubExpression = make_expression_type('-', 'SubExpression')
+LeftShiftExpression = make_expression_type('<<', 'LeftShiftExpression')
+RightShiftExpression = make_expression_type('>>', 'RightShiftExpression')
+
 
+class Reference(Operand):
+    __slots__ = ()
 
-class Reference(object):
     CODE = 1
     GLOBAL = 2
     UNIFIED = 3
     STACK = 4
 
-    def __init__(self, expr, ref_type, ip_relative=False):
-        assert ref_type in (self.CODE, self.GLOBAL, self.UNIFIED, self.STACK)
-        self.expr = expr
-        self.type = ref_type
-        self.ip_relative = ip_relative
+    prefixes = {
+        CODE: 'c',
+        GLOBAL: 'g',
+        UNIFIED: 'u',
+        STACK: 's',
+    }
+
+    expr = property(itemgetter(0))
+    type = property(itemgetter(1))
+    ip_relative = property(itemgetter(2))
+
+    def __new__(cls, expr, ref_type, ip_relative=False):
+        assert ref_type in (cls.CODE, cls.GLOBAL, cls.UNIFIED, cls.STACK)
+        return tuple.__new__(cls, (expr, ref_type, ip_relative))
 
     def prefix(self):
-        return {
-            self.CODE: 'c',
-            self.GLOBAL: 'g',
-            self.UNIFIED: 'u',
-            self.STACK: 's',
-        }[self.type]
+        return self.prefixes[self[1]]
 
     def expression(self):
-        return ('+' if self.ip_relative else '') + self.expr.textual()
+        return ('+' if self[2] else '') + self[0].textual()
 
     def textual(self):
-        return self.prefix() + '::[' + self.expression() + ']'
+        return self.prefixes[self[1]] + '::[' + self.expression() + ']'
+
+    def __repr__(self):
+        return 'Reference(expr: {!r}, type: {})'.format(self[0], self[1])
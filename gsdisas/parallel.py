@@ -0,0 +1,81 @@
+"""
+    Parallel disassembly of GalaxyScript code segments.
+
+    The MIT License (MIT)
+
+    Copyright (c) 2015 Joel Hoener <athre0z@zyantific.com>
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy
+    of this software and associated documentation files (the "Software"), to deal
+    in the Software without restriction, including without limitation the rights
+    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the Software is
+    furnished to do so, subject to the following conditions:
+    The above copyright notice and this permission notice shall be included in all
+    copies or substantial portions of the Software.
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+    SOFTWARE.
+"""
+
+
+from __future__ import print_function, division
+
+import io
+import multiprocessing
+import os
+import time
+from collections import namedtuple
+
+from gsdisas.stream import INSN_SIZE, map_segment, write_disassembly
+
+DEFAULT_SHARD_SIZE = 1 << 20
+
+ShardTiming = namedtuple('ShardTiming', 'index offset size seconds')
+
+
+def iter_shards(total_size, shard_size=DEFAULT_SHARD_SIZE):
+    """Yields `(offset, size)` pairs of instruction aligned shards."""
+    shard_size -= shard_size % INSN_SIZE
+    if shard_size <= 0:
+        raise ValueError('shard size must be at least one instruction')
+    total_size -= total_size % INSN_SIZE
+    for offset in range(0, total_size, shard_size):
+        yield offset, min(shard_size, total_size - offset)
+
+
+def _disassemble_shard(task):
+    index, path, offset, size = task
+    start = time.time()
+    with map_segment(path) as buf:
+        shard = buf[offset:offset + size]
+    out = io.StringIO()
+    write_disassembly(shard, out)
+    return out.getvalue(), ShardTiming(index, offset, size, time.time() - start)
+
+
+def parallel_disassemble(path, out, jobs=None, shard_size=DEFAULT_SHARD_SIZE):
+    """
+    Disassembles the code segment stored at `path` using a pool of `jobs`
+    worker processes (defaults to the CPU count), writing the text to `out`
+    in segment order. Output is identical to `write_disassembly`. Returns a
+    list of `ShardTiming`, one per shard.
+    """
+    tasks = [
+        (i, path, offset, size)
+        for i, (offset, size) in enumerate(iter_shards(os.path.getsize(path), shard_size))
+    ]
+    timings = []
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for text, timing in pool.imap(_disassemble_shard, tasks):
+            out.write(text)
+            timings.append(timing)
+    finally:
+        pool.terminate()
+        pool.join()
+    return timings
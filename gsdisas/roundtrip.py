@@ -0,0 +1,203 @@
+"""
+    Exhaustive decode, render and re-encode check over the instruction space.
+
+    The MIT License (MIT)
+
+    Copyright (c) 2015 Joel Hoener <athre0z@zyantific.com>
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy
+    of this software and associated documentation files (the "Software"), to deal
+    in the Software without restriction, including without limitation the rights
+    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the Software is
+    furnished to do so, subject to the following conditions:
+    The above copyright notice and this permission notice shall be included in all
+    copies or substantial portions of the Software.
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+    SOFTWARE.
+"""
+
+
+from __future__ import print_function, division
+
+import multiprocessing
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from gsdisas import render_raw
+from gsdisas.asm import assemble
+from gsdisas.layout import F_OPCODE, field_mask
+from gsdisas.tables import opcode_decoders, NUM_OPCODES
+
+DEFAULT_SHARD_WORDS = 1 << 22
+CHUNK_WORDS = 1 << 16
+
+# Bits below the opcode
+OPERAND_MASK = (1 << F_OPCODE[0]) - 1
+
+# Words whose re-encoding differs are `lossy` if they still render the same,
+# e.g. booleans held in multi-bit fields, and failures otherwise. Lossy
+# words are kept as an uint32 array of `(word, re-encoded word)` rows.
+ShardResult = namedtuple('ShardResult', 'opcode start stop checked lossy failures seconds')
+
+
+def used_mask(opcode):
+    """Returns the mask of the operand bits the decoder of `opcode` reads."""
+    mask = 0
+    for lo, hi in opcode_decoders[opcode].fields:
+        mask |= field_mask((lo, hi)) << lo
+    return mask
+
+
+def _bit_runs(mask):
+    """Splits a mask into `(lo, width)` runs of contiguous set bits."""
+    runs = []
+    lo = 0
+    while mask >> lo:
+        if (mask >> lo) & 1:
+            width = 1
+            while (mask >> (lo + width)) & 1:
+                width += 1
+            runs.append((lo, width))
+            lo += width
+        else:
+            lo += 1
+    return runs
+
+
+def deposit(values, mask):
+    """Scatters the low bits of `values` into the set bits of `mask`, in order."""
+    values = np.asarray(values, dtype=np.uint64)
+    out = np.zeros(len(values), dtype=np.uint64)
+    shift = 0
+    for lo, width in _bit_runs(mask):
+        out |= ((values >> np.uint64(shift)) & np.uint64((1 << width) - 1)) << np.uint64(lo)
+        shift += width
+    return out
+
+
+def check_words(words):
+    """
+    Round-trips raw words through rendering and assembly. Returns a list of
+    `(word, re-encoded word)` lossy words and a list of `(word, text,
+    reason)` failures.
+    """
+    masks = [used_mask(i) | (~OPERAND_MASK & 0xFFFFFFFF) for i in range(NUM_OPCODES)]
+    lossy = []
+    failures = []
+    for word in words:
+        text = render_raw(word)
+        try:
+            encoded = assemble(text)
+        except ValueError as e:
+            failures.append((word, text, str(e)))
+            continue
+        if encoded != word & masks[word >> F_OPCODE[0]]:
+            again = render_raw(encoded)
+            if again == text:
+                lossy.append((word, encoded))
+            else:
+                failures.append((word, text, 're-encodes to {:08X}: {}'.format(encoded, again)))
+    return lossy, failures
+
+
+def _check_shard(task):
+    opcode, mask, start, stop = task
+    began = time.time()
+    lossy = [np.zeros((0, 2), dtype=np.uint32)]
+    failures = []
+    base = np.uint64(opcode << F_OPCODE[0])
+    for lo in range(start, stop, CHUNK_WORDS):
+        values = np.arange(lo, min(lo + CHUNK_WORDS, stop), dtype=np.uint64)
+        chunk_lossy, chunk_failures = check_words((deposit(values, mask) | base).tolist())
+        if chunk_lossy:
+            lossy.append(np.array(chunk_lossy, dtype=np.uint32))
+        failures.extend(chunk_failures)
+    return ShardResult(opcode, start, stop, stop - start, np.concatenate(lossy), failures, time.time() - began)
+
+
+def iter_tasks(opcodes=None, canonical=False, shard_words=DEFAULT_SHARD_WORDS):
+    """
+    Yields `(opcode, mask, start, stop)` shards of the instruction space.
+    Shards enumerate the values of the operand bits set in `mask`: all of
+    them, or with `canonical` only those the decoder reads, leaving out
+    words differing in ignored bits only.
+    """
+    if shard_words <= 0:
+        raise ValueError('shard size must be at least one word')
+    for opcode in (range(NUM_OPCODES) if opcodes is None else opcodes):
+        mask = used_mask(opcode) if canonical else OPERAND_MASK
+        total = 1 << bin(mask).count('1')
+        for start in range(0, total, shard_words):
+            yield opcode, mask, start, min(start + shard_words, total)
+
+
+def parallel_check(tasks, jobs=None):
+    """
+    Checks shards using a pool of `jobs` worker processes (defaults to the
+    CPU count), yielding a `ShardResult` per task in task order.
+    """
+    if jobs == 1:
+        for task in tasks:
+            yield _check_shard(task)
+        return
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for result in pool.imap(_check_shard, tasks):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Checks that every instruction word survives decoding, rendering and re-encoding.'
+    )
+    parser.add_argument('-j', '--jobs', type=int, default=0, help='worker processes, 0 for one per CPU')
+    parser.add_argument('--opcode', type=lambda x: int(x, 0), action='append',
+                        help='opcode to check, all if omitted')
+    parser.add_argument('--canonical', action='store_true',
+                        help='only check words whose bits ignored by the decoder are zero')
+    parser.add_argument('--shard-words', type=int, default=DEFAULT_SHARD_WORDS, help='words per shard')
+    parser.add_argument('-o', '--output', default='-', help="report of lossy and failed words, '-' for stdout")
+    args = parser.parse_args(argv)
+
+    tasks = list(iter_tasks(args.opcode, args.canonical, args.shard_words))
+    total = sum(task[3] - task[2] for task in tasks)
+    out = sys.stdout if args.output == '-' else open(args.output, 'w')
+    checked = lossy = failed = 0
+    began = time.time()
+    try:
+        for result in parallel_check(tasks, args.jobs or None):
+            for word, text, reason in result.failures:
+                print('{:08X}\t{}\t{}'.format(word, text.rstrip(), reason), file=out)
+            for word, encoded in result.lossy.tolist():
+                print('{:08X}\t{}\tlossy, re-encodes to {:08X}'.format(word, render_raw(word).rstrip(), encoded), file=out)
+            checked += result.checked
+            lossy += len(result.lossy)
+            failed += len(result.failures)
+            elapsed = time.time() - began
+            print('opcode 0x{:02X} [{:X}, {:X}): {} failures, {:.1f}% done, {:.0f} words/s'.format(
+                result.opcode, result.start, result.stop, len(result.failures),
+                100 * checked / total, checked / elapsed if elapsed else 0,
+            ), file=sys.stderr)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print('{} words checked, {} lossy, {} failures'.format(checked, lossy, failed), file=sys.stderr)
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""
+    Vectorized search for instruction sequences by field values.
+
+    The MIT License (MIT)
+
+    Copyright (c) 2015 Joel Hoener <athre0z@zyantific.com>
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy
+    of this software and associated documentation files (the "Software"), to deal
+    in the Software without restriction, including without limitation the rights
+    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the Software is
+    furnished to do so, subject to the following conditions:
+    The above copyright notice and this permission notice shall be included in all
+    copies or substantial portions of the Software.
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+    SOFTWARE.
+"""
+
+
+
+from __future__ import print_function, division
+
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+from gsdisas import _mnemonics
+from gsdisas.batch import INSN_SIZE, as_words
+from gsdisas.layout import F_OPCODE, field_mask, insert, parse_hex
+from gsdisas.operands import reg_names
+from gsdisas.tables import opcode_decoders, NUM_OPCODES
+
+_OPCODE_MASK = field_mask(F_OPCODE) << F_OPCODE[0]
+
+# A compiled pattern: `(value, mask)` word pairs of consecutive instructions,
+# the opcode of each (None if any) and per capture name the `(offset, field)`
+# pairs which must hold equal values.
+Pattern = namedtuple('Pattern', 'text elements opcodes captures')
+
+
+def _parse_value(token):
+    if token in reg_names:
+        return reg_names.index(token)
+    if token in ('true', 'false'):
+        return int(token == 'true')
+    if token.startswith('#'):
+        return parse_hex(token)
+    return int(token, 0)
+
+
+def compile_pattern(text):
+    """
+    Compiles a pattern of `;` separated instructions, each a mnemonic
+    followed by comma separated values of its decoder fields in layout
+    order (see `gsdisas.tables`). Values are register names, numbers,
+    '#1Fh' immediates or true/false. '*' matches any value and '$name'
+    any value equal for all fields named alike; a '*' mnemonic matches
+    any instruction. E.g. 'ld_const_i21 $r, 0x1234; add_lsh11 $r, 5'.
+    """
+    elements = []
+    opcodes = []
+    captures = {}
+    for offset, part in enumerate(text.split(';')):
+        tokens = part.replace(',', ' ').split()
+        if not tokens:
+            raise ValueError('empty instruction in pattern {!r}'.format(text))
+        mnem, values = tokens[0], tokens[1:]
+        if mnem == '*':
+            if values:
+                raise ValueError('operands given for any instruction in {!r}'.format(text))
+            elements.append((0, 0))
+            opcodes.append(None)
+            continue
+        if mnem not in _mnemonics:
+            raise ValueError('unknown mnemonic {!r}'.format(mnem))
+        opcode = _mnemonics.index(mnem)
+        layout = opcode_decoders[opcode].fields
+        if len(values) > len(layout):
+            raise ValueError('{} takes at most {} fields'.format(mnem, len(layout)))
+        value = opcode << F_OPCODE[0]
+        mask = _OPCODE_MASK
+        for field, token in zip(layout, values):
+            if token == '*':
+                continue
+            if token.startswith('$'):
+                captures.setdefault(token[1:], []).append((offset, field))
+                continue
+            value = insert(value, field, _parse_value(token))
+            mask |= field_mask(field) << field[0]
+        elements.append((value, mask))
+        opcodes.append(opcode)
+    return Pattern(text, tuple(elements), tuple(opcodes), dict(
+        (name, tuple(fields)) for name, fields in captures.items() if len(fields) > 1
+    ))
+
+
+class PatternIndex(object):
+    """
+    Searches a code segment for patterns. Instruction indices are bucketed
+    by opcode once, a search only comparing the candidates of the rarest
+    opcode of a pattern, with one vectorized compare per instruction of it.
+    """
+    def __init__(self, buf, base=0):
+        self.words = as_words(buf)
+        self.base = base
+        opcode = (self.words >> np.uint32(F_OPCODE[0])).astype(np.uint8)
+        self._order = np.argsort(opcode, kind='mergesort')
+        self._offsets = np.zeros(NUM_OPCODES + 1, dtype=np.int64)
+        np.cumsum(np.bincount(opcode, minlength=NUM_OPCODES), out=self._offsets[1:])
+
+    def bucket(self, opcode):
+        """Returns the sorted indices of the instructions of an opcode."""
+        return self._order[self._offsets[opcode]:self._offsets[opcode + 1]]
+
+    def search(self, pattern):
+        """Returns the sorted instruction indices at which a pattern matches."""
+        if not isinstance(pattern, Pattern):
+            pattern = compile_pattern(pattern)
+        words = self.words
+        size = len(pattern.elements)
+        anchors = [
+            (self._offsets[opcode + 1] - self._offsets[opcode], offset)
+            for offset, opcode in enumerate(pattern.opcodes) if opcode is not None
+        ]
+        if anchors:
+            _, anchor = min(anchors)
+            starts = self.bucket(pattern.opcodes[anchor]) - anchor
+            starts = starts[(starts >= 0) & (starts <= len(words) - size)]
+        else:
+            anchor = None
+            starts = np.arange(max(len(words) - size + 1, 0))
+        for offset, (value, mask) in enumerate(pattern.elements):
+            # Candidates already have the anchor's opcode
+            if mask and not (offset == anchor and mask == _OPCODE_MASK):
+                starts = starts[(words[starts + offset] & np.uint32(mask)) == np.uint32(value)]
+        for fields in pattern.captures.values():
+            (offset, (lo, hi)), rest = fields[0], fields[1:]
+            expected = (words[starts + offset] >> np.uint32(lo)) & np.uint32(field_mask((lo, hi)))
+            keep = np.ones(len(starts), dtype=bool)
+            for offset, (lo, hi) in rest:
+                keep &= ((words[starts + offset] >> np.uint32(lo)) & np.uint32(field_mask((lo, hi)))) == expected
+            starts = starts[keep]
+        return starts
+
+    def search_all(self, patterns):
+        """Returns the matches of each of a sequence of patterns."""
+        return [self.search(pattern) for pattern in patterns]
+
+
+def main(argv=None):
+    import argparse
+    from gsdisas import render_raw
+    from gsdisas.stream import map_segment
+
+    parser = argparse.ArgumentParser(description='Searches a code segment for instruction patterns.')
+    parser.add_argument('input', help='code segment file')
+    parser.add_argument('pattern', nargs='+', help="pattern, e.g. 'call 0, 7, *'")
+    parser.add_argument('--base', type=lambda x: int(x, 0), default=0, help='segment base address')
+    args = parser.parse_args(argv)
+
+    try:
+        patterns = [compile_pattern(text) for text in args.pattern]
+        with map_segment(args.input) as buf:
+            index = PatternIndex(buf, args.base)
+            for text, pattern in zip(args.pattern, patterns):
+                matches = index.search(pattern)
+                print('{}: {} matches'.format(text, len(matches)))
+                for start in matches:
+                    for i in range(start, start + len(pattern.elements)):
+                        print('  0x{:08X}  {}'.format(args.base + i * INSN_SIZE, render_raw(int(index.words[i]))))
+    except (ValueError, IOError) as e:
+        print('error: {}'.format(e), file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
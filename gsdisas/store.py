@@ -0,0 +1,173 @@
+"""
+    Persistent analysis store for GalaxyScript code segments.
+
+    The MIT License (MIT)
+
+    Copyright (c) 2015 Joel Hoener <athre0z@zyantific.com>
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy
+    of this software and associated documentation files (the "Software"), to deal
+    in the Software without restriction, including without limitation the rights
+    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the Software is
+    furnished to do so, subject to the following conditions:
+    The above copyright notice and this permission notice shall be included in all
+    copies or substantial portions of the Software.
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+    SOFTWARE.
+"""
+
+
+from __future__ import print_function, division
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from gsdisas.batch import decode_batch
+from gsdisas.cfg import ControlFlowGraph, build_cfg
+from gsdisas.functions import FunctionIndex
+from gsdisas.tables import opcodes
+from gsdisas.xrefs import XrefIndex, NUM_XREF_KINDS
+
+# Bump when the layout or the meaning of stored arrays changes
+STORE_VERSION = 1
+
+_CFG_ARRAYS = ('block_start', 'block_end', 'insn_block', 'edge_src', 'edge_dst', 'edge_kind')
+
+
+def table_fingerprint():
+    """
+    Hashes everything in the opcode table that affects analysis results:
+    mnemonics, flags, field layouts, text templates and decoder code.
+    """
+    h = hashlib.sha256()
+    for mnem, decoder, flags in opcodes:
+        code = decoder.build.__code__
+        cells = [c.cell_contents for c in decoder.build.__closure__ or ()]
+        h.update(repr((mnem, flags, decoder.fields, decoder.text, code.co_consts, cells)).encode('ascii'))
+        h.update(code.co_code)
+    return h.hexdigest()
+
+
+def _array_names(path):
+    return [x[:-len('.npy')] for x in os.listdir(path) if x.endswith('.npy')]
+
+
+def segment_key(buf, base=0):
+    return '{}-{:x}'.format(hashlib.sha256(buf).hexdigest(), base)
+
+
+class Analysis(object):
+    """
+    Analysis results of one code segment: batch decoded instructions, the
+    control flow graph, function and cross-reference indices. `cached` tells
+    whether the results were loaded from the store.
+    """
+    def __init__(self, base, insns, cfg, functions, xrefs, cached=False):
+        self.base = base
+        self.insns = insns
+        self.cfg = cfg
+        self.functions = functions
+        self.xrefs = xrefs
+        self.cached = cached
+
+    @classmethod
+    def compute(cls, buf, base=0):
+        insns = decode_batch(buf, base)
+        return cls(
+            base, insns, build_cfg(insns, base), FunctionIndex(insns['raw'], base),
+            XrefIndex.build(insns, base),
+        )
+
+    def arrays(self):
+        out = {'insns': self.insns}
+        for name in _CFG_ARRAYS:
+            out['cfg_' + name] = getattr(self.cfg, name)
+        out['func_starts'], out['func_ends'] = self.functions.boundaries
+        for kind in range(NUM_XREF_KINDS):
+            out['xref_keys_{}'.format(kind)] = self.xrefs.keys[kind]
+            out['xref_sites_{}'.format(kind)] = self.xrefs.sites[kind]
+        return out
+
+    @classmethod
+    def from_arrays(cls, base, arrays, cached=False):
+        insns = arrays['insns']
+        return cls(
+            base,
+            insns,
+            ControlFlowGraph(base, *[arrays['cfg_' + name] for name in _CFG_ARRAYS]),
+            FunctionIndex(insns['raw'], base, (arrays['func_starts'], arrays['func_ends'])),
+            XrefIndex(
+                base,
+                [arrays['xref_keys_{}'.format(kind)] for kind in range(NUM_XREF_KINDS)],
+                [arrays['xref_sites_{}'.format(kind)] for kind in range(NUM_XREF_KINDS)],
+            ),
+            cached,
+        )
+
+
+class AnalysisStore(object):
+    """
+    Directory of analysis results keyed by segment content hash and base.
+    Every entry is a directory of .npy arrays, memory-mapped on load, plus
+    a metadata file. Entries written by another store version or for a
+    different opcode table are treated as missing and replaced.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.fingerprint = table_fingerprint()
+        if not os.path.isdir(root):
+            os.makedirs(root)
+
+    def _meta(self, base):
+        return {'version': STORE_VERSION, 'tables': self.fingerprint, 'base': base}
+
+    def load(self, key, base=0):
+        """Returns the stored `Analysis` for `key` or None if missing or stale."""
+        path = os.path.join(self.root, key)
+        try:
+            with open(os.path.join(path, 'meta.json')) as f:
+                meta = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if meta != self._meta(base):
+            return None
+        arrays = {}
+        for name in _array_names(path):
+            arrays[name] = np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+        return Analysis.from_arrays(base, arrays, cached=True)
+
+    def save(self, key, analysis):
+        tmp = tempfile.mkdtemp(prefix='.tmp-', dir=self.root)
+        try:
+            for name, array in analysis.arrays().items():
+                np.save(os.path.join(tmp, name + '.npy'), np.asarray(array))
+            # The metadata goes last, so incomplete entries never look valid.
+            with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+                json.dump(self._meta(analysis.base), f)
+            path = os.path.join(self.root, key)
+            if os.path.exists(path):
+                shutil.rmtree(path)
+            os.rename(tmp, path)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+    def open(self, buf, base=0):
+        """Returns the analysis of a segment, computing and storing it if needed."""
+        key = segment_key(buf, base)
+        analysis = self.load(key, base)
+        if analysis is None:
+            analysis = Analysis.compute(buf, base)
+            self.save(key, analysis)
+        return analysis
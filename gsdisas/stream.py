@@ -0,0 +1,119 @@
+"""
+    Streaming disassembly of GalaxyScript code segments.
+
+    The MIT License (MIT)
+
+    Copyright (c) 2015 Joel Hoener <athre0z@zyantific.com>
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy
+    of this software and associated documentation files (the "Software"), to deal
+    in the Software without restriction, including without limitation the rights
+    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the Software is
+    furnished to do so, subject to the following conditions:
+    The above copyright notice and this permission notice shall be included in all
+    copies or substantial portions of the Software.
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+    SOFTWARE.
+"""
+
+
+from __future__ import print_function, division
+
+import io
+import mmap
+import struct
+import sys
+from contextlib import contextmanager
+
+from gsdisas import decode_raw, render_raw
+
+INSN_SIZE = 4
+CHUNK_WORDS = 0x1000
+
+# Python 3 views little endian buffers as native words without copying
+_has_cast = hasattr(memoryview, 'cast') and sys.byteorder == 'little' and struct.calcsize('I') == INSN_SIZE
+_chunk_struct = struct.Struct('<{}I'.format(CHUNK_WORDS))
+
+
+@contextmanager
+def map_segment(path):
+    """Maps a code segment file read-only, yielding a buffer over its content."""
+    with open(path, 'rb') as f:
+        try:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty files can't be mapped
+            yield b''
+            return
+        try:
+            yield m
+        finally:
+            try:
+                m.close()
+            except BufferError:  # still exported, e.g. to numpy arrays, unmapped once they are gone
+                pass
+
+
+def iter_words(buf):
+    """
+    Yields the little endian instruction words of a buffer without copying
+    it. Trailing bytes not forming a whole word are ignored.
+    """
+    num_words = len(buf) // INSN_SIZE
+    if _has_cast:
+        view = memoryview(buf)[:num_words * INSN_SIZE].cast('I')
+        try:
+            for word in view:
+                yield word
+        finally:
+            view.release()
+        return
+
+    full_chunks, rest = divmod(num_words, CHUNK_WORDS)
+    for i in range(full_chunks):
+        for word in _chunk_struct.unpack_from(buf, i * CHUNK_WORDS * INSN_SIZE):
+            yield word
+    if rest:
+        for word in struct.unpack_from('<{}I'.format(rest), buf, full_chunks * CHUNK_WORDS * INSN_SIZE):
+            yield word
+
+
+def iter_disassemble(buf, base=0, decode=decode_raw):
+    """
+    Lazily decodes a code segment, yielding `(address, DecodedInsn)` pairs.
+    `decode` may be replaced, e.g. by the `decode` method of a `DecodeCache`.
+    """
+    addr = base
+    for word in iter_words(buf):
+        yield addr, decode(word)
+        addr += INSN_SIZE
+
+
+def write_disassembly(buf, out, chunk_lines=CHUNK_WORDS, render=render_raw):
+    """
+    Renders a code segment to a text stream, one instruction per line,
+    handing the output over in chunks of `chunk_lines` lines. `render` maps
+    raw words to lines and may be replaced, e.g. by a caching variant.
+    """
+    lines = []
+    for word in iter_words(buf):
+        lines.append(render(word))
+        if len(lines) == chunk_lines:
+            lines.append('')
+            out.write(u'\n'.join(lines))
+            del lines[:]
+    if lines:
+        lines.append('')
+        out.write(u'\n'.join(lines))
+
+
+def open_output(path, buffering=1 << 20):
+    """Opens a buffered text writer for `path`, with '-' denoting stdout."""
+    if path == '-':
+        return io.open(sys.stdout.fileno(), 'w', buffering=buffering, closefd=False)
+    return io.open(path, 'w', buffering=buffering)
@@ -0,0 +1,164 @@
+"""
+    Synthetic GalaxyScript code segment generator.
+
+    The MIT License (MIT)
+
+    Copyright (c) 2015 Joel Hoener <athre0z@zyantific.com>
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy
+    of this software and associated documentation files (the "Software"), to deal
+    in the Software without restriction, including without limitation the rights
+    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the Software is
+    furnished to do so, subject to the following conditions:
+    The above copyright notice and this permission notice shall be included in all
+    copies or substantial portions of the Software.
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+    SOFTWARE.
+"""
+
+
+from __future__ import print_function, division
+
+import bisect
+import random
+import struct
+
+from gsdisas.layout import (
+    F_OPCODE, F_REG1, F_REG2, F_REG3, F_IMM21, F_IMM16, F_CALL_IDX, field_mask, insert
+)
+from gsdisas.operands import Register
+from gsdisas.tables import opcodes, opcode_decoders, NUM_OPCODES
+
+# Relative opcode frequencies loosely modelled after compiled GalaxyScript.
+# Opcodes not listed get a weight of 1, undefined ones UNDEFINED_WEIGHT.
+DEFAULT_WEIGHTS = {
+    'ld_local32b': 120,
+    'push': 90,
+    'call': 70,
+    'pop': 60,
+    'mov': 60,
+    'ld_const_i21': 60,
+    'st_mem32': 50,
+    'push_local32': 30,
+    'jz': 25,
+    'jmp': 20,
+    'jnz': 15,
+    'add': 15,
+    'add_i21': 15,
+    'add_lsh11': 10,
+    'ld_global32i': 15,
+    'ld_global32': 10,
+    'mkstr': 10,
+    'decref': 10,
+    'st_gc': 10,
+    'seteq': 8,
+    'setge': 8,
+    'setneq': 8,
+    'ckarbnds': 5,
+    'mul': 5,
+    'sub': 5,
+    'enter': 0,  # only emitted at function starts
+    'retn': 0,  # only emitted at function ends
+}
+UNDEFINED_WEIGHT = 0.2
+
+_REG_FIELDS = (F_REG1, F_REG2, F_REG3)
+_regs = list(range(16)) + [Register.BP] * 4 + [Register.SP]
+_op_enter = [x[0] for x in opcodes].index('enter')
+_op_retn = [x[0] for x in opcodes].index('retn')
+_op_call = [x[0] for x in opcodes].index('call')
+_branch_ops = [i for i, x in enumerate(opcodes) if x[0] in ('jz', 'jnz', 'jmp')]
+
+
+class SegmentGenerator(object):
+    """
+    Seeded generator of code segments consisting of functions that start
+    with `enter`, end with `retn` and only branch within themselves. Calls
+    use native indices below `num_natives` or go through a register.
+    """
+    def __init__(self, seed=0, weights=None, num_natives=0x1000, func_len=(8, 256)):
+        self.rng = random.Random(seed)
+        self.num_natives = num_natives
+        self.func_len = func_len
+
+        weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        self._ops = []
+        self._cum_weights = []
+        total = 0
+        for i in range(NUM_OPCODES):
+            if i < len(opcodes):
+                weight = weights.get(opcodes[i][0], 1)
+            else:
+                weight = UNDEFINED_WEIGHT
+            if weight > 0:
+                total += weight
+                self._ops.append(i)
+                self._cum_weights.append(total)
+
+    def _imm(self, bits):
+        # Log-uniform magnitude, small immediates being the common case
+        return self.rng.getrandbits(self.rng.randint(1, bits)) if bits else 0
+
+    def _insn(self, opcode, idx, func_end):
+        rng = self.rng
+        raw = insert(0, F_OPCODE, opcode)
+        for field in opcode_decoders[opcode].fields:
+            if field in _REG_FIELDS:
+                raw = insert(raw, field, rng.choice(_regs))
+            else:
+                raw = insert(raw, field, self._imm(field[1] - field[0]))
+
+        if opcode in _branch_ops:
+            raw = insert(raw, F_IMM21, rng.randint(0, min(func_end - idx - 1, field_mask(F_IMM21))))
+        elif opcode == _op_call:
+            if rng.random() < 0.9:
+                raw = insert(raw, F_REG1, 0)
+                raw = insert(raw, F_CALL_IDX, rng.randrange(self.num_natives))
+            else:
+                raw = insert(raw, F_REG1, rng.randint(1, 29))
+        return raw
+
+    def iter_words(self, num_insns):
+        """Lazily generates `num_insns` raw instruction words."""
+        rng = self.rng
+        start = 0
+        while start < num_insns:
+            end = min(start + rng.randint(*self.func_len), num_insns) - 1
+            yield insert(insert(0, F_OPCODE, _op_enter), F_IMM21, 4 * rng.randint(0, 64))
+            for idx in range(start + 1, end):
+                pick = rng.random() * self._cum_weights[-1]
+                opcode = self._ops[bisect.bisect_right(self._cum_weights, pick)]
+                yield self._insn(opcode, idx, end)
+            if end > start:
+                yield insert(insert(0, F_OPCODE, _op_retn), F_IMM16, 4 * rng.randint(0, 16))
+            start = end + 1
+
+    def words(self, num_insns):
+        """Generates a list of `num_insns` raw instruction words."""
+        return list(self.iter_words(num_insns))
+
+    def segment(self, num_insns):
+        """Generates a code segment of `num_insns` instructions as bytes."""
+        words = self.words(num_insns)
+        return struct.pack('<{}I'.format(len(words)), *words)
+
+    def write(self, f, num_insns, chunk_words=0x1000):
+        """Writes a code segment of `num_insns` instructions to a binary file."""
+        chunk = []
+        for word in self.iter_words(num_insns):
+            chunk.append(word)
+            if len(chunk) == chunk_words:
+                f.write(struct.pack('<{}I'.format(len(chunk)), *chunk))
+                del chunk[:]
+        if chunk:
+            f.write(struct.pack('<{}I'.format(len(chunk)), *chunk))
+
+
+def generate_segment(num_insns, seed=0, **kwargs):
+    return SegmentGenerator(seed, **kwargs).segment(num_insns)
@@ -23,59 +23,90 @@
 """
 
 from __future__ import print_function, division
-from operands import Register, Immediate, AddExpression, Reference
+from gsdisas.operands import Register, Immediate, AddExpression, Reference
+from gsdisas.layout import (
+    FieldDecoder, fields, compile_decoders,
+    F_OPCODE, F_REG1, F_REG2, F_REG3, F_IMM21, F_IMM16, F_IMM8,
+    F_CALL_IDX, F_CALL_R, F_POP_SIZE, F_POP_CNT,
+)
 
 # Instruction decoders
-decode_unk = lambda i: ()
-decode_noops = lambda i: ()
-decode_reg = lambda i: (Register(i[21:26]), )
-decode_reg_reg = lambda i: (Register(i[21:26]), Register(i[16:21]))
-decode_reg_reg_reg = lambda i: (Register(i[21:26]), Register(i[16:21]), Register(i[11:16]))
-decode_reg_const21 = lambda i: (Register(i[21:26]), Immediate(i[0:21], 21))
-decode_reg_gref21 = lambda i: (Register(i[21:26]), Reference(Immediate(i[0:21], 21), Reference.GLOBAL))
-decode_reg_const8 = lambda i: (Register(i[21:26]), Immediate(i[0:8], 8))
-decode_cond_branch = lambda i: (Register(i[21:26]), Reference(Immediate(i[0:21] << 2, 23), Reference.CODE, True))
-decode_insn_jmp = lambda i: (Reference(Immediate(i[0:21] << 2, 21), Reference.CODE, True), )
-decode_add_lsh11 = lambda i: (Register(i[21:26]), Immediate(i[0:21] << 11, 32))
-decode_reg_glob = lambda i: (Register(i[21:26]), Reference(Immediate(i[0:21], 21), Reference.GLOBAL))
-decode_insn_add_i8 = lambda i: (Register(i[21:26]), Register(i[16:21]), Immediate(i[0:8], 8))
-decode_insn_pop = lambda i: (Immediate(i[4:26], 22), Immediate(i[0:4], 4))
-decode_insn_retn = lambda i: (Immediate(i[0:16], 16), )  # TODO: immediate consists of multiple components. parse.
-
-decode_insn_ld_local32b = lambda i: (
-    Register(i[21:26]),
-    Reference(AddExpression(Register(Register.BP), Immediate(i[0:16], 16)), Reference.STACK),
+decode_unk = FieldDecoder(lambda: (), (), '')
+decode_noops = FieldDecoder(lambda: (), (), '')
+decode_reg = FieldDecoder(lambda r1: (Register(r1), ), (F_REG1, ), '{0:reg}')
+decode_reg_reg = FieldDecoder(
+    lambda r1, r2: (Register(r1), Register(r2)), (F_REG1, F_REG2), '{0:reg}, {1:reg}'
+)
+decode_reg_reg_reg = FieldDecoder(
+    lambda r1, r2, r3: (Register(r1), Register(r2), Register(r3)), (F_REG1, F_REG2, F_REG3),
+    '{0:reg}, {1:reg}, {2:reg}'
+)
+decode_reg_const21 = FieldDecoder(
+    lambda r1, imm: (Register(r1), Immediate(imm, 21)), (F_REG1, F_IMM21), '{0:reg}, {1:hex}'
+)
+decode_reg_gref21 = FieldDecoder(
+    lambda r1, imm: (Register(r1), Reference(Immediate(imm, 21), Reference.GLOBAL)), (F_REG1, F_IMM21),
+    '{0:reg}, g::[{1:hex}]'
+)
+decode_reg_const8 = FieldDecoder(
+    lambda r1, imm: (Register(r1), Immediate(imm, 8)), (F_REG1, F_IMM8), '{0:reg}, {1:hex}'
+)
+decode_cond_branch = FieldDecoder(
+    lambda r1, imm: (Register(r1), Reference(Immediate(imm << 2, 23), Reference.CODE, True)), (F_REG1, F_IMM21),
+    '{0:reg}, c::[+{1:hex_lsh2}]'
 )
-decode_insn_push_local32 = lambda i: (
-    Immediate(i[21:26], 5, Immediate.CONST_BOOL),
-    Reference(AddExpression(Register(Register.BP), Immediate(i[0:16], 16)), Reference.STACK),
+decode_insn_jmp = FieldDecoder(
+    lambda imm: (Reference(Immediate(imm << 2, 21), Reference.CODE, True), ), (F_IMM21, ),
+    'c::[+{0:hex_lsh2}]'
 )
+decode_add_lsh11 = FieldDecoder(
+    lambda r1, imm: (Register(r1), Immediate(imm << 11, 32)), (F_REG1, F_IMM21), '{0:reg}, {1:hex_lsh11}'
+)
+decode_reg_glob = FieldDecoder(
+    lambda r1, imm: (Register(r1), Reference(Immediate(imm, 21), Reference.GLOBAL)), (F_REG1, F_IMM21),
+    '{0:reg}, g::[{1:hex}]'
+)
+decode_insn_add_i8 = FieldDecoder(
+    lambda r1, r2, imm: (Register(r1), Register(r2), Immediate(imm, 8)), (F_REG1, F_REG2, F_IMM8),
+    '{0:reg}, {1:reg}, {2:hex}'
+)
+decode_insn_pop = FieldDecoder(
+    lambda size, cnt: (Immediate(size, 22), Immediate(cnt, 4)), (F_POP_SIZE, F_POP_CNT), '{0:hex}, {1:hex}'
+)
+# TODO: immediate consists of multiple components. parse.
+decode_insn_retn = FieldDecoder(lambda imm: (Immediate(imm, 16), ), (F_IMM16, ), '{0:hex}')
+
+decode_insn_ld_local32b = FieldDecoder(lambda r1, imm: (
+    Register(r1),
+    Reference(AddExpression(Register(Register.BP), Immediate(imm, 16)), Reference.STACK),
+), (F_REG1, F_IMM16), '{0:reg}, s::[bp+{1:hex}]')
+decode_insn_push_local32 = FieldDecoder(lambda r1, imm: (
+    Immediate(r1, 5, Immediate.CONST_BOOL),
+    Reference(AddExpression(Register(Register.BP), Immediate(imm, 16)), Reference.STACK),
+), (F_REG1, F_IMM16), '{0:bool}, s::[bp+{1:hex}]')
 
 def make_decode_reg_reg_const16(type_):
-    return lambda i: (
-        Register(i[21:26]),
-        Reference(AddExpression(Register(i[16:21]), Immediate(i[0:16], 16)), type_),
-    )
+    return FieldDecoder(lambda r1, r2, imm: (
+        Register(r1),
+        Reference(AddExpression(Register(r2), Immediate(imm, 16)), type_),
+    ), (F_REG1, F_REG2, F_IMM16), '{0:reg}, ' + Reference.prefixes[type_] + '::[{1:reg}+{2:hex}]')
 
 decode_reg_reg_const16_s = make_decode_reg_reg_const16(Reference.STACK)
 decode_reg_reg_const16_g = make_decode_reg_reg_const16(Reference.GLOBAL)
 decode_reg_reg_const16_c = make_decode_reg_reg_const16(Reference.CODE)
 decode_reg_reg_const16_u = make_decode_reg_reg_const16(Reference.UNIFIED)
 
-def decode_insn_call(insn):
-    reg = insn[21:26]
-    func_idx = insn[1:21]
-    r = Immediate(insn[0:1], 1, Immediate.CONST_BOOL)
+@fields(F_REG1, F_CALL_IDX, F_CALL_R)
+def decode_insn_call(reg, func_idx, r):
+    r = Immediate(r, 1, Immediate.CONST_BOOL)
     return (Immediate(func_idx, 20), r) if reg == 0 else (Register(reg), r)
 
-def decode_insn_push(insn):
-    reg = insn[21:26]
-    return (Immediate(insn[0:21], 21) if reg == Register.BP else Register(reg)),
+@fields(F_REG1, F_IMM21)
+def decode_insn_push(reg, imm):
+    return (Immediate(imm, 21) if reg == Register.BP else Register(reg)),
 
-def decode_store(insn):
-    val_reg = insn[16:21]
-    base_reg = insn[21:26]
-    imm = insn[0:16]
+@fields(F_REG2, F_REG1, F_IMM16)
+def decode_store(val_reg, base_reg, imm):
     if base_reg == Register.BP:
         dst = Reference(AddExpression(Register(Register.BP), Immediate(imm, 16)), Reference.STACK)
     else:
@@ -88,16 +119,17 @@ def decode_store(insn):
         dst = Reference(Register(base_reg), ref_type)
     return dst, Register(val_reg) if val_reg != Register.SP else Immediate(0, 32)
 
-def decode_decref(insn):
-    reg = insn[21:26]
-    imm = Immediate(insn[0:21], 21)
+@fields(F_REG1, F_IMM21)
+def decode_decref(reg, imm):
+    imm = Immediate(imm, 21)
     rhs = AddExpression(Register(reg), imm) if reg != 30 else imm
     return Reference(AddExpression(Register(Register.BP), rhs), Reference.STACK),
 
-def decode_mov(insn):
-    dst_reg = Register(insn[21:26])
-    src_reg = Register(insn[16:21])
-    imm = Immediate(insn[0:16], 16)
+@fields(F_REG1, F_REG2, F_IMM16)
+def decode_mov(dst_reg, src_reg, imm):
+    dst_reg = Register(dst_reg)
+    src_reg = Register(src_reg)
+    imm = Immediate(imm, 16)
     return dst_reg, AddExpression(src_reg, imm) if imm.val else src_reg
 
 # Operand usage information
@@ -174,4 +206,10 @@ opcodes = [
     ('sub',          decode_reg_reg_reg,       OP_CHG1 | OP_USE2 | OP_USE3),  # 0x37
     ('sub_gc',       decode_reg_reg_reg,       OP_CHG1 | OP_USE2 | OP_USE3),  # 0x38
     ('xor',          decode_reg_reg_reg,       OP_CHG1 | OP_USE2 | OP_USE3),  # 0x39
-]
\ No newline at end of file
+]
+
+# Specialized shift-and-mask decoders for all 64 possible opcodes, generated
+# once from the field layouts above. Undefined opcodes decode without operands.
+NUM_OPCODES = 1 << (F_OPCODE[1] - F_OPCODE[0])
+opcode_decoders = [opcodes[i][1] if i < len(opcodes) else decode_unk for i in range(NUM_OPCODES)]
+raw_decoders = compile_decoders(opcode_decoders)
@@ -0,0 +1,226 @@
+"""
+    Emulator translating hot basic blocks into Python functions.
+
+    The MIT License (MIT)
+
+    Copyright (c) 2015 Joel Hoener <athre0z@zyantific.com>
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy
+    of this software and associated documentation files (the "Software"), to deal
+    in the Software without restriction, including without limitation the rights
+    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the Software is
+    furnished to do so, subject to the following conditions:
+    The above copyright notice and this permission notice shall be included in all
+    copies or substantial portions of the Software.
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+    SOFTWARE.
+"""
+
+
+
+from __future__ import print_function, division
+
+import re
+import sys
+
+from gsdisas.emu import Emulator, VmFault, REGISTER_OPS, UNARY_OPS, _IP_MASK, _MASK, _div, _s32, FIXED_BITS
+
+# Executions of a block entry before it is translated
+HOT_THRESHOLD = 16
+# Instructions per translation at most
+MAX_TRACE_INSNS = 256
+
+# Inline statements of simple handlers, over the decoder fields
+_TEMPLATES = {
+    'add_i21': 'R[{a}] = (R[{a}] + {b}) & 0xFFFFFFFF',
+    'add_lsh11': 'R[{a}] = (R[{a}] + {b_lsh11}) & 0xFFFFFFFF',
+    'mul_i21': 'R[{a}] = (R[{a}] * {b}) & 0xFFFFFFFF',
+    'add_i8': 'R[{a}] = (R[{b}] + {c}) & 0xFFFFFFFF',
+    'mov': 'R[{a}] = (R[{b}] + {c}) & 0xFFFFFFFF',
+    'ld_const_i21': 'R[{a}] = {b}',
+    'shl_r': 'R[{a}] = (R[{a}] << (R[{b}] & 31)) & 0xFFFFFFFF',
+    'shr_r': 'R[{a}] = R[{a}] >> (R[{b}] & 31)',
+    'shl_i8': 'R[{a}] = (R[{a}] << {b_and31}) & 0xFFFFFFFF',
+    'shr_i8': 'R[{a}] = R[{a}] >> {b_and31}',
+    'bp': None,
+    'mkgc': None,
+}
+for _mnem, _expr in REGISTER_OPS.items():
+    _expr = re.sub(r'\by\b', 'R[{b}]', _expr)
+    _expr = re.sub(r'\bx\b', '0' if _mnem in UNARY_OPS else 'R[{c}]', _expr)
+    _TEMPLATES[_mnem] = 'R[{a}] = (' + _expr + ') & 0xFFFFFFFF'
+# Inlined handlers that may fault
+_FAULTING = frozenset(('div', 'mod', 'fdiv'))
+# Handlers ending a translation, besides branches. Natives may patch code.
+_EXITS = frozenset(('retn', 'call', None))
+
+
+class TranslatingEmulator(Emulator):
+    """
+    Emulator translating hot code into Python functions. Blocks are
+    interpreted until their entry executed HOT_THRESHOLD times, then traced
+    into a single function inlining register operations and following
+    unconditional jumps, with branches back to the trace's entry compiled
+    into a loop. Other exits return to a dispatcher indexing translations
+    by instruction, so no decoding or hashing happens between blocks.
+
+    Translations covering instructions patched by `write_code` are dropped.
+    Traces only run while at least MAX_TRACE_INSNS steps remain, the last
+    ones before `max_steps` being interpreted. A fault inside a trace counts
+    the steps before the faulting instruction, like `Emulator.run` does.
+    """
+    def __init__(self, buf, natives=None, hot_threshold=HOT_THRESHOLD, **kwargs):
+        super(TranslatingEmulator, self).__init__(buf, natives, **kwargs)
+        self.hot_threshold = hot_threshold
+        self.translations = 0
+        self._names = dict((handler, mnem) for mnem, handler in self._handlers.items())
+        self._blocks = [None] * len(self.code)
+        self._heat = [0] * len(self.code)
+        self._spans = {}
+        self._ends = [self._ends_block(entry) for entry in self.code]
+        # Steps a faulting trace took, set before the fault propagates
+        self._fault_steps = [0]
+
+    def _ends_block(self, entry):
+        name = self._names.get(entry[0])
+        return name in _EXITS or name in ('jz', 'jnz', 'jmp')
+
+    def invalidate(self, start, stop):
+        for i in range(start, stop):
+            self._ends[i] = self._ends_block(self.code[i])
+        for entry, covered in list(self._spans.items()):
+            if any(start <= i < stop for i in covered):
+                del self._spans[entry]
+                self._blocks[entry] = None
+                self._heat[entry] = 0
+
+    def _translate(self, entry):
+        """Compiles the trace starting at instruction `entry`."""
+        code = self.code
+        namespace = {
+            'regs': self.regs, 'objects': self.objects, 'VmFault': VmFault,
+            '_div': _div, '_s32': _s32, '_MASK': _MASK, 'FIXED_BITS': FIXED_BITS,
+            'fault_steps': self._fault_steps,
+        }
+        handler_names = {}
+        body = []
+        covered = []
+        ip = entry
+
+        def emit(line, depth=0):
+            body.append('    ' * (depth + 3) + line)
+
+        def leave(target, count, depth=0):
+            if target == entry:
+                emit('n += {}'.format(count), depth)
+                emit('if n > budget - {}:'.format(MAX_TRACE_INSNS), depth)
+                emit('    return {}, n'.format(entry), depth)
+                emit('continue', depth)
+            else:
+                emit('return {}, n + {}'.format(target, count), depth)
+
+        while True:
+            covered.append(ip)
+            handler, a, b, c = code[ip]
+            name = self._names.get(handler)
+            count = len(covered)
+            if name in ('jz', 'jnz'):
+                taken = (ip + 1 + b) & _IP_MASK
+                emit('if R[{}] {} 0:'.format(a, '==' if name == 'jz' else '!='))
+                leave(taken, count, 1)
+                ip += 1
+            elif name == 'jmp':
+                ip = (ip + 1 + a) & _IP_MASK
+            elif name in _TEMPLATES and name not in _EXITS:
+                template = _TEMPLATES[name]
+                if name in _FAULTING:
+                    emit('_i = {}'.format(ip))
+                if template is not None:
+                    emit(template.format(a=a, b=b, c=c, b_lsh11=b << 11, b_and31=b & 31))
+                ip += 1
+            else:
+                fn = handler_names.get(handler)
+                if fn is None:
+                    fn = handler_names[handler] = 'H{}'.format(len(handler_names))
+                    namespace[fn] = handler
+                emit('_i = {}'.format(ip))
+                call = '{}({}, {}, {}, {})'.format(fn, a, b, c, ip)
+                if name in _EXITS:
+                    emit('return {}, n + {}'.format(call, count))
+                    break
+                emit(call)
+                ip += 1
+            if ip == entry or ip in covered or not 0 <= ip < len(code) or len(covered) >= MAX_TRACE_INSNS:
+                leave(ip, count)
+                break
+
+        source = (
+            'def block(budget):\n'
+            '    R = regs\n'
+            '    n = 0\n'
+            '    _i = {0}\n'
+            '    try:\n'
+            '        while True:\n'
+            '{1}\n'
+            '    except VmFault as e:\n'
+            '        if e.ip is None:\n'
+            '            e.ip = _i\n'
+            '        fault_steps[0] = n + positions[_i]\n'
+            '        raise\n'.format(entry, '\n'.join(body))
+        )
+        # Instructions occur once per trace, so their position in it is the
+        # number of steps taken before them in the current iteration.
+        namespace['positions'] = dict((i, pos) for pos, i in enumerate(covered))
+        exec(compile(source, '<gsvm-block-{}>'.format(entry), 'exec'), namespace)
+        self._spans[entry] = frozenset(covered)
+        self.translations += 1
+        return namespace['block']
+
+    def run(self, ip, max_steps=None):
+        code = self.code
+        blocks = self._blocks
+        heat = self._heat
+        ends = self._ends
+        threshold = self.hot_threshold
+        limit = sys.maxsize if max_steps is None else max_steps
+        steps = 0
+        try:
+            while ip >= 0 and steps < limit:
+                block = blocks[ip]
+                if block is None:
+                    heat[ip] += 1
+                    if heat[ip] >= threshold:
+                        blocks[ip] = self._translate(ip)
+                        continue
+                elif limit - steps >= MAX_TRACE_INSNS:
+                    try:
+                        ip, count = block(limit - steps)
+                    except VmFault:
+                        steps += self._fault_steps[0]
+                        raise
+                    steps += count
+                    continue
+                while steps < limit:
+                    handler, a, b, c = code[ip]
+                    end = ends[ip]
+                    ip = handler(a, b, c, ip)
+                    steps += 1
+                    if end or ip < 0:
+                        break
+        except VmFault as e:
+            if e.ip is None:
+                e.ip = ip
+            raise
+        except IndexError:
+            if 0 <= ip < len(code):
+                raise
+            raise VmFault('e_badJump', ip)
+        finally:
+            self.steps += steps
+        return ip
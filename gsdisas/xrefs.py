@@ -0,0 +1,124 @@
+"""
+    Cross-reference indexing for GalaxyScript code segments.
+
+    The MIT License (MIT)
+
+    Copyright (c) 2015 Joel Hoener <athre0z@zyantific.com>
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy
+    of this software and associated documentation files (the "Software"), to deal
+    in the Software without restriction, including without limitation the rights
+    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the Software is
+    furnished to do so, subject to the following conditions:
+    The above copyright notice and this permission notice shall be included in all
+    copies or substantial portions of the Software.
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+    SOFTWARE.
+"""
+
+
+from __future__ import print_function, division
+
+import numpy as np
+
+from gsdisas.batch import INSN_SIZE, NO_TARGET
+from gsdisas.tables import (
+    opcodes, NUM_OPCODES, decode_reg_glob, decode_reg_gref21, decode_reg_reg_const16_g, decode_insn_call
+)
+
+# Cross-reference kinds and what their keys denote
+XREF_GLOBAL = 0  # global address referenced by an immediate (ld_global32i, ld_global8i)
+XREF_STRING = 1  # global address of string data (mkstr)
+XREF_GLOBAL_DISP = 2  # displacement of register based global accesses (ld_global32, ld_global8, unk_36)
+XREF_CODE = 3  # absolute branch target address (jz, jnz, jmp)
+XREF_CALL = 4  # call index of direct calls
+NUM_XREF_KINDS = 5
+
+FORMAT_VERSION = 1
+
+
+def _opcode_mask(decoder):
+    mask = np.zeros(NUM_OPCODES, dtype=bool)
+    for i, cur_opcode in enumerate(opcodes):
+        mask[i] = cur_opcode[1] is decoder
+    return mask
+
+_global_ops = _opcode_mask(decode_reg_glob)
+_string_ops = _opcode_mask(decode_reg_gref21)
+_global_disp_ops = _opcode_mask(decode_reg_reg_const16_g)
+_call_ops = _opcode_mask(decode_insn_call)
+
+
+class XrefIndex(object):
+    """
+    Cross-references of a code segment. For every kind, `keys[kind]` and
+    `sites[kind]` are parallel arrays sorted by key and then referencing
+    address, so lookups are binary searches.
+    """
+    def __init__(self, base, keys, sites):
+        self.base = base
+        self.keys = keys
+        self.sites = sites
+
+    @classmethod
+    def build(cls, insns, base=0):
+        """Builds the index of a batch decoded segment in one pass per kind."""
+        opcode = insns['opcode']
+        addrs = base + np.arange(len(insns), dtype=np.int64) * INSN_SIZE
+        imm21 = insns['imm21'].astype(np.int64)
+
+        direct_call = _call_ops[opcode] & (insns['reg1'] == 0)
+        selections = [
+            (_global_ops[opcode], imm21),
+            (_string_ops[opcode], imm21),
+            (_global_disp_ops[opcode], insns['imm16'].astype(np.int64)),
+            (insns['target'] != NO_TARGET, insns['target']),
+            (direct_call, imm21 >> 1),
+        ]
+        keys = []
+        sites = []
+        for mask, values in selections:
+            cur_keys = values[mask]
+            cur_sites = addrs[mask]
+            order = np.lexsort((cur_sites, cur_keys))
+            keys.append(cur_keys[order])
+            sites.append(cur_sites[order])
+        return cls(base, keys, sites)
+
+    def refs_to(self, kind, key):
+        """Returns the addresses of all instructions referencing `key`."""
+        keys = self.keys[kind]
+        lo, hi = np.searchsorted(keys, [key, key + 1])
+        return self.sites[kind][lo:hi]
+
+    def referenced(self, kind):
+        """Returns the distinct keys referenced by instructions."""
+        return np.unique(self.keys[kind])
+
+    def save(self, f):
+        """Writes the index to a file (name or file object) in NumPy's npz format."""
+        arrays = {'version': np.array([FORMAT_VERSION]), 'base': np.array([self.base])}
+        for kind in range(NUM_XREF_KINDS):
+            arrays['keys_{}'.format(kind)] = self.keys[kind]
+            arrays['sites_{}'.format(kind)] = self.sites[kind]
+        np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, f):
+        with np.load(f) as data:
+            if int(data['version'][0]) != FORMAT_VERSION:
+                raise ValueError('unsupported xref index format version')
+            return cls(
+                int(data['base'][0]),
+                [data['keys_{}'.format(kind)] for kind in range(NUM_XREF_KINDS)],
+                [data['sites_{}'.format(kind)] for kind in range(NUM_XREF_KINDS)],
+            )
+
+    def __repr__(self):
+        return 'XrefIndex(base=0x{:X}, refs={})'.format(self.base, sum(len(x) for x in self.keys))